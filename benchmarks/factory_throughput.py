@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compares the throughput of creating and rendering environments one by one with the 'NsblFactory'.
+
+Usage: python benchmarks/factory_throughput.py [number_of_configs] [max_workers]
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import sys
+import time
+
+from nsbl.factory import NsblFactory
+from nsbl.nsbl import Nsbl
+from nsbl.render_targets import InMemoryRenderTarget
+
+
+def create_config(index):
+
+    return [{"envs": [
+        {"meta": {"name": "group_{}".format(index), "type": "group", "hosts": ["host_a_{}".format(index),
+                                                                             "host_b_{}".format(index)]},
+         "tasks": [{"shell": {"free_form": "echo {}".format(index)}}, "apt"]},
+        {"meta": {"name": "host_c_{}".format(index), "type": "host"},
+         "tasks": [{"file": {"path": "/tmp/{}".format(index), "state": "directory"}}]}
+    ]}]
+
+
+def run_one_by_one(configs):
+
+    for index, config in enumerate(configs):
+        nsbl = Nsbl.create(config, pre_chain=[])
+        nsbl.render("/tmp/nsbl_benchmark_{}".format(index), ask_become_pass="false",
+                    render_target=InMemoryRenderTarget())
+
+
+def run_factory(configs, max_workers):
+
+    factory = NsblFactory()
+    jobs = [(config, "/tmp/nsbl_benchmark_{}".format(index)) for index, config in enumerate(configs)]
+    factory.render_many(jobs, max_workers=max_workers, create_args={"pre_chain": []}, ask_become_pass="false",
+                        render_target_factory=lambda env_dir: InMemoryRenderTarget())
+
+
+def measure(name, func, *args):
+
+    start = time.time()
+    func(*args)
+    duration = time.time() - start
+    print("{:<24} {:8.3f}s {:10.1f} configs/s".format(name, duration, len(args[0]) / duration))
+
+
+if __name__ == "__main__":
+
+    number_of_configs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    configs = [create_config(i) for i in range(number_of_configs)]
+
+    measure("one by one", run_one_by_one, configs)
+    measure("factory (1 worker)", run_factory, configs, 1)
+    measure("factory ({} workers)".format(max_workers), run_factory, configs, max_workers)
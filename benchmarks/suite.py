@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Times the expensive steps of nsbl against a synthetic role repository and configuration, and compares the
+results to stored baselines.
+
+Benchmarks: scanning the role repo ('find_roles_in_repo'), processing the task descriptions
+('calculate_task_descs'), 'Nsbl.create', 'Nsbl.render' (into memory), and the 'NsblLogCallbackAdapter' processing
+a canned event stream.
+
+Usage:
+
+    python benchmarks/suite.py [--scale small] [--save-baseline] [--tolerance 0.3]
+
+Without '--save-baseline', the script exits with 1 if a benchmark is slower than its baseline (plus the
+tolerance).
+
+Absolute timings can't be compared between machines, so every run also times a fixed calibration workload
+(parsing and dumping yaml and json, which doesn't depend on nsbl), and results and baselines are stored relative to
+it. That evens out most of the differences in CPU speed, but not all of them (e.g. different Python or library
+versions), so for a tight tolerance the baselines should be saved again on the machine the benchmarks run on.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import click
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic  # noqa: E402
+from nsbl import defaults, tasks  # noqa: E402
+from nsbl.defaults import calculate_role_repos, calculate_task_descs  # noqa: E402
+from nsbl.nsbl import Nsbl  # noqa: E402
+from nsbl.output import NsblLogCallbackAdapter, forward_log_messages  # noqa: E402
+from nsbl.render_targets import InMemoryRenderTarget  # noqa: E402
+
+# the sizes of the synthetic inputs
+SCALES = {
+    "tiny": {"roles": 20, "hosts": 50, "groups": 5, "events": 500},
+    "small": {"roles": 500, "hosts": 2000, "groups": 20, "events": 20000},
+    "large": {"roles": 3000, "hosts": 10000, "groups": 50, "events": 100000}
+}
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+# number of lines the event adapter gets at once (about what's read from the ansible output in one go)
+EVENT_BATCH_SIZE = 100
+# name of the calibration workload in the results, all other results are stored relative to it
+CALIBRATION_BENCHMARK = "calibration"
+# number of items the calibration workload dumps and parses
+CALIBRATION_ITEMS = 200
+
+
+class NullWriter(object):
+    """Discards the output of the event adapter, so only the processing is timed."""
+
+    def write(self, message=u"", nl=True):
+        pass
+
+    def flush(self):
+        pass
+
+
+def calibrate():
+    """A fixed amount of work that doesn't depend on nsbl, the unit the benchmark results are compared in."""
+
+    data = [{"name": "item_{}".format(index), "vars": {"index": index, "tags": ["a", "b", "c"]}}
+            for index in range(CALIBRATION_ITEMS)]
+    yaml.safe_load(yaml.safe_dump(data, default_flow_style=False))
+    json.loads(json.dumps(data))
+
+
+def clear_caches():
+
+    tasks.ROLE_CACHE.clear()
+    defaults.TASK_DESCS_CACHE.clear()
+
+
+class BenchmarkSuite(object):
+    def __init__(self, work_dir, scale):
+        """Creates the synthetic inputs for the benchmarks.
+
+        Args:
+          work_dir (str): the folder to create the synthetic role repo in
+          scale (dict): the sizes of the inputs (see 'SCALES')
+        """
+
+        self.scale = scale
+        self.role_repo = synthetic.create_role_repo(os.path.join(work_dir, "roles"), scale["roles"])
+        self.role_repos = calculate_role_repos([self.role_repo], use_default_roles=True)
+        self.config = synthetic.create_config(scale["hosts"], scale["groups"], scale["roles"])
+
+        clear_caches()
+        self.nsbl = self.create()
+        self.events = synthetic.create_event_stream(self.nsbl.get_lookup_index(), scale["events"])
+
+    def find_roles(self):
+
+        for role_repo in self.role_repos:
+            tasks.find_roles_in_repo(role_repo)
+
+    def calculate_task_descs(self):
+
+        calculate_task_descs(None, self.role_repos)
+
+    def create(self):
+
+        return Nsbl.create(self.config, self.role_repos, [], pre_chain=[])
+
+    def render(self):
+
+        self.nsbl.render("/tmp/nsbl_bench_env", ask_become_pass="false", render_target=InMemoryRenderTarget())
+
+    def process_events(self):
+
+        adapter = NsblLogCallbackAdapter(self.nsbl.get_lookup_index(), writer=NullWriter())
+        for start in range(0, len(self.events), EVENT_BATCH_SIZE):
+            forward_log_messages(adapter, self.events[start:start + EVENT_BATCH_SIZE])
+        adapter.finish_up()
+
+    def get_benchmarks(self):
+        """Returns (name, setup, function) tuples, the setup function is not timed."""
+
+        return [
+            (CALIBRATION_BENCHMARK, None, calibrate),
+            ("find_roles_in_repo", clear_caches, self.find_roles),
+            ("calculate_task_descs", clear_caches, self.calculate_task_descs),
+            # with the role repo scan and task descriptions cached, only the configuration is processed
+            ("Nsbl.create", None, self.create),
+            ("Nsbl.render", None, self.render),
+            ("event_adapter", None, self.process_events)
+        ]
+
+
+def measure(setup, func, repeats):
+    """Returns the fastest of several runs of a function (after an untimed warm-up run)."""
+
+    durations = []
+    for i in range(repeats + 1):
+        if setup is not None:
+            setup()
+        start = time.time()
+        func()
+        durations.append(time.time() - start)
+
+    return min(durations[1:])
+
+
+def load_baselines(path):
+
+    if not os.path.exists(path):
+        return {}
+    with io.open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baselines(path, baselines):
+
+    with io.open(path, "w", encoding="utf-8") as f:
+        f.write("{}\n".format(json.dumps(baselines, indent=2, sort_keys=True, separators=(",", ": "))))
+
+
+def get_relative_results(results):
+    """Divides the durations of all benchmarks by the duration of the calibration workload.
+
+    Args:
+      results (dict): the durations (including the calibration workload), keyed by benchmark name
+
+    Returns:
+      dict: the relative durations, keyed by benchmark name
+    """
+
+    calibration = results[CALIBRATION_BENCHMARK]
+    return dict((name, duration / calibration) for name, duration in results.items()
+                if name != CALIBRATION_BENCHMARK)
+
+
+def find_regressions(results, baselines, tolerance):
+    """Compares results to their baselines.
+
+    Args:
+      results (dict): the (relative) durations, keyed by benchmark name
+      baselines (dict): the (relative) baseline durations, keyed by benchmark name
+      tolerance (float): how much slower (relative) than its baseline a benchmark may be
+
+    Returns:
+      list: the names of the benchmarks that are too slow
+    """
+
+    return [name for name, duration in sorted(results.items())
+            if name in baselines.keys() and duration > baselines[name] * (1 + tolerance)]
+
+
+def run_suite(scale_name, repeats=3, work_dir=None):
+    """Creates the synthetic inputs for a scale, and runs all benchmarks (and the calibration workload).
+
+    Returns:
+      dict: the durations (in seconds), keyed by benchmark name
+    """
+
+    temp_dir = tempfile.mkdtemp(prefix="nsbl_bench_", dir=work_dir)
+    try:
+        suite = BenchmarkSuite(temp_dir, SCALES[scale_name])
+        return dict((name, measure(setup, func, repeats)) for name, setup, func in suite.get_benchmarks())
+    finally:
+        clear_caches()
+        shutil.rmtree(temp_dir)
+
+
+@click.command()
+@click.option('--scale', type=click.Choice(sorted(SCALES.keys())), default="small", show_default=True,
+              help="the size of the synthetic inputs")
+@click.option('--repeats', type=int, default=3, show_default=True, help="the number of timed runs per benchmark")
+@click.option('--baseline-file', default=DEFAULT_BASELINE_FILE, help="the file the baselines are stored in")
+@click.option('--save-baseline', is_flag=True, default=False, help="store the results as baselines for the scale")
+@click.option('--tolerance', type=float, default=0.3, show_default=True,
+              help="how much slower (relative) than its baseline a benchmark may be")
+def cli(scale, repeats, baseline_file, save_baseline, tolerance):
+    """Runs the benchmarks, and compares the results (relative to the calibration workload) to the baselines."""
+
+    results = run_suite(scale, repeats=repeats)
+    relative_results = get_relative_results(results)
+    baselines = load_baselines(baseline_file)
+    scale_baselines = baselines.get(scale, {})
+
+    click.echo("{:<24} {:8.3f}s".format(CALIBRATION_BENCHMARK, results[CALIBRATION_BENCHMARK]))
+    for name, relative in sorted(relative_results.items()):
+        baseline = scale_baselines.get(name, None)
+        change = "" if not baseline else "{:+7.1f}%".format((relative / baseline - 1) * 100)
+        click.echo("{:<24} {:8.3f}s {:9.2f}x {}".format(name, results[name], relative, change))
+
+    if save_baseline:
+        baselines[scale] = dict((name, round(relative, 4)) for name, relative in relative_results.items())
+        save_baselines(baseline_file, baselines)
+        click.echo("Saved baselines for scale '{}' to: {}".format(scale, baseline_file))
+        return
+
+    regressions = find_regressions(relative_results, scale_baselines, tolerance)
+    if regressions:
+        click.echo("Slower than baseline: {}".format(", ".join(regressions)), err=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""Generates synthetic role repositories, configurations and event streams for the benchmarks."""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import json
+import os
+
+import yaml
+
+from nsbl.defaults import TASK_DESC_DEFAULT_FILENAME
+
+# roles are spread over sub-folders of the role repo, like in most real repos
+ROLES_PER_FOLDER = 50
+
+
+def write_yaml(path, content):
+
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with io.open(path, "wb") as f:
+        f.write(yaml.safe_dump(content, default_flow_style=False, encoding="utf-8", allow_unicode=True))
+
+
+def get_role_name(index):
+
+    return "bench-role-{}".format(index)
+
+
+def get_alias_name(index):
+
+    return "bench-folders-{}".format(index)
+
+
+def create_role_repo(path, number_of_roles):
+    """Creates a role repository with the given number of roles and a task aliases file.
+
+    Every role has a 'meta/main.yml', 'tasks/main.yml' and 'defaults/main.yml'. The task aliases file contains one
+    alias per role that uses a default key and a split key (so every item of its list becomes its own task).
+
+    Args:
+      path (str): the folder to create the role repository in
+      number_of_roles (int): the number of roles
+
+    Returns:
+      str: the path of the role repository
+    """
+
+    for index in range(number_of_roles):
+        role_dir = os.path.join(path, "folder_{}".format(index // ROLES_PER_FOLDER), get_role_name(index))
+        write_yaml(os.path.join(role_dir, "meta", "main.yml"),
+                   {"galaxy_info": {"author": "nsbl", "description": "synthetic role {}".format(index)},
+                    "dependencies": []})
+        write_yaml(os.path.join(role_dir, "tasks", "main.yml"),
+                   [{"name": "synthetic task {}".format(index), "debug": {"msg": "{{ message }}"}}])
+        write_yaml(os.path.join(role_dir, "defaults", "main.yml"), {"message": "role {}".format(index)})
+
+    aliases = []
+    for index in range(number_of_roles):
+        aliases.append({get_alias_name(index): {
+            "meta": {"task-name": "file", "task-desc": "creating folders ({})".format(index), "default-key": "path",
+                     "split-key": "path"},
+            "vars": {"state": "directory"}}})
+    write_yaml(os.path.join(path, TASK_DESC_DEFAULT_FILENAME), aliases)
+
+    return path
+
+
+def create_config(number_of_hosts, number_of_groups, number_of_roles, tasks_per_env=4, number_of_host_envs=5):
+    """Creates a configuration that uses the roles and aliases of a synthetic role repository.
+
+    The hosts are spread over the groups, every group gets its own vars and task list (roles, aliases with a
+    list that's split into several tasks, and plain ansible modules). A few single hosts get their own task
+    lists too.
+
+    Args:
+      number_of_hosts (int): the number of hosts
+      number_of_groups (int): the number of groups
+      number_of_roles (int): the number of roles in the role repository
+      tasks_per_env (int): the number of (role and alias) tasks of every environment
+      number_of_host_envs (int): the number of environments of type 'host'
+
+    Returns:
+      list: the configuration
+    """
+
+    envs = []
+    for group in range(number_of_groups):
+        tasks = []
+        for task in range(tasks_per_env):
+            index = (group * tasks_per_env + task) % number_of_roles
+            if task % 2 == 0:
+                tasks.append({get_role_name(index): {"message": "group {}".format(group)}})
+            else:
+                tasks.append({get_alias_name(index): ["/tmp/nsbl_bench/{}/{}/a".format(group, task),
+                                                      "/tmp/nsbl_bench/{}/{}/b".format(group, task)]})
+        tasks.append({"shell": {"free_form": "echo {}".format(group)}})
+        envs.append({"meta": {"name": "bench_group_{}".format(group), "type": "group",
+                              "hosts": ["bench_host_{}".format(host) for host in
+                                        range(group, number_of_hosts, number_of_groups)]},
+                     "vars": {"group_index": group},
+                     "tasks": tasks})
+
+    for host in range(min(number_of_host_envs, number_of_hosts)):
+        envs.append({"meta": {"name": "bench_host_{}".format(host), "type": "host"},
+                     "vars": {"host_index": host},
+                     "tasks": [get_role_name(host % number_of_roles)]})
+
+    return [{"envs": envs}]
+
+
+def create_event_stream(lookup_index, number_of_events, items_per_task=3):
+    """Creates the output of the 'nsbl_internal' callback for a run of the environments of a lookup index.
+
+    Every role gets a task event, dynamic role tasks get an item event per item as well, until the requested number
+    of events is reached (starting with the first environment again if necessary).
+
+    Args:
+      lookup_index (LookupIndex): the lookup index of the (synthetic) Nsbl object
+      number_of_events (int): the (approximate) number of events
+      items_per_task (int): the number of item events for every dynamic role task
+
+    Returns:
+      list: the (json encoded) event lines
+    """
+
+    roles = {}
+    for (env_id, role_id, task_id) in lookup_index.records.keys():
+        if role_id is None:
+            continue
+        roles.setdefault(env_id, {}).setdefault(role_id, [])
+        if task_id is not None:
+            roles[env_id][role_id].append(task_id)
+
+    lines = []
+    while len(lines) < number_of_events:
+        for env_id in sorted(roles.keys()):
+            lines.append(json.dumps({"category": "play_start", "name": "play {}".format(env_id)}))
+            for role_id in sorted(roles[env_id].keys()):
+                task_ids = sorted(roles[env_id][role_id]) or [None]
+                for task_id in task_ids:
+                    event = {"_env_id": env_id, "_role_id": role_id, "name": "task", "action": "debug",
+                             "status": "ok", "skipped": False}
+                    if task_id is not None:
+                        event["_dyn_task_id"] = task_id
+                        for item in range(items_per_task):
+                            lines.append(json.dumps(dict(event, category="item_ok", item="item_{}".format(item),
+                                                         status="changed")))
+                    lines.append(json.dumps(dict(event, category="ok", msg="done", stdout_lines=["output"])))
+            if len(lines) >= number_of_events:
+                break
+
+    return lines
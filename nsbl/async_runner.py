@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import logging
+import signal
+import subprocess
+import threading
+
+from builtins import *
+
+from .defaults import *
+from .exceptions import NsblException
+from .nsbl import create_callback_adapter, start_new_session
+from .output import forward_log_messages, iter_line_batches
+
+log = logging.getLogger("nsbl")
+
+
+class NsblRun(object):
+    def __init__(self, nsbl, target, consumer, render_args, run_env=None, pre_run_callback=None,
+                 done_callback=None):
+        """Handle for a single, non-blocking ansible run, created by 'AsyncNsblRunner.start'.
+
+        The environment is rendered and run in a background thread. Every line the run prints to stdout is
+        forwarded to the 'add_log_message' method of the consumer (or, in batches, to 'add_log_messages', if the
+        consumer has that method), every line on stderr to 'add_error_message', and 'finish_up' is called once
+        the run is finished. So any 'NsblLogCallbackAdapter'-compatible object
+        can be used as consumer. Those methods are called from the background threads of this run, one at
+        a time.
+
+        Args:
+          nsbl (Nsbl): the Nsbl object holding the (processed) configuration
+          target (str): the target directory where the ansible environment should be rendered
+          consumer (object): the object the output of the run is forwarded to
+          render_args (dict): the keyword arguments for the 'Nsbl.render' call
+          run_env (dict): the environment variables for the ansible run (defaults to the ones of this process)
+          pre_run_callback (function): a callback to execute after the environment is rendered, but before the run is kicked off
+          done_callback (function): a callback that gets called (with this object as argument) once the run is finished
+        """
+
+        self.nsbl = nsbl
+        self.target = target
+        self.consumer = consumer
+        self.render_args = render_args
+        self.run_env = run_env
+        self.pre_run_callback = pre_run_callback
+        self.done_callback = done_callback
+
+        self.parameters = None
+        self.return_code = None
+        self.error = None
+        self.cancelled = False
+
+        self._proc = None
+        self._lock = threading.Lock()
+        self._consumer_lock = threading.Lock()
+        self._finished = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="nsbl-run-{}".format(id(self)))
+        self._thread.daemon = True
+
+    def start(self):
+
+        self._thread.start()
+        return self
+
+    def done(self):
+        """Returns whether the run is finished (successful or not)."""
+
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """Waits for the run to finish.
+
+        Args:
+          timeout (float): the maximum time to wait, in seconds (None to wait until the run is finished)
+
+        Returns:
+          int: the return code of the run, or None if the run is not finished yet, or didn't start a process
+        """
+
+        self._finished.wait(timeout)
+        return self.return_code
+
+    def cancel(self):
+        """Cancels the run, killing the process group of the ansible run if it already started.
+
+        Returns:
+          bool: whether the run was cancelled (False if it was already finished)
+        """
+
+        with self._lock:
+            if self.done():
+                return False
+            self.cancelled = True
+            proc = self._proc
+
+        if proc is not None and proc.poll() is None:
+            log.debug("Cancelling ansible run (process group: {})".format(proc.pid))
+            try:
+                # the run got its own session, so its process group id is its pid
+                os.killpg(proc.pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+        return True
+
+    def _forward_errors(self, stream):
+
+        for line in iter(stream.readline, b""):
+            with self._consumer_lock:
+                self.consumer.add_error_message(line)
+        stream.close()
+
+    def _forward_log(self, stream):
+
+        for lines in iter_line_batches(stream):
+            with self._consumer_lock:
+                forward_log_messages(self.consumer, lines)
+        stream.close()
+
+    def _run(self):
+
+        try:
+            self.parameters = self.nsbl.render(self.target, extract_vars=True, **self.render_args)
+
+            if self.parameters["ask_become_pass"]:
+                raise NsblException(
+                    "Can't ask for a sudo password in a non-interactive run, use 'ask_become_pass=False'.")
+
+            if self.pre_run_callback:
+                self.pre_run_callback(self.parameters["env_dir"])
+
+            run_env = self.run_env
+            if run_env is None:
+                run_env = os.environ.copy()
+            if self.render_args.get("callback", "").startswith("nsbl_internal"):
+                run_env['NSBL_ENVIRONMENT'] = "true"
+
+            with self._lock:
+                if self.cancelled:
+                    log.debug("Run cancelled before ansible was started.")
+                    return
+                self._proc = subprocess.Popen([self.parameters["run_playbooks_script"]], stdout=subprocess.PIPE,
+                                              stderr=subprocess.PIPE, stdin=subprocess.PIPE, env=run_env,
+                                              preexec_fn=start_new_session)
+            self._proc.stdin.close()
+
+            stderr_thread = threading.Thread(target=self._forward_errors, args=(self._proc.stderr,))
+            stderr_thread.daemon = True
+            stderr_thread.start()
+            self._forward_log(self._proc.stdout)
+            stderr_thread.join()
+
+            self.return_code = self._proc.wait()
+            self.parameters["return_code"] = self.return_code
+            with self._consumer_lock:
+                self.consumer.finish_up()
+
+        except Exception as e:
+            log.debug("Ansible run failed: {}".format(e), exc_info=True)
+            self.error = e
+        finally:
+            with self._lock:
+                self._finished.set()
+            if self.done_callback:
+                try:
+                    self.done_callback(self)
+                except Exception as e:
+                    log.warning("Error in callback after ansible run: {}".format(e))
+
+
+class AsyncNsblRunner(object):
+    def __init__(self, nsbl):
+        """Class to kick off rendering and running the ansible environment in question, without blocking.
+
+        In contrast to the 'NsblRunner', every call to 'start' returns immediately with a 'NsblRun' handle. Any
+        number of runs can be in progress at the same time, each one streams its output to its own consumer.
+        To integrate with an event loop, use a 'done_callback' that hands the finished run back to the loop.
+
+        Args:
+          nsbl (Nsbl): the Nsbl object holding the (processed) configuration
+        """
+
+        self.nsbl = nsbl
+        self.runs = []
+
+    def start(self, target, consumer=None, force=True, ansible_verbose="", ask_become_pass=False, extra_plugins=None,
+              callback=None, add_timestamp_to_env=False, add_symlink_to_env=False, display_sub_tasks=True,
+              display_skipped_tasks=True, display_ignore_tasks=[], run_env=None, pre_run_callback=None,
+              done_callback=None):
+        """Renders and runs the environment in the background.
+
+        Args:
+          target (str): the target directory where the ansible environment should be rendered
+          consumer (object): a 'NsblLogCallbackAdapter'-compatible object that receives the output of the run, if not specified one is created according to the callback
+          force (bool): whether to overwrite potentially existing files at the target (most likely an old rendered ansible environment)
+          ansible_verbose (str): verbosity arguments to ansible-playbook command
+          ask_become_pass (str): whether to check if a sudo password is needed (the run fails if one is, as there is no way to ask for it)
+          extra_plugins (str): a repository of extra ansible plugins to use
+          callback (str): the callback to use for the ansible run. default is 'default'
+          add_timestamp_to_env (bool): whether to append a timestamp to the run directory (default: False)
+          add_symlink_to_env (str): whether to add a symlink to the run directory - default: False, otherwise path to symlink
+          display_sub_tasks (bool): whether to display subtasks in the output (not applicable for all callbacks)
+          display_skipped_tasks (bool): whether to display skipped tasks in the output (not applicable for all callbacks)
+          display_ignore_tasks (list): a list of strings that indicate task titles that should be ignored when displaying the task log
+          run_env (dict): the environment variables for the ansible run (defaults to the ones of this process)
+          pre_run_callback (function): a callback to execute after the environment is rendered, but before the run is kicked off
+          done_callback (function): a callback that gets called (with the NsblRun object as argument) once the run is finished
+
+        Returns:
+          NsblRun: the handle of the (already started) run
+        """
+
+        if callback == None:
+            callback = "default"
+
+        if consumer is None:
+            consumer = create_callback_adapter(self.nsbl, callback, display_sub_tasks=display_sub_tasks,
+                                               display_skipped_tasks=display_skipped_tasks,
+                                               display_ignore_tasks=display_ignore_tasks)
+
+        render_args = {"force": force, "ansible_args": ansible_verbose, "ask_become_pass": ask_become_pass,
+                       "extra_plugins": extra_plugins, "callback": callback,
+                       "add_timestamp_to_env": add_timestamp_to_env, "add_symlink_to_env": add_symlink_to_env}
+
+        run = NsblRun(self.nsbl, target, consumer, render_args, run_env=run_env, pre_run_callback=pre_run_callback,
+                      done_callback=done_callback)
+        self.runs.append(run)
+
+        return run.start()
+
+    def wait_all(self, timeout=None):
+        """Waits for all runs that were started by this runner.
+
+        Args:
+          timeout (float): the maximum time to wait for each run, in seconds (None to wait until all runs are finished)
+
+        Returns:
+          list: the return codes of all runs, in the order they were started
+        """
+
+        return [run.wait(timeout) for run in self.runs]
+
+    def cancel_all(self):
+        """Cancels all runs of this runner that are not finished yet."""
+
+        for run in self.runs:
+            run.cancel()
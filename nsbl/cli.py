@@ -6,19 +6,21 @@ import sys
 
 import click
 import click_log
-import yaml
 
 from . import __version__ as VERSION
 from .defaults import *
-from .inventory import NsblInventory
-from .nsbl import Nsbl
-from .tasks import NsblTasks
+from .exceptions import NsblException
+
+# the modules that do the actual work (and pull in frkl, jinja2, cookiecutter, ...) are only imported by the
+# commands that need them, so the cli starts fast for '--version', '--help' and the simple commands
 
 logger = logging.getLogger('nsbl')
 
 
 def output(python_object, format="raw", pager=False):
     if format == 'yaml':
+        import yaml
+
         output_string = yaml.safe_dump(python_object, default_flow_style=False, encoding='utf-8', allow_unicode=True)
     elif format == 'json':
         output_string = json.dumps(python_object, sort_keys=4, indent=4)
@@ -48,9 +50,24 @@ def cli(ctx, version, role_repo, task_desc):
         click.echo(VERSION)
         sys.exit(0)
 
-    ctx.obj = {}
-    ctx.obj['role-repos'] = calculate_role_repos(role_repo, use_default_roles=True)
-    ctx.obj['task-desc'] = calculate_task_descs(task_desc, ctx.obj['role-repos'])
+    ctx.obj = {"role-repo-args": list(role_repo), "task-desc-args": list(task_desc)}
+
+
+def get_role_repos_and_task_descs(ctx):
+    """Returns the role repos and task descriptions for the command, they are only calculated once they are needed.
+
+    Args:
+      ctx (click.Context): the context of the command
+
+    Returns:
+      tuple: a tuple of the role repos (list) and the task descriptions (list)
+    """
+
+    if 'role-repos' not in ctx.obj:
+        ctx.obj['role-repos'] = calculate_role_repos(ctx.obj['role-repo-args'], use_default_roles=True)
+        ctx.obj['task-desc'] = calculate_task_descs(ctx.obj['task-desc-args'], ctx.obj['role-repos'])
+
+    return (ctx.obj['role-repos'], ctx.obj['task-desc'])
 
 
 @cli.command('list-groups')
@@ -61,6 +78,8 @@ def cli(ctx, version, role_repo, task_desc):
 def list_groups(ctx, config, format, pager):
     """Lists all groups and their variables"""
 
+    from .inventory import NsblInventory
+
     inventory = NsblInventory.create(config)
     if inventory.groups:
         output(inventory.groups, format)
@@ -74,6 +93,8 @@ def list_groups(ctx, config, format, pager):
 def list_hosts(ctx, config, format, pager):
     """Lists all hosts and their variables"""
 
+    from .inventory import NsblInventory
+
     inventory = NsblInventory.create(config)
     if inventory.hosts:
         output(inventory.hosts, format)
@@ -87,7 +108,10 @@ def list_hosts(ctx, config, format, pager):
 def list_roles(ctx, config, format, pager):
     """Lists all roles from a task list"""
 
-    tasks = NsblTasks.create(config, ctx.obj['role-repos'], ctx.obj['task-desc'])
+    from .tasks import NsblTasks
+
+    role_repos, task_descs = get_role_repos_and_task_descs(ctx)
+    tasks = NsblTasks.create(config, role_repos, task_descs)
     result = []
     for role in tasks.roles:
         result.append(role.details())
@@ -127,6 +151,8 @@ def list_roles(ctx, config, format, pager):
 def extract_inventory(ctx, config, target):
     """Creates an ansible inventory folder with in inventory file, and all group and host vars folders"""
 
+    from .inventory import NsblInventory
+
     inventory = NsblInventory.create(config)
 
     # if static:
@@ -144,6 +170,8 @@ def extract_inventory(ctx, config, target):
 def print_inventory(ctx, config, pager):
     """Prints the assembled inventory file, containing hosts, groups and subgroups"""
 
+    from .inventory import NsblInventory
+
     inventory = NsblInventory.create(config)
 
     inv_string = inventory.get_inventory_config_string()
@@ -157,7 +185,10 @@ def print_inventory(ctx, config, pager):
 def print_available_tasks(ctx, pager, format):
     """Prints all available tasks included in the included (or specified) task-desc files"""
 
-    nsbl = Nsbl.create([], ctx.obj['role-repos'], ctx.obj['task-desc'])
+    from .nsbl import Nsbl
+
+    role_repos, task_descs = get_role_repos_and_task_descs(ctx)
+    nsbl = Nsbl.create([], role_repos, task_descs)
     int_tasks = nsbl.task_descs
     output(int_tasks, format, pager)
 
@@ -170,6 +201,8 @@ def print_available_tasks(ctx, pager, format):
 def expand_packages(ctx, config, pager, format):
     """Creates an expanded list of packages out of a package list (for debugging purposes)"""
 
+    from frkl import frkl
+
     frkl_format = {"child_marker": "packages",
                    "default_leaf": "vars",
                    "default_leaf_key": "name",
@@ -191,7 +224,10 @@ def expand_packages(ctx, config, pager, format):
 @click.option('--force', '-f', is_flag=True, help="delete potentially existing target directory", default=False)
 @click.pass_context
 def create(ctx, config, target, force):
-    nsbl = Nsbl.create(config, ctx.obj['role-repos'], ctx.obj['task-desc'])
+    from .nsbl import Nsbl
+
+    role_repos, task_descs = get_role_repos_and_task_descs(ctx)
+    nsbl = Nsbl.create(config, role_repos, task_descs)
 
     nsbl.render(target, extract_vars=True, force=force, ansible_args="", callback='default')
     # for play, tasks in result["plays"].items():
@@ -201,5 +237,56 @@ def create(ctx, config, target, force):
     # nsbl.render_environment(target, extract_vars=static, force=force, ansible_verbose="")
 
 
+@cli.command('run')
+@click.argument('config', required=True, nargs=-1)
+@click.option('--target', '-t',
+              help="target output directory of created ansible environment, defaults to 'nsbl_env' in the current directory",
+              default="nsbl_env")
+@click.option('--force', '-f', is_flag=True, help="delete potentially existing target directory", default=False)
+@click.option('--ask-become-pass', type=click.Choice(['true', 'false', 'auto']), default='auto',
+              help="whether to ask for the sudo password (default: auto)")
+@click.option('--parallel', is_flag=True, default=False,
+              help="run the plays of environments that don't share hosts in parallel")
+@click.option('--progress-format', type=click.Choice(PROGRESS_FORMATS), default='text',
+              help="'text' to display the progress in the terminal, 'jsonl' to write one json record per finished env/role/task/item")
+@click.option('--progress-fd', type=int, default=None,
+              help="file descriptor to write the 'jsonl' progress records to (default: stdout)")
+@click.pass_context
+def run(ctx, config, target, force, ask_become_pass, parallel, progress_format, progress_fd):
+    """Creates the ansible environment for a configuration, and runs it"""
+
+    from .nsbl import Nsbl, NsblRunner
+
+    role_repos, task_descs = get_role_repos_and_task_descs(ctx)
+    nsbl = Nsbl.create(config, role_repos, task_descs)
+    try:
+        result = NsblRunner(nsbl).run(target, force=force, ask_become_pass=ask_become_pass, callback="nsbl_internal",
+                                      parallel=parallel, progress_format=progress_format, progress_file=progress_fd)
+    except NsblException as e:
+        raise click.ClickException("{}".format(e))
+
+    return_code = result.get("return_code", 1) if result else 1
+    if return_code:
+        sys.exit(return_code)
+
+
+@cli.command('replay')
+@click.argument('run_dir', required=True, nargs=1)
+@click.option('--display-sub-tasks/--no-display-sub-tasks', default=True, help="whether to display subtasks")
+@click.option('--display-skipped-tasks/--no-display-skipped-tasks', default=True,
+              help="whether to display skipped tasks")
+@click.pass_context
+def replay(ctx, run_dir, display_sub_tasks, display_skipped_tasks):
+    """Displays the output of a past run again, using the event log in its run folder"""
+
+    from .event_log import replay_event_log
+
+    try:
+        replay_event_log(os.path.expanduser(run_dir), display_sub_tasks=display_sub_tasks,
+                         display_skipped_tasks=display_skipped_tasks)
+    except NsblException as e:
+        raise click.ClickException("{}".format(e))
+
+
 if __name__ == "__main__":
     cli()
@@ -5,7 +5,7 @@ import sys
 
 import click
 import click_log
-import frkl
+from frkl import frkl
 import yaml
 
 from . import __version__ as VERSION
@@ -183,7 +183,7 @@ def create(ctx, config, target, static, force):
     init_params = {"task_descs": ctx.obj['task-desc'], "role_repos": ctx.obj["role-repos"]}
     nsbl = Nsbl(init_params)
 
-    nsbl_frkl = frkl.Frkl(config, NSBL_INVENTORY_BOOTSTRAP_CHAIN)
+    nsbl_frkl = frkl.Frkl(config, get_inventory_bootstrap_chain())
     result = nsbl_frkl.process(nsbl)
 
     nsbl.render("/tmp/test_env", extract_vars=static, force=force, ansible_args="", callback='default')
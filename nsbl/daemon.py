@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import importlib
+import io
+import json
+import logging
+import os
+import socket
+import sys
+import time
+import traceback
+
+from six import binary_type
+from six.moves import socketserver
+
+# this module is also the client, which has to start fast: nothing else of nsbl is imported at module level
+
+log = logging.getLogger("nsbl")
+
+# the unix socket the daemon listens on, if not specified otherwise
+DAEMON_SOCKET_PATH = os.environ.get("NSBL_DAEMON_SOCKET", os.path.expanduser("~/.nsbl/daemon.sock"))
+# seconds the daemon keeps the result of scanning role repos for roles, before it scans them again
+DAEMON_CACHE_MAX_AGE = 60
+# seconds the client waits for the daemon to accept a connection, before running the command itself
+DAEMON_CONNECT_TIMEOUT = 1
+
+# the programs the daemon can run, and their (click) entry points
+DAEMON_PROGRAMS = {
+    "nsbl": ("nsbl.cli", "cli"),
+    "nsbl-playbook": ("nsbl.playbook_cli", "cli"),
+    "nsbl-tasks": ("nsbl.tasks_cli", "cli"),
+    "nsbl-inventory": ("nsbl.inventory_cli", "main")
+}
+# the 'nsbl' sub-commands that don't need a terminal (or user input), and can be run by the daemon
+DAEMON_NSBL_COMMANDS = ["list-groups", "list-hosts", "list-roles", "create-inventory", "print-inventory",
+                        "print-available-tasks", "expand-packages", "create-environment"]
+
+
+def get_entry_point(program):
+    """Returns the (click) command of one of the nsbl programs.
+
+    Args:
+      program (str): the name of the program (one of the keys of 'DAEMON_PROGRAMS')
+
+    Returns:
+      click.Command: the command
+    """
+
+    module_name, attr = DAEMON_PROGRAMS[program]
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def get_unsupported_reason(program, argv):
+    """Checks whether the daemon can run a command.
+
+    Commands that run ansible, or might ask for user input, need the terminal of the user, so they are always run by
+    the client.
+
+    Args:
+      program (str): the name of the program
+      argv (list): the arguments of the command
+
+    Returns:
+      str: the reason the daemon can't run the command, or None if it can
+    """
+
+    if program not in DAEMON_PROGRAMS.keys():
+        return "unknown program '{}'".format(program)
+    if program == "nsbl-inventory" or "--help" in argv or "--version" in argv:
+        return None
+
+    command = get_entry_point(program)
+    ctx = command.make_context(program, list(argv), resilient_parsing=True)
+    if program == "nsbl":
+        sub_command = (ctx.protected_args + ctx.args)[:1]
+        if sub_command and sub_command[0] not in DAEMON_NSBL_COMMANDS:
+            return "'{}' needs a terminal".format(sub_command[0])
+    elif program == "nsbl-playbook":
+        if not ctx.params.get("no_run", False):
+            return "running plays needs a terminal"
+    else:
+        return "'{}' needs a terminal".format(program)
+
+    return None
+
+
+class DaemonStream(object):
+    def __init__(self, send, name):
+        """A file-like object that sends everything that is written to it to the client.
+
+        Args:
+          send (function): the function that sends a message to the client
+          name (str): the name of the stream ('stdout' or 'stderr')
+        """
+
+        self.send = send
+        self.name = name
+        self.encoding = "utf-8"
+
+    def write(self, text):
+
+        if isinstance(text, binary_type):
+            text = text.decode("utf-8", "replace")
+        if text:
+            self.send({self.name: text})
+
+    def writelines(self, lines):
+
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+
+        pass
+
+    def isatty(self):
+
+        return False
+
+    def fileno(self):
+
+        raise io.UnsupportedOperation("fileno")
+
+
+class NsblDaemonHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+        except (ValueError) as e:
+            self.send({"stderr": "Invalid request: {}\n".format(e), "exit_code": 1})
+            return
+
+        if request.get("command", None) == "stop":
+            self.send({"exit_code": 0})
+            self.server.stopped = True
+            return
+
+        program = request["program"]
+        argv = request["argv"]
+        # the verbosity option of a command changes the level of the logger, which must not stick
+        old_level = log.level
+        try:
+            try:
+                reason = get_unsupported_reason(program, argv)
+            except (Exception) as e:
+                reason = "can't parse arguments: {}".format(e)
+            if reason is not None:
+                log.debug("Not running '{} {}': {}".format(program, " ".join(argv), reason))
+                self.send({"fallback": reason})
+                return
+
+            exit_code = self.server.run_command(program, argv, request.get("cwd", None), self.send)
+        finally:
+            log.setLevel(old_level)
+        self.send({"exit_code": exit_code})
+
+    def send(self, message):
+
+        self.wfile.write("{}\n".format(json.dumps(message)).encode("utf-8"))
+        self.wfile.flush()
+
+
+class NsblDaemon(socketserver.UnixStreamServer):
+    def __init__(self, socket_path=DAEMON_SOCKET_PATH, cache_max_age=DAEMON_CACHE_MAX_AGE):
+        """A server that runs nsbl commands for 'nsbl-client', so they don't have to pay for a cold start every time.
+
+        The daemon keeps all modules imported, as well as the processed task descriptions (see
+        'calculate_task_descs', which notices changed files) and the roles found in role repos (which are scanned
+        again once they are older than 'cache_max_age'). Requests are handled one after the other, in the working
+        directory of the client. Only commands that don't run ansible (and don't need user input) are run by the
+        daemon, the client runs all other commands itself.
+
+        Args:
+          socket_path (str): the path of the unix socket to listen on
+          cache_max_age (float): seconds the roles found in role repos are cached for
+        """
+
+        self.socket_path = os.path.expanduser(socket_path)
+        self.cache_max_age = cache_max_age
+        self.cache_time = time.time()
+        self.stopped = False
+
+        socket_dir = os.path.dirname(self.socket_path)
+        if socket_dir and not os.path.exists(socket_dir):
+            os.makedirs(socket_dir, 0o700)
+        if os.path.exists(self.socket_path):
+            sock = connect(self.socket_path)
+            if sock is not None:
+                sock.close()
+                from .exceptions import NsblException
+
+                raise NsblException("Daemon already running on socket: {}".format(self.socket_path))
+            os.remove(self.socket_path)
+
+        # only the current user is allowed to connect
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, self.socket_path, NsblDaemonHandler)
+        finally:
+            os.umask(umask)
+
+    def warm_up(self):
+        """Imports all entry points, and processes the default role repo and task descriptions."""
+
+        from .defaults import calculate_role_repos, calculate_task_descs
+        from .tasks import find_roles_in_repo
+
+        for program in DAEMON_PROGRAMS.keys():
+            get_entry_point(program)
+        role_repos = calculate_role_repos([], use_default_roles=True)
+        for role_repo in role_repos:
+            find_roles_in_repo(role_repo)
+        calculate_task_descs(None, role_repos)
+
+    def expire_caches(self):
+
+        from . import tasks
+
+        if time.time() - self.cache_time > self.cache_max_age:
+            tasks.ROLE_CACHE.clear()
+            self.cache_time = time.time()
+
+    def run_command(self, program, argv, cwd, send):
+        """Runs a command, with its output sent to the client.
+
+        Args:
+          program (str): the name of the program
+          argv (list): the arguments of the command
+          cwd (str): the working directory of the client
+          send (function): the function that sends a message to the client
+
+        Returns:
+          int: the exit code of the command
+        """
+
+        self.expire_caches()
+
+        old_cwd = os.getcwd()
+        old_streams = (sys.stdin, sys.stdout, sys.stderr)
+        exit_code = 0
+        try:
+            if cwd:
+                os.chdir(cwd)
+            sys.stdin = io.StringIO()
+            sys.stdout = DaemonStream(send, "stdout")
+            sys.stderr = DaemonStream(send, "stderr")
+            get_entry_point(program).main(args=list(argv), prog_name=program)
+        except (SystemExit) as e:
+            if e.code is None:
+                exit_code = 0
+            elif isinstance(e.code, int):
+                exit_code = e.code
+            else:
+                sys.stderr.write("{}\n".format(e.code))
+                exit_code = 1
+        except (Exception):
+            sys.stderr.write(traceback.format_exc())
+            exit_code = 1
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = old_streams
+            os.chdir(old_cwd)
+
+        return exit_code
+
+    def serve(self):
+        """Handles requests until a client asks the daemon to stop."""
+
+        try:
+            while not self.stopped:
+                self.handle_request()
+        finally:
+            self.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def connect(socket_path=DAEMON_SOCKET_PATH, timeout=DAEMON_CONNECT_TIMEOUT):
+    """Connects to a daemon.
+
+    Args:
+      socket_path (str): the path of the unix socket the daemon listens on
+      timeout (float): seconds to wait for the daemon to accept the connection
+
+    Returns:
+      socket.socket: the connected socket, or None if no daemon is listening on it
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(os.path.expanduser(socket_path))
+    except (socket.error, OSError):
+        sock.close()
+        return None
+    sock.settimeout(None)
+    return sock
+
+
+def send_request(request, socket_path=DAEMON_SOCKET_PATH, stdout=None, stderr=None):
+    """Sends a request to a daemon, and writes the output of the command to stdout and stderr.
+
+    Args:
+      request (dict): the request
+      socket_path (str): the path of the unix socket the daemon listens on
+      stdout (file): the (binary) file to write the output of the command to, defaults to the one of this process
+      stderr (file): the (binary) file to write the errors of the command to, defaults to the one of this process
+
+    Returns:
+      int: the exit code of the command, or None if the command was not run by the daemon
+    """
+
+    if stdout is None:
+        stdout = getattr(sys.stdout, "buffer", sys.stdout)
+    if stderr is None:
+        stderr = getattr(sys.stderr, "buffer", sys.stderr)
+
+    sock = connect(socket_path)
+    if sock is None:
+        return None
+    try:
+        sock.sendall("{}\n".format(json.dumps(request)).encode("utf-8"))
+        for line in sock.makefile("rb"):
+            message = json.loads(line.decode("utf-8"))
+            if "fallback" in message.keys():
+                log.debug("Daemon didn't run command: {}".format(message["fallback"]))
+                return None
+            for name, stream in (("stdout", stdout), ("stderr", stderr)):
+                if name in message.keys():
+                    stream.write(message[name].encode("utf-8"))
+                    stream.flush()
+            if "exit_code" in message.keys():
+                return message["exit_code"]
+    finally:
+        sock.close()
+
+    stderr.write(b"Connection to nsbl daemon lost.\n")
+    return 1
+
+
+def client_main(args=None):
+    """Console script for 'nsbl-client': runs an nsbl command with a running 'nsbl-daemon', or without one.
+
+    Usage: nsbl-client <nsbl|nsbl-playbook|nsbl-tasks|nsbl-inventory> [ARGS]...
+    """
+
+    if args is None:
+        args = sys.argv[1:]
+    if not args or args[0] not in DAEMON_PROGRAMS.keys():
+        sys.stderr.write("Usage: nsbl-client <{}> [ARGS]...\n".format("|".join(sorted(DAEMON_PROGRAMS.keys()))))
+        sys.exit(2)
+
+    program = args[0]
+    argv = args[1:]
+    exit_code = send_request({"program": program, "argv": argv, "cwd": os.getcwd()})
+    if exit_code is None:
+        # no daemon, or a command the daemon doesn't run
+        get_entry_point(program).main(args=argv, prog_name=program)
+    sys.exit(exit_code)
+
+
+def daemon_main(args=None):
+    """Console script for 'nsbl-daemon'."""
+
+    import click
+    import click_log
+
+    @click.command()
+    @click.option('--socket', 'socket_path', help='the unix socket to listen on', default=DAEMON_SOCKET_PATH,
+                  show_default=True)
+    @click.option('--cache-max-age', type=float, default=DAEMON_CACHE_MAX_AGE, show_default=True,
+                  help='seconds the roles found in role repos are cached for')
+    @click.option('--stop', is_flag=True, default=False, help='stop the daemon that listens on the socket')
+    @click_log.simple_verbosity_option(log)
+    def cli(socket_path, cache_max_age, stop):
+        """Runs nsbl commands for 'nsbl-client', without a cold start for every command"""
+
+        if stop:
+            if send_request({"command": "stop"}, socket_path=socket_path) is None:
+                raise click.ClickException("No daemon running on socket: {}".format(socket_path))
+            return
+
+        from .exceptions import NsblException
+
+        try:
+            daemon = NsblDaemon(socket_path, cache_max_age=cache_max_age)
+        except NsblException as e:
+            raise click.ClickException("{}".format(e))
+        daemon.warm_up()
+        log.info("Listening on: {}".format(daemon.socket_path))
+        try:
+            daemon.serve()
+        except KeyboardInterrupt:
+            pass
+
+    cli.main(args=args, prog_name="nsbl-daemon")
+
+
+if __name__ == "__main__":
+    daemon_main()
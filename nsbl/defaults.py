@@ -4,10 +4,10 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import copy
+import threading
 
 import os
 from builtins import *
-from frkl import frkl
 from six import string_types
 
 # from frkl import CHILD_MARKER_NAME, DEFAULT_LEAF_NAME, DEFAULT_LEAFKEY_NAME, KEY_MOVE_MAP_NAME, OTHER_KEYS_NAME, \
@@ -75,6 +75,8 @@ DYN_ROLE_TYPE = "dyn_role"
 TASK_TASK_TYPE = "ansible-task"
 # key to indicate what the generated role should be called
 ROLE_NAME_KEY = "role-name"
+# number of characters of the content hash that is used to name dynamic roles that were not named explicitely
+DYN_ROLE_HASH_LENGTH = 12
 # filename that contains meta information for internal roles
 ROLE_META_FILENAME = "meta.yml"
 # path where nsbl default roles are located
@@ -82,6 +84,80 @@ DEFAULT_ROLES_PATH = os.path.join(os.path.dirname(__file__), "external", "defaul
 # default task description filename
 TASK_DESC_DEFAULT_FILENAME = "task-aliases.yml"
 ANSIBLE_ROLE_CACHE_DIR = os.path.expanduser("~/.cache/ansible-roles")
+# filename of the manifest that records which external roles (src, version) are in the role store
+ROLE_LOCK_FILENAME = "roles_lock.yml"
+# filename of the (deduplicated) external role requirements file in a rendered environment
+ROLE_REQUIREMENTS_FILENAME = "roles_requirements.yml"
+# command used to download external roles
+ANSIBLE_GALAXY_COMMAND = ["ansible-galaxy"]
+# maximum number of external roles that are downloaded in parallel
+ROLE_FETCH_WORKERS = 4
+# folder (within the role cache) that contains one entry per external role (src, version)
+ROLE_STORE_DIRNAME = "store"
+# maximum number of unreferenced role store entries to keep (least recently used ones are pruned first)
+ROLE_STORE_MAX_ENTRIES = 100
+# maximum size (in bytes) of the role store before unreferenced entries are pruned, None for no limit
+ROLE_STORE_MAX_SIZE = None
+# minimum number of seconds between two prunes of the role store that are only needed because of its size limit
+ROLE_STORE_PRUNE_INTERVAL = 3600
+
+# default maximum number of 'ansible-playbook' processes when running plays in parallel
+DEFAULT_MAX_PARALLEL_PLAYS = 4
+# maximum time (in seconds) to wait for a parallel run to finish
+PARALLEL_PLAYS_TIMEOUT = 60 * 60 * 24 * 7
+# folders that might contain ansible, in ascending order of priority (see the 'run_all_plays.sh' script)
+ANSIBLE_PATH_DIRS = ["~/.local/bin", "~/.local/inaugurate/bin", "~/.local/inaugurate/conda/bin",
+                     "~/.local/inaugurate/virtualenvs/inaugurate/bin", "~/.local/inaugurate/conda/envs/inaugurate/bin"]
+# maximum number of bytes read at once from the output of an ansible run
+OUTPUT_READ_CHUNK_SIZE = 64 * 1024
+# minimum time (in seconds) between two writes of the (buffered) run output to the terminal
+OUTPUT_REFRESH_INTERVAL = 0.1
+# number of characters of buffered run output that triggers a write, regardless of the refresh interval
+OUTPUT_MAX_BUFFER_SIZE = 8 * 1024
+# minimum time (in seconds) between two updates of the status lines of environments that run in parallel
+MULTIPLEX_REFRESH_INTERVAL = 0.2
+# maximum number of status lines of environments that run in parallel that are displayed at the same time
+MULTIPLEX_MAX_STATUS_LINES = 20
+# number of characters of stdout/stderr/messages of a task that are kept in memory, more output is moved to a temp file
+OUTPUT_SPILL_THRESHOLD = 1024 * 1024
+
+# seconds the result of the passwordless sudo check is cached for (0 to disable caching)
+SUDO_PROBE_CACHE_TTL = 300
+# file to share the result of the passwordless sudo check between processes, None to only cache within a process
+SUDO_PROBE_CACHE_FILE = os.environ.get("NSBL_SUDO_PROBE_CACHE_FILE", None)
+# filename of the json file (in the environment folder) the phase durations of a render/run are written to
+TIMINGS_FILENAME = "timings.json"
+# path (relative to the environment folder) of the compressed log of all structured events of a run
+EVENT_LOG_FILENAME = os.path.join("logs", "events.jsonl.gz")
+# maximum time (in seconds) events are kept in memory before they are written to the event log
+EVENT_LOG_FLUSH_INTERVAL = 1.0
+# maximum number of events that are kept in memory before they are written to the event log
+EVENT_LOG_MAX_BUFFERED_EVENTS = 1000
+# zlib compression level of the event log
+EVENT_LOG_COMPRESSION_LEVEL = 6
+# path (relative to the environment folder) of the json file that contains the lookup index of the environment
+LOOKUP_INDEX_FILENAME = os.path.join("logs", "lookup_index.json")
+# number of events that are handed to the callback adapter at once when replaying an event log
+REPLAY_BATCH_SIZE = 1000
+# path (relative to the environment folder) of the json file the duration metrics of a run are written to
+METRICS_FILENAME = os.path.join("logs", "metrics.json")
+# path (relative to the environment folder) of the text file the duration metrics of a run are written to, as a table
+METRICS_TABLE_FILENAME = os.path.join("logs", "metrics.txt")
+# percentiles that are calculated for the durations of environments, roles, tasks and items
+METRICS_PERCENTILES = [50, 90, 99]
+# number of the slowest roles that are listed in the metrics summary
+METRICS_TOP_ROLES = 10
+# maximum number of batches of output lines that are queued for a sink of the event bus before the reader waits
+# (or, for lossy sinks, further batches are dropped)
+EVENT_BUS_MAX_QUEUE_SIZE = 1000
+# maximum time (in seconds) to wait for a sink of the event bus to process its queued output once a run is finished
+EVENT_BUS_CLOSE_TIMEOUT = 60
+# timeout (in seconds) for the requests of the webhook event sink
+WEBHOOK_TIMEOUT = 5
+# the formats the progress of a run can be displayed in
+PROGRESS_FORMATS = ["text", "jsonl"]
+# folder that contains cached, processed Nsbl objects ('plans'), keyed by a hash of all inputs
+PLAN_CACHE_DIR = os.path.expanduser("~/.cache/nsbl/plans")
 
 LOCAL_ROLE_TYPE = "local"
 REMOTE_ROLE_TYPE = "remote"
@@ -104,29 +180,72 @@ DEFAULT_ENV_TYPE = ENV_TYPE_GROUP
 # tasks that emit 'nsbl'-specific events: nsbl_item_started, nsbl_item_ok, nsbl_item_failed
 NSBLIZED_TASKS = ["install"]
 
+# the keys of a frkl format (the values of frkl's '*_NAME' constants, so frkl only has to be imported once it's used)
+FRKL_CHILD_MARKER_NAME = "child_marker"
+FRKL_DEFAULT_LEAF_NAME = "default_leaf"
+FRKL_DEFAULT_LEAFKEY_NAME = "default_leaf_key"
+FRKL_KEY_MOVE_MAP_NAME = "key_move_map"
+FRKL_OTHER_KEYS_NAME = "other_keys"
+
 DEFAULT_NSBL_TASKS_BOOTSTRAP_FORMAT = {
-    frkl.CHILD_MARKER_NAME: TASKS_KEY,
-    frkl.DEFAULT_LEAF_NAME: TASKS_META_KEY,
-    frkl.DEFAULT_LEAFKEY_NAME: TASK_META_NAME_KEY,
-    frkl.KEY_MOVE_MAP_NAME: {'*': (VARS_KEY, 'default')},
+    FRKL_CHILD_MARKER_NAME: TASKS_KEY,
+    FRKL_DEFAULT_LEAF_NAME: TASKS_META_KEY,
+    FRKL_DEFAULT_LEAFKEY_NAME: TASK_META_NAME_KEY,
+    FRKL_KEY_MOVE_MAP_NAME: {'*': (VARS_KEY, 'default')},
     "use_context": True
 }
-DEFAULT_NSBL_TASKS_BOOTSTRAP_CHAIN = [
-    frkl.FrklProcessor(DEFAULT_NSBL_TASKS_BOOTSTRAP_FORMAT)
-]
 
-# bootstrap frkl processor chain for creating the inventory hosts/groups lists
+# bootstrap frkl format for creating the inventory hosts/groups lists
 NSBL_INVENTORY_BOOTSTRAP_FORMAT = {
-    frkl.CHILD_MARKER_NAME: ENVS_KEY,
-    frkl.DEFAULT_LEAF_NAME: ENV_META_KEY,
-    frkl.DEFAULT_LEAFKEY_NAME: ENV_NAME_KEY,
-    frkl.OTHER_KEYS_NAME: [VARS_KEY, TASKS_KEY],
-    frkl.KEY_MOVE_MAP_NAME: VARS_KEY
+    FRKL_CHILD_MARKER_NAME: ENVS_KEY,
+    FRKL_DEFAULT_LEAF_NAME: ENV_META_KEY,
+    FRKL_DEFAULT_LEAFKEY_NAME: ENV_NAME_KEY,
+    FRKL_OTHER_KEYS_NAME: [VARS_KEY, TASKS_KEY],
+    FRKL_KEY_MOVE_MAP_NAME: VARS_KEY
 }
-# bootstrap chain used for creating the inventory
-NSBL_INVENTORY_BOOTSTRAP_CHAIN = [
-    frkl.UrlAbbrevProcessor(), frkl.EnsureUrlProcessor(), frkl.EnsurePythonObjectProcessor(),
-    frkl.FrklProcessor(NSBL_INVENTORY_BOOTSTRAP_FORMAT)]
+
+
+def get_inventory_bootstrap_chain():
+    """Returns a new bootstrap frkl processor chain for creating the inventory."""
+
+    from frkl import frkl
+
+    return [frkl.UrlAbbrevProcessor(), frkl.EnsureUrlProcessor(), frkl.EnsurePythonObjectProcessor(),
+            frkl.FrklProcessor(NSBL_INVENTORY_BOOTSTRAP_FORMAT)]
+
+
+# processed task descriptions, keyed by the task description files and their modification times
+TASK_DESCS_CACHE = {}
+
+# the jinja environment for the templates that come with nsbl, created on first use
+JINJA_ENV = None
+JINJA_ENV_LOCK = threading.Lock()
+
+
+def to_nice_yaml(var):
+    """util function to convert to yaml in a jinja template"""
+    import yaml
+
+    return yaml.safe_dump(var, default_flow_style=False)
+
+
+def get_jinja_env():
+    """Returns the jinja environment for the templates that come with nsbl.
+
+    The environment is shared (within a process), so every template is only loaded and compiled once.
+    """
+
+    global JINJA_ENV
+    if JINJA_ENV is None:
+        with JINJA_ENV_LOCK:
+            if JINJA_ENV is None:
+                from jinja2 import Environment, PackageLoader
+
+                jinja_env = Environment(loader=PackageLoader('nsbl', 'templates'))
+                jinja_env.filters['to_nice_yaml'] = to_nice_yaml
+                JINJA_ENV = jinja_env
+
+    return JINJA_ENV
 
 
 def generate_nsbl_tasks_format(task_descs, tasks_format=DEFAULT_NSBL_TASKS_BOOTSTRAP_FORMAT):
@@ -137,7 +256,7 @@ def generate_nsbl_tasks_format(task_descs, tasks_format=DEFAULT_NSBL_TASKS_BOOTS
     for task_desc in task_descs:
         if DEFAULT_KEY_KEY in task_desc[TASKS_META_KEY].keys():
             # TODO: check for duplicate keys?
-            result[frkl.KEY_MOVE_MAP_NAME][task_desc[TASKS_META_KEY][TASK_META_NAME_KEY]] = "vars/{}".format(
+            result[FRKL_KEY_MOVE_MAP_NAME][task_desc[TASKS_META_KEY][TASK_META_NAME_KEY]] = "vars/{}".format(
                 task_desc[TASKS_META_KEY][DEFAULT_KEY_KEY])
 
     return result
@@ -198,6 +317,9 @@ def calculate_task_descs(task_descs, role_repos=[], add_upper_case_versions=True
     contains a file with the value of TASK_DESC_DEFAULT_FILENAME. If so, those
     will be added to the beginning of the resulting list.
 
+    If all task descriptions are local files, the result is cached (within the process) until one of the files
+    changes, so long-running processes (e.g. 'nsbl-daemon') only process them once.
+
     Args:
       task_descs (list): a string or list of strings of local files
       role_repos (list): a list of role repos (see 'calculate_role_repos' method)
@@ -225,6 +347,38 @@ def calculate_task_descs(task_descs, role_repos=[], add_upper_case_versions=True
 
         task_descs = repo_task_descs + task_descs
 
+    cache_key = _get_task_descs_cache_key(task_descs, add_upper_case_versions)
+    if cache_key is not None and cache_key in TASK_DESCS_CACHE.keys():
+        return copy.deepcopy(TASK_DESCS_CACHE[cache_key])
+
+    result = _process_task_descs(task_descs, add_upper_case_versions)
+    if cache_key is not None:
+        TASK_DESCS_CACHE[cache_key] = copy.deepcopy(result)
+
+    return result
+
+
+def _get_task_descs_cache_key(task_descs, add_upper_case_versions):
+
+    key = [add_upper_case_versions]
+    for task_desc in task_descs:
+        if not isinstance(task_desc, string_types):
+            return None
+        path = os.path.abspath(os.path.expanduser(task_desc))
+        try:
+            st = os.stat(path)
+        except OSError:
+            # most likely a (possibly abbreviated) url, the content of which can change at any time
+            return None
+        key.append((path, st.st_mtime, st.st_size))
+
+    return tuple(key)
+
+
+def _process_task_descs(task_descs, add_upper_case_versions):
+
+    from frkl import frkl
+
     # TODO: check whether paths exist
     frkl_format = generate_nsbl_tasks_format([])
     task_desk_frkl = frkl.Frkl(task_descs, [frkl.UrlAbbrevProcessor(),
@@ -3,12 +3,11 @@
 
 import inspect
 import logging
-import subprocess
 
 import os
 from cookiecutter.main import cookiecutter
 
-from .nsbl import NsblInventory
+from .nsbl import NsblInventory, can_passwordless_sudo
 
 log = logging.getLogger("nsbl")
 
@@ -17,16 +16,6 @@ INVENTORY_DIR = "inventory"
 EXECUTION_SCRIPT_FILE = "run_play.sh"
 
 
-def can_passwordless_sudo():
-    """Checks if the user can use passwordless sudo on this host."""
-
-    FNULL = open(os.devnull, 'w')
-    # use -k to ignore any existing sudo token
-    p = subprocess.Popen('sudo -k -n true', shell=True, stdout=FNULL, stderr=subprocess.STDOUT, close_fds=True)
-    r = p.wait()
-    return r == 0
-
-
 class NsblCreateException(Exception):
     def __init__(self, message_or_parent, parent=None):
         if isinstance(message_or_parent, Exception):
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import json
+import logging
+import threading
+import time
+
+from builtins import *
+from six.moves import queue
+from six.moves.urllib.request import Request, urlopen
+
+from .defaults import *
+from .output import decode_event, forward_log_messages
+
+log = logging.getLogger("nsbl")
+
+
+def decode_events(lines):
+    """Decodes all (json) event lines of a batch, lines that are not events are ignored."""
+
+    result = []
+    for line in lines:
+        try:
+            event = decode_event(line)
+        except (Exception):
+            continue
+        if isinstance(event, dict):
+            result.append((line, event))
+    return result
+
+
+class EventSink(object):
+    """Base class for the subscribers of an 'EventBus'.
+
+    All methods are called from the worker thread of the sink, one at a time. Sinks that can do without some of
+    the output (e.g. because they only report statistics) set 'lossy' to True, so the bus drops batches for them
+    instead of waiting until they caught up.
+    """
+
+    lossy = False
+
+    def process_lines(self, timestamp, lines):
+        """Processes a batch of output lines of the run.
+
+        Args:
+          timestamp (float): the time the lines were read
+          lines (list): the lines
+        """
+
+        pass
+
+    def process_error(self, timestamp, line):
+
+        pass
+
+    def close(self, timestamp, aborted=False):
+        """Called once the run is finished.
+
+        Args:
+          timestamp (float): the time the run finished
+          aborted (bool): whether the run was interrupted
+        """
+
+        pass
+
+
+class CallbackAdapterSink(EventSink):
+    def __init__(self, callback_adapter):
+        """Forwards the output of a run to a callback adapter (e.g. the 'NsblLogCallbackAdapter' that displays it)."""
+
+        self.callback_adapter = callback_adapter
+
+    def process_lines(self, timestamp, lines):
+
+        forward_log_messages(self.callback_adapter, lines)
+
+    def process_error(self, timestamp, line):
+
+        self.callback_adapter.add_error_message(line)
+
+    def close(self, timestamp, aborted=False):
+
+        # after an interrupt, the state of the last role is unknown, so it is not displayed
+        if not aborted:
+            self.callback_adapter.finish_up()
+
+
+class EventLogSink(EventSink):
+    def __init__(self, event_log):
+        """Writes the events of a run into an 'EventLogWriter', which is closed once the run is finished."""
+
+        self.event_log = event_log
+
+    def process_lines(self, timestamp, lines):
+
+        for line, event in decode_events(lines):
+            self.event_log.add_event(line, event)
+
+    def close(self, timestamp, aborted=False):
+
+        self.event_log.close()
+
+
+class MetricsSink(EventSink):
+    def __init__(self, metrics):
+        """Adds the events of a run to a 'RunMetrics' object, using the time they were read."""
+
+        self.metrics = metrics
+
+    # the durations are calculated from the events that arrive, a few missing ones don't matter much
+    lossy = True
+
+    def process_lines(self, timestamp, lines):
+
+        for line, event in decode_events(lines):
+            self.metrics.add_event(event, timestamp=timestamp)
+
+    def close(self, timestamp, aborted=False):
+
+        self.metrics.finish(timestamp=timestamp)
+
+
+class WebhookSink(EventSink):
+    def __init__(self, url, timeout=WEBHOOK_TIMEOUT):
+        """Posts the events of a run to an url, as a json object with the events of one batch under the 'events' key.
+
+        A request that fails is logged, but doesn't fail the run.
+
+        Args:
+          url (str): the url to post to
+          timeout (float): the timeout for every request, in seconds
+        """
+
+        self.url = url
+        self.timeout = timeout
+        self.failed_requests = 0
+
+    lossy = True
+
+    def post(self, payload):
+
+        request = Request(self.url, data=json.dumps(payload).encode("utf-8"),
+                          headers={"Content-Type": "application/json"})
+        try:
+            urlopen(request, timeout=self.timeout).close()
+        except (Exception) as e:
+            self.failed_requests += 1
+            log.debug("Could not post events to '{}': {}".format(self.url, e))
+
+    def process_lines(self, timestamp, lines):
+
+        events = [event for line, event in decode_events(lines)]
+        if events:
+            self.post({"timestamp": timestamp, "events": events})
+
+    def close(self, timestamp, aborted=False):
+
+        self.post({"timestamp": timestamp, "finished": True, "aborted": aborted})
+        if self.failed_requests:
+            log.warning("Could not post {} batches of events to: {}".format(self.failed_requests, self.url))
+
+
+class EventBus(object):
+    def __init__(self, sinks=[], max_queue_size=EVENT_BUS_MAX_QUEUE_SIZE, close_timeout=EVENT_BUS_CLOSE_TIMEOUT):
+        """Distributes the output of a run to any number of sinks.
+
+        Every sink gets its own bounded queue, which is processed by its own worker thread, so the thread that reads
+        the output of the 'ansible-playbook' process usually only has to add batches of lines to those queues. If a
+        sink can't keep up and its queue is full, the reader waits until there is space again, so sinks always get
+        the complete output. Only for lossy sinks (see 'subscribe') further batches are dropped instead (and a
+        warning is logged once the run is finished).
+
+        The bus has the same methods as a callback adapter ('add_log_messages', 'add_error_message',
+        'finish_up'), so it can be used wherever one is expected.
+
+        Args:
+          sinks (list): the 'EventSink' objects to subscribe
+          max_queue_size (int): maximum number of batches that are queued for every sink
+          close_timeout (float): maximum time (in seconds) to wait for every sink to finish once the run is finished
+        """
+
+        self.max_queue_size = max_queue_size
+        self.close_timeout = close_timeout
+        self.subscriptions = []
+        self.closed = False
+
+        for sink in sinks:
+            self.subscribe(sink)
+
+    def subscribe(self, sink, lossy=None):
+        """Subscribes a sink, and starts its worker thread.
+
+        Args:
+          sink (EventSink): the sink
+          lossy (bool): whether to drop batches for this sink if its queue is full, instead of waiting until the
+            sink caught up, None to use the 'lossy' attribute of the sink
+        """
+
+        if lossy is None:
+            lossy = getattr(sink, "lossy", False)
+        subscription = {"sink": sink, "queue": queue.Queue(self.max_queue_size), "lossy": lossy, "dropped": 0}
+        thread = threading.Thread(target=self._process, args=(subscription,),
+                                  name="nsbl-sink-{}".format(type(sink).__name__))
+        thread.daemon = True
+        subscription["thread"] = thread
+        self.subscriptions.append(subscription)
+        thread.start()
+
+    def _process(self, subscription):
+
+        sink = subscription["sink"]
+        while True:
+            kind, timestamp, payload = subscription["queue"].get()
+            try:
+                if kind == "lines":
+                    sink.process_lines(timestamp, payload)
+                elif kind == "error":
+                    sink.process_error(timestamp, payload)
+                else:
+                    sink.close(timestamp, aborted=payload)
+                    return
+            except (Exception) as e:
+                log.warning("Error in event sink '{}': {}".format(type(sink).__name__, e))
+                log.debug("Error in event sink", exc_info=True)
+                if kind == "close":
+                    return
+
+    def _publish(self, kind, payload):
+
+        item = (kind, time.time(), payload)
+        for subscription in self.subscriptions:
+            if not subscription["lossy"]:
+                subscription["queue"].put(item)
+                continue
+            try:
+                subscription["queue"].put_nowait(item)
+            except queue.Full:
+                subscription["dropped"] += 1
+
+    def add_log_message(self, line):
+
+        self.add_log_messages([line])
+
+    def add_log_messages(self, lines):
+
+        if lines:
+            self._publish("lines", list(lines))
+
+    def add_error_message(self, line):
+
+        self._publish("error", line)
+
+    def close(self, aborted=False):
+        """Lets every sink know the run is finished, and waits until they processed everything that is queued.
+
+        Args:
+          aborted (bool): whether the run was interrupted
+        """
+
+        if self.closed:
+            return
+        self.closed = True
+
+        timestamp = time.time()
+        for subscription in self.subscriptions:
+            # lossy sinks wait for this item as well, but not forever
+            try:
+                subscription["queue"].put(("close", timestamp, aborted), timeout=self.close_timeout)
+            except queue.Full:
+                pass
+        for subscription in self.subscriptions:
+            name = type(subscription["sink"]).__name__
+            subscription["thread"].join(self.close_timeout)
+            if subscription["thread"].is_alive():
+                log.warning("Event sink '{}' didn't finish in time.".format(name))
+            if subscription["dropped"]:
+                log.warning("Event sink '{}' couldn't keep up, dropped {} batches of output.".format(
+                    name, subscription["dropped"]))
+
+    def finish_up(self):
+
+        self.close()
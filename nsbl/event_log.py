@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import json
+import logging
+import tempfile
+import time
+import zlib
+
+from builtins import *
+from six import text_type
+
+from .defaults import *
+from .exceptions import NsblException
+from .lookup_index import LookupIndex
+from .output import NsblLogCallbackAdapter, decode_event, forward_log_messages
+
+log = logging.getLogger("nsbl")
+
+# wbits for zlib to create/read gzip members
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+# version of the format of the event log index
+EVENT_LOG_INDEX_VERSION = 1
+
+
+def get_event_log_key(env_id=None, role_id=None, task_id=None):
+    """Returns the key of an (env id, role id, dynamic task id) combination in the event log index."""
+
+    return "/".join(["" if token is None else "{}".format(token) for token in (env_id, role_id, task_id)])
+
+
+class EventLogWriter(object):
+    def __init__(self, path, index_path=None, flush_interval=EVENT_LOG_FLUSH_INTERVAL,
+                 max_buffered_events=EVENT_LOG_MAX_BUFFERED_EVENTS):
+        """Appends the structured events of a run to a gzip compressed json-lines file.
+
+        Events are buffered, and written as one gzip member when the buffer is full, or 'flush_interval' seconds
+        after the last write. As every member can be decompressed on its own, the index (written when the log is
+        closed) maps every env/role/task id combination to the file offsets of the members that contain its
+        events, so those can be read without decompressing the whole log.
+
+        Args:
+          path (str): the path of the event log
+          index_path (str): the path of the index file, defaults to the path of the log with '.index.json' instead of '.jsonl.gz'
+          flush_interval (float): maximum time (in seconds) events are kept in memory before they are written
+          max_buffered_events (int): maximum number of events that are kept in memory before they are written
+        """
+
+        self.path = path
+        if index_path is None:
+            index_path = get_event_log_index_path(path)
+        self.index_path = index_path
+        self.flush_interval = flush_interval
+        self.max_buffered_events = max_buffered_events
+
+        self.file = io.open(self.path, "wb")
+        self.buffer = []
+        self.buffer_keys = set()
+        self.last_flush = time.time()
+
+        self.blocks = []
+        self.keys = {}
+        self.number_of_events = 0
+
+        self.current_env_id = None
+        self.current_role_id = None
+        self.current_task_id = None
+
+    def add_event(self, line, event):
+        """Adds an event to the log.
+
+        Args:
+          line (str): the (json) line of the event, as printed by the ansible callback
+          event (dict): the decoded event
+        """
+
+        ids = self._resolve_ids(event)
+        if ids != (event.get(ENV_ID_KEY, None), event.get(ROLE_ID_KEY, None), event.get(DYN_TASK_ID_KEY, None)):
+            # so the event can be attributed without the events before it
+            event = dict(event)
+            event[ENV_ID_KEY], event[ROLE_ID_KEY], event[DYN_TASK_ID_KEY] = ids
+            line = json.dumps(event)
+        if isinstance(line, text_type):
+            line = line.encode("utf-8")
+
+        self.buffer.append(line.strip())
+        self.buffer_keys.add(get_event_log_key(*ids))
+        self.number_of_events += 1
+
+        if len(self.buffer) >= self.max_buffered_events or time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def _resolve_ids(self, event):
+
+        env_id = event.get(ENV_ID_KEY, None)
+        role_id = event.get(ROLE_ID_KEY, None)
+        task_id = event.get(DYN_TASK_ID_KEY, None)
+
+        # same as in the 'NsblLogCallbackAdapter', 'nsbl' events belong to the last role if they don't specify one
+        if event.get("category", "").startswith("nsbl") and (env_id is None or role_id is None):
+            env_id = self.current_env_id
+            role_id = self.current_role_id
+            if task_id is None:
+                task_id = self.current_task_id
+        else:
+            self.current_env_id = env_id
+            self.current_role_id = role_id
+            self.current_task_id = task_id
+
+        return (env_id, role_id, task_id)
+
+    def flush(self):
+        """Writes all buffered events."""
+
+        self.last_flush = time.time()
+        if not self.buffer:
+            return
+
+        compressor = zlib.compressobj(EVENT_LOG_COMPRESSION_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+        data = b"\n".join(self.buffer) + b"\n"
+        offset = self.file.tell()
+        self.file.write(compressor.compress(data) + compressor.flush())
+        self.file.flush()
+
+        self.blocks.append([offset, len(self.buffer)])
+        for key in self.buffer_keys:
+            self.keys.setdefault(key, []).append(offset)
+        self.buffer = []
+        self.buffer_keys = set()
+
+    def get_index(self):
+
+        return {"version": EVENT_LOG_INDEX_VERSION, "events": self.number_of_events, "blocks": self.blocks,
+                "keys": self.keys}
+
+    def close(self):
+        """Writes all buffered events and the index, and closes the log."""
+
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+        index_dir = os.path.dirname(os.path.abspath(self.index_path))
+        fd, temp_file = tempfile.mkstemp(dir=index_dir, prefix=".events_index_")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.get_index(), f)
+        os.rename(temp_file, self.index_path)
+
+
+def get_event_log_index_path(path):
+
+    if path.endswith(".jsonl.gz"):
+        path = path[:-len(".jsonl.gz")]
+    return "{}.index.json".format(path)
+
+
+def load_event_log_index(path):
+    """Loads the index of an event log.
+
+    Args:
+      path (str): the path of the event log
+
+    Returns:
+      dict: the index, or None if it doesn't exist (e.g. because the run was killed)
+    """
+
+    try:
+        with open(get_event_log_index_path(path)) as f:
+            return json.load(f)
+    except (IOError, OSError):
+        return None
+
+
+def iter_event_lines(path):
+    """Reads the (json) lines of all events of an event log, without loading the whole log into memory.
+
+    Args:
+      path (str): the path of the event log
+
+    Returns:
+      generator: the lines, without line endings
+    """
+
+    rest = b""
+    with io.open(path, "rb") as f:
+        decompressor = zlib.decompressobj(GZIP_WBITS)
+        while True:
+            chunk = f.read(OUTPUT_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            data = decompressor.decompress(chunk)
+            # every flush of the log starts a new gzip member
+            while decompressor.unused_data:
+                unused_data = decompressor.unused_data
+                decompressor = zlib.decompressobj(GZIP_WBITS)
+                data = data + decompressor.decompress(unused_data)
+
+            lines = (rest + data).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                if line:
+                    yield line
+
+    if rest.strip():
+        yield rest
+
+
+def iter_events(path):
+    """Reads all events of an event log, without loading the whole log into memory.
+
+    Args:
+      path (str): the path of the event log
+
+    Returns:
+      generator: the (decoded) events
+    """
+
+    for line in iter_event_lines(path):
+        yield decode_event(line)
+
+
+def _read_block(f, offset):
+
+    f.seek(offset)
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    data = []
+    while not decompressor.unused_data:
+        chunk = f.read(OUTPUT_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        data.append(decompressor.decompress(chunk))
+    return b"".join(data)
+
+
+def iter_indexed_events(path, env_id, role_id=None, task_id=None, index=None):
+    """Reads the events of one environment (or one role, or one task of a dynamic role), using the index.
+
+    Only the parts of the log that contain events of the environment/role/task are decompressed.
+
+    Args:
+      path (str): the path of the event log
+      env_id (int): the id of the environment
+      role_id (int): the id of the role (optional)
+      task_id (str): the id of the task within a dynamic role (optional, needs 'role_id')
+      index (dict): the index of the log, loaded from the index file if not provided
+
+    Returns:
+      generator: the (decoded) events
+    """
+
+    if index is None:
+        index = load_event_log_index(path)
+    if index is None:
+        raise NsblException("No index for event log: {}".format(path))
+
+    if task_id is not None:
+        prefix = get_event_log_key(env_id, role_id, task_id)
+    elif role_id is not None:
+        prefix = "{}/{}/".format(env_id, role_id)
+    else:
+        prefix = "{}/".format(env_id)
+
+    matches = [key for key in index["keys"].keys() if key.startswith(prefix)]
+    offsets = sorted(set(offset for key in matches for offset in index["keys"][key]))
+
+    with io.open(path, "rb") as f:
+        for offset in offsets:
+            for line in _read_block(f, offset).splitlines():
+                if not line.strip():
+                    continue
+                event = decode_event(line)
+                if event.get(ENV_ID_KEY, None) != env_id:
+                    continue
+                if role_id is not None and event.get(ROLE_ID_KEY, None) != role_id:
+                    continue
+                if task_id is not None and event.get(DYN_TASK_ID_KEY, None) != task_id:
+                    continue
+                yield event
+
+
+def replay_event_log(run_dir, callback_adapter=None, display_sub_tasks=True, display_skipped_tasks=True,
+                     display_ignore_tasks=[]):
+    """Displays the events of a past run again, without running anything.
+
+    Args:
+      run_dir (str): the environment folder of the run
+      callback_adapter (object): the adapter to send the events to, defaults to a 'NsblLogCallbackAdapter' using the lookup index of the run
+      display_sub_tasks (bool): whether to display subtasks in the output
+      display_skipped_tasks (bool): whether to display skipped tasks in the output
+      display_ignore_tasks (list): a list of strings that indicate task titles that should be ignored
+
+    Returns:
+      int: the number of replayed events
+    """
+
+    path = os.path.join(run_dir, EVENT_LOG_FILENAME)
+    if not os.path.exists(path):
+        raise NsblException("No event log in run folder: {}".format(run_dir))
+
+    if callback_adapter is None:
+        lookup_index_file = os.path.join(run_dir, LOOKUP_INDEX_FILENAME)
+        if not os.path.exists(lookup_index_file):
+            raise NsblException("No lookup index in run folder: {}".format(run_dir))
+        callback_adapter = NsblLogCallbackAdapter(LookupIndex.load_json(lookup_index_file),
+                                                  display_sub_tasks=display_sub_tasks,
+                                                  display_skipped_tasks=display_skipped_tasks,
+                                                  display_ignore_tasks=display_ignore_tasks)
+
+    number_of_events = 0
+    batch = []
+    for line in iter_event_lines(path):
+        batch.append(line)
+        if len(batch) >= REPLAY_BATCH_SIZE:
+            forward_log_messages(callback_adapter, batch)
+            number_of_events += len(batch)
+            batch = []
+    if batch:
+        forward_log_messages(callback_adapter, batch)
+        number_of_events += len(batch)
+
+    callback_adapter.finish_up()
+
+    return number_of_events
@@ -0,0 +1,663 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import fcntl
+import hashlib
+import logging
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import click
+import yaml
+from builtins import *
+
+from .defaults import *
+from .exceptions import NsblException
+from .render_targets import FileSystemRenderTarget
+
+log = logging.getLogger("nsbl")
+
+# name of the folder (within the role cache) that contains the lock files
+ROLE_CACHE_LOCKS_DIRNAME = ".locks"
+# name of the folder (within the role cache) roles are downloaded into before they are moved into place
+ROLE_CACHE_STAGING_DIRNAME = ".staging"
+# name of the folder (within a role store entry) that contains the role itself
+ROLE_STORE_ROLE_DIRNAME = "role"
+# name of the folder (within a role store entry) that contains one file per environment using the entry
+ROLE_STORE_REFS_DIRNAME = "refs"
+# name of the file (within a role store entry) whose modification time is the last time the entry was used
+ROLE_STORE_LAST_USED_FILENAME = ".last_used"
+# name of the file (within the role cache) whose modification time is the last time the role store was pruned
+ROLE_CACHE_LAST_PRUNED_FILENAME = ".last_pruned"
+# how often external roles are resolved again if another process pruned them before they could be locked
+ROLE_STORE_RESOLVE_ATTEMPTS = 3
+
+# to not garble the output of roles that are downloaded in parallel
+OUTPUT_LOCK = threading.Lock()
+
+
+class RoleCacheLock(object):
+    def __init__(self, lock_name, role_cache_dir=ANSIBLE_ROLE_CACHE_DIR, shared=False):
+        """Inter-process file lock on an item in the role cache.
+
+        Args:
+          lock_name (str): the name of the lock, usually the store key of a role
+          role_cache_dir (str): the folder external roles are downloaded into
+          shared (bool): whether to take a shared (reader) lock instead of an exclusive one
+        """
+
+        locks_dir = os.path.join(role_cache_dir, ROLE_CACHE_LOCKS_DIRNAME)
+        if not os.path.exists(locks_dir):
+            try:
+                os.makedirs(locks_dir)
+            except OSError:
+                # another process was quicker
+                pass
+
+        self.lock_file = os.path.join(locks_dir, "{}.lock".format(lock_name.replace(os.sep, "_")))
+        self.lock_fd = None
+        self.shared = shared
+
+    def __enter__(self):
+        self.lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self.lock_fd, fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+
+    def __exit__(self, *args):
+        fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+        os.close(self.lock_fd)
+        self.lock_fd = None
+
+
+class RoleStoreEntriesLock(object):
+    def __init__(self, roles, role_cache_dir=ANSIBLE_ROLE_CACHE_DIR):
+        """Shared lock on the role store entries of several roles.
+
+        Held while the roles are copied into an environment: 'prune_role_store' needs an exclusive lock to
+        remove an entry, so no process can prune the entries in the meantime.
+
+        Args:
+          roles (list): the role descriptions
+          role_cache_dir (str): the folder external roles are downloaded into
+        """
+
+        keys = sorted(set(get_role_store_key(role) for role in roles))
+        self.locks = [RoleCacheLock(key, role_cache_dir, shared=True) for key in keys]
+        self.acquired = []
+
+    def acquire(self):
+
+        for lock in self.locks:
+            lock.__enter__()
+            self.acquired.append(lock)
+
+    def release(self):
+
+        while self.acquired:
+            self.acquired.pop().__exit__()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def get_role_store_key(role):
+    """Calculates the key of a role in the role store.
+
+    The key only depends on the 'src' and 'version' of a role, so the same role is never downloaded twice,
+    and different versions of a role can live side by side.
+
+    Args:
+      role (dict): the role description
+
+    Returns:
+      str: the store key
+    """
+
+    token = "{}\n{}".format(role["src"], role.get("version", None) or "")
+    return hashlib.sha1(token.encode("utf-8")).hexdigest()
+
+
+def get_role_store_entry(role, role_cache_dir=ANSIBLE_ROLE_CACHE_DIR):
+    """Returns the path to the role store entry of a role."""
+
+    return os.path.join(role_cache_dir, ROLE_STORE_DIRNAME, get_role_store_key(role))
+
+
+def get_role_store_path(role, role_cache_dir=ANSIBLE_ROLE_CACHE_DIR):
+    """Returns the path to the downloaded role within the role store, which is the one to copy into an environment."""
+
+    return os.path.join(get_role_store_entry(role, role_cache_dir), ROLE_STORE_ROLE_DIRNAME)
+
+
+def get_role_lock_file(role_cache_dir=ANSIBLE_ROLE_CACHE_DIR):
+    """Returns the path to the lock manifest of the provided role cache."""
+
+    return os.path.join(role_cache_dir, ROLE_LOCK_FILENAME)
+
+
+def read_role_lock(role_cache_dir=ANSIBLE_ROLE_CACHE_DIR):
+    """Reads the lock manifest of a role cache.
+
+    Args:
+      role_cache_dir (str): the folder external roles are downloaded into
+
+    Returns:
+      dict: the role store key as key, a dict with the 'name', 'src' and 'version' of the installed role as value
+    """
+
+    lock_file = get_role_lock_file(role_cache_dir)
+    if not os.path.exists(lock_file):
+        return {}
+
+    with open(lock_file, "r") as f:
+        lock = yaml.safe_load(f)
+
+    if not lock:
+        return {}
+    if not isinstance(lock, dict):
+        raise NsblException("Invalid role lock file '{}', needs to contain a dictionary.".format(lock_file))
+
+    return lock
+
+
+def write_role_lock(lock, role_cache_dir=ANSIBLE_ROLE_CACHE_DIR):
+    """Writes the lock manifest of a role cache.
+
+    The manifest is written to a temporary file first, and then moved into place, so readers never see a
+    partially written file.
+
+    Args:
+      lock (dict): the lock manifest, see 'read_role_lock'
+      role_cache_dir (str): the folder external roles are downloaded into
+    """
+
+    if not os.path.exists(role_cache_dir):
+        os.makedirs(role_cache_dir)
+
+    lock_file = get_role_lock_file(role_cache_dir)
+    content = yaml.safe_dump(lock, default_flow_style=False, encoding='utf-8', allow_unicode=True).decode('utf-8')
+    temp_file = "{}.{}".format(lock_file, os.getpid())
+    with open(temp_file, "w") as text_file:
+        text_file.write(content)
+    os.rename(temp_file, lock_file)
+
+
+def update_role_lock(added=[], removed=[], role_cache_dir=ANSIBLE_ROLE_CACHE_DIR):
+    """Records newly installed and removed roles in the lock manifest.
+
+    Holds the manifest lock while reading and writing, so concurrent updates don't get lost.
+
+    Args:
+      added (list): descriptions of the roles that were installed
+      removed (list): store keys of the entries that were removed
+      role_cache_dir (str): the folder external roles are downloaded into
+    """
+
+    with RoleCacheLock(ROLE_LOCK_FILENAME, role_cache_dir):
+        lock = read_role_lock(role_cache_dir)
+        for role in added:
+            lock[get_role_store_key(role)] = get_role_lock_entry(role)
+        for key in removed:
+            lock.pop(key, None)
+        write_role_lock(lock, role_cache_dir)
+
+
+def get_role_lock_entry(role):
+    """Returns the details of a role that are recorded in the lock manifest."""
+
+    return {"name": role["name"], "src": role["src"], "version": role.get("version", None)}
+
+
+def is_role_satisfied(role, lock, role_cache_dir=ANSIBLE_ROLE_CACHE_DIR):
+    """Checks whether a role is already in the role store.
+
+    Args:
+      role (dict): the role description (needs 'name' and 'src' keys, 'version' is optional)
+      lock (dict): the lock manifest of the role cache
+      role_cache_dir (str): the folder external roles are downloaded into
+
+    Returns:
+      bool: whether the role needs to be installed (False) or not (True)
+    """
+
+    if get_role_store_key(role) not in lock.keys():
+        return False
+
+    return os.path.isdir(get_role_store_path(role, role_cache_dir))
+
+
+def touch_role_store_entry(role, role_cache_dir=ANSIBLE_ROLE_CACHE_DIR):
+    """Marks a role store entry as used just now."""
+
+    last_used_file = os.path.join(get_role_store_entry(role, role_cache_dir), ROLE_STORE_LAST_USED_FILENAME)
+    with open(last_used_file, "a"):
+        os.utime(last_used_file, None)
+
+
+def add_role_reference(role, env_dir, role_cache_dir=ANSIBLE_ROLE_CACHE_DIR):
+    """Records that an environment uses a role store entry.
+
+    Entries that are referenced by an environment that still exists are never pruned.
+
+    Args:
+      role (dict): the role description
+      env_dir (str): the path to the environment
+      role_cache_dir (str): the folder external roles are downloaded into
+    """
+
+    env_dir = "{}".format(os.path.abspath(env_dir))
+    refs_dir = os.path.join(get_role_store_entry(role, role_cache_dir), ROLE_STORE_REFS_DIRNAME)
+    if not os.path.exists(refs_dir):
+        os.makedirs(refs_dir)
+
+    ref_file = os.path.join(refs_dir, hashlib.sha1(env_dir.encode("utf-8")).hexdigest())
+    with open(ref_file, "w") as text_file:
+        text_file.write(env_dir)
+
+    touch_role_store_entry(role, role_cache_dir)
+
+
+def get_live_role_references(entry_dir):
+    """Returns all environments that use a role store entry and still exist.
+
+    References to environments that were deleted are removed.
+
+    Args:
+      entry_dir (str): the path to the role store entry
+
+    Returns:
+      list: the paths of the environments
+    """
+
+    refs_dir = os.path.join(entry_dir, ROLE_STORE_REFS_DIRNAME)
+    if not os.path.exists(refs_dir):
+        return []
+
+    result = []
+    for ref in os.listdir(refs_dir):
+        ref_file = os.path.join(refs_dir, ref)
+        with open(ref_file, "r") as f:
+            env_dir = f.read().strip()
+        if os.path.exists(env_dir):
+            result.append(env_dir)
+        else:
+            os.remove(ref_file)
+
+    return result
+
+
+def last_used_changed(entry_dir, last_used):
+    """Checks whether a role store entry was used after the provided time."""
+
+    last_used_file = os.path.join(entry_dir, ROLE_STORE_LAST_USED_FILENAME)
+    return os.path.exists(last_used_file) and os.path.getmtime(last_used_file) != last_used
+
+
+def get_folder_size(path):
+    """Returns the size of all files under a folder, in bytes."""
+
+    size = 0
+    for root, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            size += os.lstat(os.path.join(root, filename)).st_size
+
+    return size
+
+
+def prune_role_store(role_cache_dir=ANSIBLE_ROLE_CACHE_DIR, max_entries=ROLE_STORE_MAX_ENTRIES,
+                     max_size=ROLE_STORE_MAX_SIZE, exclude=[]):
+    """Removes least recently used role store entries that are not referenced by any existing environment.
+
+    Entries are removed until there are no more than 'max_entries' unreferenced entries left, and the
+    store is not larger than 'max_size' anymore (or there are no unreferenced entries left). Entries that
+    are locked by a 'RoleStoreEntriesLock' are only removed once that lock is released.
+
+    Args:
+      role_cache_dir (str): the folder external roles are downloaded into
+      max_entries (int): the maximum number of unreferenced entries to keep, None for no limit
+      max_size (int): the maximum size of the role store in bytes, None for no limit
+      exclude (list): the store keys of entries that are never removed (e.g. the ones the caller just used)
+
+    Returns:
+      list: the keys of the removed entries
+    """
+
+    store_dir = os.path.join(role_cache_dir, ROLE_STORE_DIRNAME)
+    if not os.path.exists(store_dir):
+        return []
+
+    unreferenced = []
+    total_size = 0
+    for key in os.listdir(store_dir):
+        entry_dir = os.path.join(store_dir, key)
+        size = get_folder_size(entry_dir) if max_size is not None else 0
+        total_size += size
+        if key in exclude or get_live_role_references(entry_dir):
+            continue
+        last_used_file = os.path.join(entry_dir, ROLE_STORE_LAST_USED_FILENAME)
+        last_used = os.path.getmtime(last_used_file) if os.path.exists(last_used_file) else 0
+        unreferenced.append((last_used, key, size))
+
+    unreferenced.sort()
+    removed = []
+    for last_used, key, size in unreferenced:
+        too_many = max_entries is not None and len(unreferenced) - len(removed) > max_entries
+        too_big = max_size is not None and total_size > max_size
+        if not too_many and not too_big:
+            break
+
+        entry_dir = os.path.join(store_dir, key)
+        with RoleCacheLock(key, role_cache_dir):
+            # might have been referenced (or used by another process) in the meantime
+            if get_live_role_references(entry_dir) or last_used_changed(entry_dir, last_used):
+                continue
+            log.debug("Pruning role store entry: {}".format(entry_dir))
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        removed.append(key)
+        total_size -= size
+
+    if removed:
+        update_role_lock(removed=removed, role_cache_dir=role_cache_dir)
+
+    return removed
+
+
+def prune_role_store_if_needed(role_cache_dir=ANSIBLE_ROLE_CACHE_DIR, max_entries=ROLE_STORE_MAX_ENTRIES,
+                               max_size=ROLE_STORE_MAX_SIZE, exclude=[], interval=ROLE_STORE_PRUNE_INTERVAL):
+    """Prunes the role store (see 'prune_role_store'), but only if it can be over one of its limits.
+
+    The number of entries is taken from the lock manifest, so the store is only walked if it has more than
+    'max_entries' entries. Its size can't be known without walking it, so if only 'max_size' is set, the store
+    is pruned at most once every 'interval' seconds.
+
+    Args:
+      role_cache_dir (str): the folder external roles are downloaded into
+      max_entries (int): the maximum number of unreferenced entries to keep, None for no limit
+      max_size (int): the maximum size of the role store in bytes, None for no limit
+      exclude (list): the store keys of entries that are never removed (e.g. the ones the caller just used)
+      interval (int): the minimum number of seconds between two prunes because of the size limit
+
+    Returns:
+      list: the keys of the removed entries
+    """
+
+    last_pruned_file = os.path.join(role_cache_dir, ROLE_CACHE_LAST_PRUNED_FILENAME)
+    if max_entries is None or len(read_role_lock(role_cache_dir)) <= max_entries:
+        if max_size is None:
+            return []
+        if os.path.exists(last_pruned_file) and time.time() - os.path.getmtime(last_pruned_file) < interval:
+            return []
+
+    removed = prune_role_store(role_cache_dir, max_entries=max_entries, max_size=max_size, exclude=exclude)
+
+    with open(last_pruned_file, "a"):
+        os.utime(last_pruned_file, None)
+
+    return removed
+
+
+def write_roles_requirements_file(roles, requirements_file, render_target=None):
+    """Writes a list of external roles into an ansible-galaxy requirements file.
+
+    An existing file will be overwritten.
+
+    Args:
+      roles (list): a list of role descriptions
+      requirements_file (str): the path to the requirements file
+      render_target (RenderTarget): the target to write the file to (default: the local filesystem)
+    """
+
+    if render_target is None:
+        render_target = FileSystemRenderTarget()
+
+    template = get_jinja_env().get_template('external_role.yml')
+
+    content = "".join([template.render(role=role) for role in roles])
+    render_target.write_file(requirements_file, content)
+
+
+def install_roles_with_galaxy(requirements_file, target_dir, force=False, galaxy_command=ANSIBLE_GALAXY_COMMAND):
+    """Calls 'ansible-galaxy' to install all roles in a requirements file into a folder.
+
+    Args:
+      requirements_file (str): the path to the requirements file
+      target_dir (str): the folder to install the roles into
+      force (bool): whether to overwrite roles that are already installed
+      galaxy_command (list): the command (and optional arguments) to use instead of 'ansible-galaxy'
+
+    Returns:
+      tuple: the return code of the 'ansible-galaxy' process, and a list of its (relevant) output lines
+    """
+
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir)
+
+    command = list(galaxy_command) + ["install", "-r", requirements_file, "-p", target_dir]
+    if force:
+        command.append("--force")
+    my_env = os.environ.copy()
+    my_env["PATH"] = "{}:{}:{}".format(os.path.expanduser("~/.local/bin"),
+                                       os.path.expanduser("~/.local/inaugurate/bin"), my_env["PATH"])
+
+    res = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
+                           env=my_env)
+    output = []
+    for line in iter(res.stdout.readline, ""):
+        if "already installed" not in line and "--force to change" not in line:
+            output.append(line)
+
+    return (res.wait(), output)
+
+
+def fetch_role(role, role_cache_dir=ANSIBLE_ROLE_CACHE_DIR, force=False, galaxy_command=ANSIBLE_GALAXY_COMMAND,
+               output_to_stderr=False):
+    """Downloads a single external role into the role store.
+
+    While downloading, an exclusive lock for the store entry is held, so concurrent nsbl processes never
+    download the same role at the same time. After the lock is acquired the lock manifest is checked again, in
+    case the role was installed in the meantime. The role is downloaded into a staging folder first, and only
+    moved into the role store once 'ansible-galaxy' finished successfully.
+
+    Args:
+      role (dict): the role description
+      role_cache_dir (str): the folder external roles are downloaded into
+      force (bool): whether to re-install the role even if the lock manifest says it is installed already
+      galaxy_command (list): the command (and optional arguments) to use instead of 'ansible-galaxy'
+      output_to_stderr (bool): whether to display the output of 'ansible-galaxy' on stderr instead of stdout
+
+    Returns:
+      bool: whether the role was installed (True), or was already present (False)
+    """
+
+    name = role["name"]
+    entry_dir = get_role_store_entry(role, role_cache_dir)
+    role_path = get_role_store_path(role, role_cache_dir)
+
+    with RoleCacheLock(get_role_store_key(role), role_cache_dir):
+
+        if not force and is_role_satisfied(role, read_role_lock(role_cache_dir), role_cache_dir):
+            log.debug("Role '{}' installed by another process, not downloading it again.".format(name))
+            return False
+
+        staging_base = os.path.join(role_cache_dir, ROLE_CACHE_STAGING_DIRNAME)
+        if not os.path.exists(staging_base):
+            try:
+                os.makedirs(staging_base)
+            except OSError:
+                pass
+        staging_dir = tempfile.mkdtemp(prefix="{}_".format(name), dir=staging_base)
+
+        try:
+            requirements_file = os.path.join(staging_dir, ROLE_REQUIREMENTS_FILENAME)
+            write_roles_requirements_file([role], requirements_file)
+
+            log.debug("Downloading and installing external role '{}'...".format(name))
+            return_code, output = install_roles_with_galaxy(requirements_file, os.path.join(staging_dir, "roles"),
+                                                            galaxy_command=galaxy_command)
+            with OUTPUT_LOCK:
+                for line in output:
+                    click.echo("  {}".format(line.encode('utf8')), nl=False, err=output_to_stderr)
+
+            staged_role = os.path.join(staging_dir, "roles", name)
+            if return_code != 0 or not os.path.isdir(staged_role):
+                raise NsblException(
+                    "Could not install external role '{}', ansible-galaxy exited with code {}".format(name,
+                                                                                                     return_code))
+
+            if not os.path.exists(entry_dir):
+                os.makedirs(entry_dir)
+            if os.path.exists(role_path):
+                old_role_path = os.path.join(staging_dir, "old")
+                os.rename(role_path, old_role_path)
+            os.rename(staged_role, role_path)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        touch_role_store_entry(role, role_cache_dir)
+        update_role_lock(added=[role], role_cache_dir=role_cache_dir)
+
+    return True
+
+
+def fetch_roles(roles, role_cache_dir=ANSIBLE_ROLE_CACHE_DIR, force=False, max_workers=ROLE_FETCH_WORKERS,
+                galaxy_command=ANSIBLE_GALAXY_COMMAND, output_to_stderr=False):
+    """Downloads external roles into the role store in parallel, one job per role.
+
+    Args:
+      roles (list): a list of role descriptions (need to be unique by name)
+      role_cache_dir (str): the folder external roles are downloaded into
+      force (bool): whether to re-install roles even if the lock manifest says they are installed already
+      max_workers (int): the maximum number of roles to download at the same time
+      galaxy_command (list): the command (and optional arguments) to use instead of 'ansible-galaxy'
+      output_to_stderr (bool): whether to display the output of 'ansible-galaxy' on stderr instead of stdout
+
+    Returns:
+      list: the roles that were installed
+    """
+
+    if not roles:
+        return []
+
+    if not os.path.exists(role_cache_dir):
+        try:
+            os.makedirs(role_cache_dir)
+        except OSError:
+            pass
+
+    def fetch(role):
+        try:
+            return (role, fetch_role(role, role_cache_dir, force=force, galaxy_command=galaxy_command,
+                                     output_to_stderr=output_to_stderr), None)
+        except (Exception) as e:
+            return (role, False, e)
+
+    pool = ThreadPool(max(1, min(max_workers, len(roles))))
+    try:
+        results = pool.map(fetch, roles)
+    finally:
+        pool.close()
+        pool.join()
+
+    errors = ["{}: {}".format(role["name"], error) for role, installed, error in results if error]
+    if errors:
+        raise NsblException("Could not install external role(s):\n  {}".format("\n  ".join(errors)))
+
+    return [role for role, installed, error in results if installed]
+
+
+def resolve_external_roles(roles, requirements_file, role_cache_dir=ANSIBLE_ROLE_CACHE_DIR, force_update_roles=False,
+                           max_workers=ROLE_FETCH_WORKERS, galaxy_command=ANSIBLE_GALAXY_COMMAND, render_target=None,
+                           output_to_stderr=False):
+    """Makes sure all external roles are available in the role store.
+
+    The (deduplicated) list of roles is written into the requirements file of the environment. Then the lock
+    manifest of the role cache is checked, and only the roles whose (src, version) is not in the role store
+    yet are downloaded (in parallel, see 'fetch_roles'). If all roles are satisfied, no 'ansible-galaxy'
+    process is started at all.
+
+    Args:
+      roles (list): a list of external role descriptions (need to be unique by name)
+      requirements_file (str): the path to the requirements file of the environment
+      role_cache_dir (str): the folder external roles are downloaded into
+      force_update_roles (bool): whether to re-install all roles, even if they are recorded in the lock manifest
+      max_workers (int): the maximum number of roles to download at the same time
+      galaxy_command (list): the command (and optional arguments) to use instead of 'ansible-galaxy'
+      render_target (RenderTarget): the target the requirements file is written to (default: the local filesystem)
+      output_to_stderr (bool): whether to display the download progress on stderr instead of stdout (e.g. because
+        stdout is used for machine readable output)
+
+    Returns:
+      list: the roles that were (re-)installed
+    """
+
+    write_roles_requirements_file(roles, requirements_file, render_target=render_target)
+
+    lock = read_role_lock(role_cache_dir)
+    if force_update_roles:
+        missing = list(roles)
+    else:
+        missing = [role for role in roles if not is_role_satisfied(role, lock, role_cache_dir)]
+
+    if not missing:
+        log.debug("All external roles satisfied by role store, not calling ansible-galaxy.")
+        return []
+
+    click.echo("\nDownloading external roles...", err=output_to_stderr)
+    return fetch_roles(missing, role_cache_dir, force=force_update_roles, max_workers=max_workers,
+                       galaxy_command=galaxy_command, output_to_stderr=output_to_stderr)
+
+
+def lock_external_roles(roles, requirements_file, env_dir=None, role_cache_dir=ANSIBLE_ROLE_CACHE_DIR,
+                        force_update_roles=False, max_workers=ROLE_FETCH_WORKERS,
+                        galaxy_command=ANSIBLE_GALAXY_COMMAND, render_target=None, output_to_stderr=False):
+    """Resolves external roles (see 'resolve_external_roles'), and locks their role store entries.
+
+    Once all entries are locked they are checked again, since another process could have pruned one of them
+    after it was resolved. Every entry is marked as used, and referenced by the environment if 'env_dir' is
+    provided. The returned lock needs to be released once the roles are copied into the environment.
+
+    Args:
+      roles (list): a list of external role descriptions (need to be unique by name)
+      requirements_file (str): the path to the requirements file of the environment
+      env_dir (str): the path to the environment, or None if the environment can't reference the entries
+      role_cache_dir (str): the folder external roles are downloaded into
+      force_update_roles (bool): whether to re-install all roles, even if they are recorded in the lock manifest
+      max_workers (int): the maximum number of roles to download at the same time
+      galaxy_command (list): the command (and optional arguments) to use instead of 'ansible-galaxy'
+      render_target (RenderTarget): the target the requirements file is written to (default: the local filesystem)
+      output_to_stderr (bool): whether to display the download progress on stderr instead of stdout
+
+    Returns:
+      RoleStoreEntriesLock: the (acquired) lock on the role store entries
+    """
+
+    for attempt in range(ROLE_STORE_RESOLVE_ATTEMPTS):
+        resolve_external_roles(roles, requirements_file, role_cache_dir=role_cache_dir,
+                               force_update_roles=force_update_roles and attempt == 0, max_workers=max_workers,
+                               galaxy_command=galaxy_command, render_target=render_target,
+                               output_to_stderr=output_to_stderr)
+
+        entries_lock = RoleStoreEntriesLock(roles, role_cache_dir)
+        entries_lock.acquire()
+        lock = read_role_lock(role_cache_dir)
+        if all(is_role_satisfied(role, lock, role_cache_dir) for role in roles):
+            for role in roles:
+                if env_dir:
+                    add_role_reference(role, env_dir, role_cache_dir)
+                else:
+                    touch_role_store_entry(role, role_cache_dir)
+            return entries_lock
+
+        entries_lock.release()
+        log.debug("External role(s) pruned by another process, resolving them again.")
+
+    raise NsblException("Could not lock external roles, they were pruned by another process while resolving them.")
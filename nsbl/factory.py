@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import logging
+from multiprocessing.pool import ThreadPool
+
+from builtins import *
+
+from .defaults import *
+from .nsbl import Nsbl
+from .tasks import find_roles_in_repo
+
+log = logging.getLogger("nsbl")
+
+# templates that are used for every environment, loaded when a factory is created
+NSBL_TEMPLATES = ["playbook.yml", "play.yml", "hosts", "external_role.yml"]
+
+
+class NsblFactory(object):
+    def __init__(self, role_repos=[], task_descs=[], use_default_roles=True, default_env_type=DEFAULT_ENV_TYPE,
+                 additional_roles=[]):
+        """Creates (and renders) many Nsbl objects that share the same role repositories and task descriptions.
+
+        The role repositories are indexed, the task descriptions processed and the templates loaded once, when
+        the factory is created. All Nsbl objects created by the factory use those (read-only) structures,
+        instead of re-calculating them for every configuration.
+
+        Args:
+          role_repos (list): a list of local role repos
+          task_descs (list): a list of additional task description files
+          use_default_roles (bool): whether to use the default roles that come with nsbl
+          default_env_type (str): the type a environment is if it is not explicitely specified
+          additional_roles (list): a list of additional roles that should always be added to the ansible environments
+        """
+
+        self.role_repos = calculate_role_repos(list(role_repos), use_default_roles=use_default_roles)
+        for repo in self.role_repos:
+            find_roles_in_repo(os.path.expanduser(repo))
+        self.task_descs = calculate_task_descs(list(task_descs), self.role_repos)
+        self.default_env_type = default_env_type
+        self.additional_roles = additional_roles
+
+        jinja_env = get_jinja_env()
+        for template in NSBL_TEMPLATES:
+            jinja_env.get_template(template)
+
+    def create(self, config, **kwargs):
+        """Creates a Nsbl object for a configuration.
+
+        Args:
+          config (list): a list of configuration items
+          **kwargs: other arguments for 'Nsbl.create'
+
+        Returns:
+          Nsbl: the Nsbl object, already 'processed'
+        """
+
+        kwargs.setdefault("default_env_type", self.default_env_type)
+        kwargs.setdefault("additional_roles", self.additional_roles)
+        return Nsbl.create(config, self.role_repos, self.task_descs, **kwargs)
+
+    def render(self, config, env_dir, create_args=None, **render_args):
+        """Creates a Nsbl object for a configuration, and renders it.
+
+        Args:
+          config (list): a list of configuration items
+          env_dir (str): the folder where the environment should be created
+          create_args (dict): other arguments for 'Nsbl.create'
+          **render_args: other arguments for 'Nsbl.render'
+
+        Returns:
+          dict: the result of the 'Nsbl.render' call
+        """
+
+        nsbl = self.create(config, **(create_args or {}))
+        return nsbl.render(env_dir, **render_args)
+
+    def create_many(self, configs, max_workers=1, **kwargs):
+        """Creates a Nsbl object for every configuration.
+
+        Args:
+          configs (list): a list of configurations (each one a list of configuration items)
+          max_workers (int): how many configurations to process at the same time
+          **kwargs: other arguments for 'Nsbl.create'
+
+        Returns:
+          list: the Nsbl objects, in the same order as the configurations
+        """
+
+        return self._map(lambda config: self.create(config, **kwargs), configs, max_workers)
+
+    def render_many(self, jobs, max_workers=1, create_args=None, **render_args):
+        """Creates and renders an environment for every job.
+
+        Args:
+          jobs (list): a list of (config, env_dir) tuples
+          max_workers (int): how many jobs to process at the same time
+          create_args (dict): other arguments for 'Nsbl.create'
+          **render_args: other arguments for 'Nsbl.render', a 'render_target_factory' function can be provided to create a render target per job (it gets the env_dir as argument)
+
+        Returns:
+          list: the results of the 'Nsbl.render' calls, in the same order as the jobs
+        """
+
+        render_target_factory = render_args.pop("render_target_factory", None)
+
+        def render_job(job):
+            config, env_dir = job
+            job_render_args = dict(render_args)
+            if render_target_factory is not None:
+                job_render_args["render_target"] = render_target_factory(env_dir)
+            return self.render(config, env_dir, create_args=create_args, **job_render_args)
+
+        return self._map(render_job, jobs, max_workers)
+
+    def _map(self, func, items, max_workers):
+
+        items = list(items)
+        if max_workers <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+
+        pool = ThreadPool(min(max_workers, len(items)))
+        try:
+            # using 'map_async' so a KeyboardInterrupt doesn't get swallowed while waiting
+            return pool.map_async(func, items).get(PARALLEL_PLAYS_TIMEOUT)
+        finally:
+            pool.close()
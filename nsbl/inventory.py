@@ -9,10 +9,10 @@ from builtins import *
 from frkl.frkl import (ConfigProcessor,
                        EnsurePythonObjectProcessor, EnsureUrlProcessor, Frkl,
                        FrklCallback, FrklProcessor, UrlAbbrevProcessor)
-from jinja2 import Environment, PackageLoader
 
 from .defaults import *
 from .exceptions import NsblException
+from .render_targets import FileSystemRenderTarget
 
 
 def parse_host_string(host_string):
@@ -99,12 +99,17 @@ class NsblInventory(FrklCallback):
     def result(self):
         return self.list()
 
-    def extract_vars(self, inventory_dir):
+    def extract_vars(self, inventory_dir, render_target=None):
         """Writes a folder structure with 'group_vars' and 'host_vars' folders into the target directory.
 
         Args:
           inventory_dir (str): the directory the inventory should be written to
+          render_target (RenderTarget): the target to write the files to (default: the local filesystem)
         """
+
+        if render_target is None:
+            render_target = FileSystemRenderTarget()
+
         for group, group_vars in self.groups.items():
             vars = group_vars.get(VARS_KEY, {})
             if not vars:
@@ -114,9 +119,7 @@ class NsblInventory(FrklCallback):
             content = yaml.safe_dump(vars, default_flow_style=False, encoding='utf-8', allow_unicode=True).decode(
                 'utf-8')
 
-            os.makedirs(group_dir)
-            with open(var_file, "w") as text_file:
-                text_file.write(content)
+            render_target.write_file(var_file, content)
 
         for host, host_vars in self.hosts.items():
             vars = host_vars.get(VARS_KEY, {})
@@ -127,20 +130,17 @@ class NsblInventory(FrklCallback):
             content = yaml.safe_dump(vars, default_flow_style=False, encoding='utf-8', allow_unicode=True).decode(
                 'utf-8')
 
-            os.makedirs(host_dir)
-            with open(var_file, "w") as text_file:
-                text_file.write(content)
+            render_target.write_file(var_file, content)
 
     def get_inventory_config_string(self):
         """Returns a string that can be used to write an ansible hosts file, including hosts, groups and child-groups."""
 
-        jinja_env = Environment(loader=PackageLoader('nsbl', 'templates'))
-        template = jinja_env.get_template('hosts')
+        template = get_jinja_env().get_template('hosts')
         output_text = template.render(groups=self.groups, hosts=self.hosts)
 
         return output_text
 
-    def write_inventory_file_or_script(self, inventory_dir, extract_vars=False, relative_paths=True):
+    def write_inventory_file_or_script(self, inventory_dir, extract_vars=False, relative_paths=True, render_target=None):
         """Writes an ansible hosts file or dynamic inventory script into the provided directory.
 
         Writing a dynamic inventory script is not implemented yet.
@@ -149,17 +149,17 @@ class NsblInventory(FrklCallback):
           inventory_dir (str): the target directory
           extract_vars (bool): whether to extract all vars (True, default) or write a dynamic inventory script
           relative_paths (bool): only important for when writing dynamic inventory scripts, makes the paths in the script relative to the ansible environment root so its easily copy-able
+          render_target (RenderTarget): the target to write the files to (default: the local filesystem)
         """
+        if render_target is None:
+            render_target = FileSystemRenderTarget()
+
         if extract_vars:
             inventory_string = self.get_inventory_config_string()
             inventory_name = "hosts"
             inventory_file = os.path.join(inventory_dir, inventory_name)
-            par_dir = os.path.dirname(inventory_file)
-            if  not os.path.exists(par_dir):
-                os.makedirs(par_dir)
 
-            with open(inventory_file, "w") as text_file:
-                text_file.write(inventory_string)
+            render_target.write_file(inventory_file, inventory_string)
 
         else:
             raise Exception("Dynamic inventory script creation not implemented yet.")
@@ -359,6 +359,34 @@ class NsblInventory(FrklCallback):
         host_vars = self.hosts.get(host, {}).get(VARS_KEY, {})
         return host_vars
 
+    def get_hosts(self, env_name, _visited=None):
+        """Returns the names of all hosts that are part of an environment.
+
+        For groups, this includes the hosts of all sub-groups.
+
+        Args:
+          env_name (str): the name of the group or host
+        Returns:
+          set: the host names
+        """
+
+        if env_name == "all":
+            return set(self.hosts.keys())
+
+        if env_name not in self.groups.keys():
+            return set([env_name])
+
+        if _visited is None:
+            _visited = set()
+        _visited.add(env_name)
+
+        result = set(self.groups[env_name].get("hosts", []))
+        for child in self.groups[env_name].get("children", []):
+            if child not in _visited:
+                result |= self.get_hosts(child, _visited)
+
+        return result
+
     def get_vars(self, env_name):
         """Returns all variables for the environment with the specified name.
 
@@ -5,8 +5,6 @@ import sys
 
 import click
 
-from .inventory import NsblInventory
-
 
 @click.command()
 @click.option('--list', help='list of all groups', required=False, is_flag=True)
@@ -19,6 +17,9 @@ def main(list, host, config):
         click.echo("Using both '--list' and '--host' options not allowd")
         sys.exit(1)
 
+    # imported here, so '--help' doesn't have to wait for it
+    from .inventory import NsblInventory
+
     inventory = NsblInventory.create(config)
     if list:
         result = inventory.list()
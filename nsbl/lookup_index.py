@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import json
+import logging
+
+from builtins import *
+
+from .defaults import *
+
+log = logging.getLogger("nsbl")
+
+
+class LookupIndex(object):
+    def __init__(self, records=None):
+        """Maps the ids an ansible callback event carries to what's needed to display (or measure) it.
+
+        In contrast to the lookup dict of a Nsbl object (see 'Nsbl.get_lookup_dict'), which contains the full
+        details (including vars) of every role, the index only contains one small record per environment, role and
+        dynamic role task, all in one flat dictionary:
+
+          - (env_id, None, None): {'name': <env name>}
+          - (env_id, role_id, None): {'name': <role name>, 'role_type': <role type>, 'task-desc': <description or None>}
+          - (env_id, role_id, dyn_task_id): {'name': <task name>, 'task-desc': <description or None>}
+
+        Args:
+          records (dict): the records, keyed by (env_id, role_id, dyn_task_id) tuples
+        """
+
+        if records is None:
+            records = {}
+        self.records = records
+
+    def add_env(self, env_id, name):
+
+        self.records[(env_id, None, None)] = {ENV_NAME_KEY: name}
+
+    def add_role(self, env_id, role_id, name, role_type, task_desc=None):
+
+        self.records[(env_id, role_id, None)] = {TASK_META_NAME_KEY: name, "role_type": role_type,
+                                                 TASK_DESC_KEY: task_desc}
+
+    def add_task(self, env_id, role_id, task_id, name, task_desc=None):
+
+        self.records[(env_id, role_id, task_id)] = {TASK_META_NAME_KEY: name, TASK_DESC_KEY: task_desc}
+
+    def get(self, env_id, role_id=None, task_id=None, default=None):
+        """Returns the record of an environment, role or dynamic role task.
+
+        Args:
+          env_id (int): the id of the environment
+          role_id (int): the id of the role, None for the record of the environment
+          task_id (str): the id of the task within a dynamic role, None for the record of the role
+          default (object): the value to return if there is no such record
+
+        Returns:
+          dict: the record
+        """
+
+        return self.records.get((env_id, role_id, task_id), default)
+
+    def get_env_name(self, env_id, default=None):
+
+        return self.get(env_id, default={}).get(ENV_NAME_KEY, default)
+
+    def to_list(self):
+        """Returns the index as json-serializable list of [env_id, role_id, dyn_task_id, record] items."""
+
+        return [[env_id, role_id, task_id, record] for (env_id, role_id, task_id), record in
+                sorted(self.records.items(), key=lambda r: json.dumps(r[0]))]
+
+    @classmethod
+    def from_list(cls, items):
+
+        return cls(dict(((env_id, role_id, task_id), record) for env_id, role_id, task_id, record in items))
+
+    def write_json(self, path):
+
+        with open(path, "w") as f:
+            f.write("{}".format(json.dumps(self.to_list())))
+
+    @classmethod
+    def load_json(cls, path):
+        """Loads an index that was written with 'write_json'."""
+
+        with open(path) as f:
+            return cls.from_list(json.load(f))
+
+    @classmethod
+    def from_lookup_dict(cls, lookup_dict):
+        """Creates the index from a (nested) lookup dict, as returned by 'Nsbl.get_lookup_dict'."""
+
+        index = cls()
+        for env_id, env in lookup_dict.items():
+            index.add_env(env_id, env.get(ENV_NAME_KEY, None))
+            for role_id, role in env.get(TASKS_KEY, {}).items():
+                index.add_role(env_id, role_id, role.get(TASK_META_NAME_KEY, None), role.get("role_type", None),
+                               role.get(TASKS_META_KEY, {}).get(TASK_DESC_KEY, None))
+                for task_id, task in role.get(TASKS_KEY, {}).items():
+                    meta = task.get(TASKS_META_KEY, {})
+                    index.add_task(env_id, role_id, task_id, meta.get(TASK_META_NAME_KEY, None),
+                                   meta.get(TASK_DESC_KEY, None))
+
+        return index
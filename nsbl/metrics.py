@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import json
+import logging
+import math
+import time
+
+from builtins import *
+
+from .defaults import *
+from .lookup_index import LookupIndex
+
+log = logging.getLogger("nsbl")
+
+# the kinds of spans that are measured, in the order they are displayed
+METRICS_KINDS = ["env", "role", "task", "item"]
+# the possible status of a span, a span gets the 'worst' status of all its events
+METRICS_STATUS = ["skipped", "ok", "changed", "failed"]
+
+
+def get_event_status(event):
+    """Returns the status ('skipped', 'ok', 'changed' or 'failed') an event of the 'nsbl_internal' callback reports."""
+
+    category = event.get("category", "")
+    if category in ["failed", "item_failed", "nsbl_item_failed"] and not event.get("ignore_errors", False):
+        return "failed"
+    if event.get("status", None) == "changed":
+        return "changed"
+    if category in ["skipped", "item_skipped"] or event.get("skipped", False):
+        return "skipped"
+    return "ok"
+
+
+def calculate_percentile(sorted_values, percentile):
+    """Returns the percentile of a sorted list of values (nearest-rank method).
+
+    Args:
+      sorted_values (list): the values, sorted ascending
+      percentile (float): the percentile (0-100)
+
+    Returns:
+      float: the value, or None if the list is empty
+    """
+
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(percentile / 100.0 * len(sorted_values)))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def calculate_stats(durations, percentiles=METRICS_PERCENTILES):
+    """Returns count, total, min, max, mean and percentiles of a list of durations."""
+
+    values = sorted(durations)
+    result = {"count": len(values), "total": sum(values)}
+    if values:
+        result["min"] = values[0]
+        result["max"] = values[-1]
+        result["mean"] = result["total"] / len(values)
+    for percentile in percentiles:
+        result["p{}".format(percentile)] = calculate_percentile(values, percentile)
+    return result
+
+
+class RunMetrics(object):
+    def __init__(self, lookup_index=None, percentiles=METRICS_PERCENTILES, listener=None):
+        """Measures how long every environment, role, (dynamic role) task and item of a run takes.
+
+        The durations are calculated from the time the events of the 'nsbl_internal' callback arrive, following
+        the same env/role/task transitions as the 'NsblLogCallbackAdapter'. Ansible only reports a task once it is
+        finished, so a role (or task) is taken to start right after the last event before its first one, and to
+        end with its last event (or when the run finishes). Items end with their own event, so the duration of an
+        item is the time since the end of the previous item of the same task (or the start of the task).
+
+        Args:
+          lookup_index (LookupIndex): the lookup index (or dict) of the run (see 'Nsbl.get_lookup_index'), used to name the envs/roles/tasks
+          percentiles (list): the percentiles to calculate for every kind of span
+          listener (function): called with the kind, the record (names, ids, status, duration and end time) of every span once it ended
+        """
+
+        if lookup_index is None:
+            lookup_index = LookupIndex()
+        elif not isinstance(lookup_index, LookupIndex):
+            # a (nested) lookup dict, as returned by 'Nsbl.get_lookup_dict'
+            lookup_index = LookupIndex.from_lookup_dict(lookup_index)
+        self.lookup_index = lookup_index
+        self.percentiles = percentiles
+        self.listener = listener
+
+        # (kind, name, duration) tuples
+        self.spans = []
+
+        self.current_env_id = None
+        self.current_role_id = None
+        self.current_task = None
+        self.current_dyn_task_id = None
+        self.current_task_name = None
+        # kind -> (name, start time, record) of the currently open spans
+        self.open_spans = {}
+        self.last_item_end = None
+        self.last_event_time = None
+
+    def _env_name(self, env_id):
+
+        return self.lookup_index.get_env_name(env_id, "env_{}".format(env_id))
+
+    def _role_name(self, env_id, role_id):
+
+        role = self.lookup_index.get(env_id, role_id, default={})
+        return "{}/{}".format(self._env_name(env_id), role.get(TASK_META_NAME_KEY, "role_{}".format(role_id)))
+
+    def _task_name(self, env_id, role_id, dyn_task_id, task_name):
+
+        if dyn_task_id is not None:
+            task = self.lookup_index.get(env_id, role_id, dyn_task_id, default={})
+            task_name = task.get(TASK_DESC_KEY, None) or dyn_task_id
+        return task_name
+
+    def _open(self, kind, name, timestamp, **record):
+
+        self.open_spans[kind] = (name, timestamp, record)
+
+    def _close(self, kind, timestamp):
+
+        span = self.open_spans.pop(kind, None)
+        if span is None:
+            return
+        name, start, record = span
+        self.spans.append((kind, name, timestamp - start))
+        if self.listener is not None:
+            record["duration"] = timestamp - start
+            record["timestamp"] = timestamp
+            self.listener(kind, record)
+
+    def _update_status(self, status, kinds):
+
+        for kind in kinds:
+            span = self.open_spans.get(kind, None)
+            if span is None:
+                continue
+            current = span[2].get("status", None)
+            if current is None or METRICS_STATUS.index(status) > METRICS_STATUS.index(current):
+                span[2]["status"] = status
+
+    def _close_from(self, kind, timestamp):
+
+        for k in reversed(METRICS_KINDS[METRICS_KINDS.index(kind):]):
+            self._close(k, timestamp)
+
+    def add_event(self, event, timestamp=None):
+        """Processes an event of the 'nsbl_internal' callback.
+
+        Args:
+          event (dict): the (decoded) event
+          timestamp (float): the time the event happened, defaults to now
+        """
+
+        if timestamp is None:
+            timestamp = time.time()
+        boundary = timestamp if self.last_event_time is None else self.last_event_time
+        self.last_event_time = timestamp
+
+        category = event.get("category", "")
+        if category == "play_start":
+            self._close_from("env", boundary)
+            self.current_env_id = None
+            self.current_role_id = None
+            self.current_task = None
+            self.last_event_time = timestamp
+            return
+
+        env_id = event.get(ENV_ID_KEY, None)
+        role_id = event.get(ROLE_ID_KEY, None)
+        dyn_task_id = event.get(DYN_TASK_ID_KEY, None)
+        task_name = event.get(TASK_META_NAME_KEY, None)
+        if category.startswith("nsbl"):
+            if env_id is None or role_id is None:
+                env_id = self.current_env_id
+                role_id = self.current_role_id
+            if not dyn_task_id:
+                dyn_task_id = self.current_dyn_task_id
+            if not task_name:
+                task_name = self.current_task_name
+
+        if env_id is None or role_id is None:
+            # utility tasks, not displayed either
+            return
+
+        env = {"env": self._env_name(env_id), "env_id": env_id}
+        if env_id != self.current_env_id:
+            self._close_from("env", boundary)
+            self._open("env", env["env"], boundary, **env)
+            self.current_role_id = None
+        role = dict(env, role=self.lookup_index.get(env_id, role_id, default={}).get(TASK_META_NAME_KEY, None),
+                    role_id=role_id)
+        if role_id != self.current_role_id:
+            self._close_from("role", boundary)
+            self._open("role", self._role_name(env_id, role_id), boundary, **role)
+            self.current_task = None
+        task = dict(role, task=self._task_name(env_id, role_id, dyn_task_id, task_name), task_id=dyn_task_id)
+        if (dyn_task_id, task_name) != self.current_task:
+            self._close_from("task", boundary)
+            self._open("task", "{}/{}".format(self._role_name(env_id, role_id), task["task"]), boundary, **task)
+            self.last_item_end = boundary
+
+        self.current_env_id = env_id
+        self.current_role_id = role_id
+        self.current_task = (dyn_task_id, task_name)
+        self.current_dyn_task_id = dyn_task_id
+        self.current_task_name = task_name
+
+        if category == "nsbl_item_started":
+            self._close("item", timestamp)
+            self._open("item", "{}".format(event.get("item", None)), timestamp, item=event.get("item", None), **task)
+            return
+
+        status = get_event_status(event)
+        if category in ["nsbl_item_ok", "nsbl_item_failed", "item_ok", "item_failed", "item_skipped"]:
+            if "item" not in self.open_spans:
+                self._open("item", "{}".format(event.get("item", None)), self.last_item_end,
+                           item=event.get("item", None), **task)
+            self._update_status(status, METRICS_KINDS)
+            self._close("item", timestamp)
+            self.last_item_end = timestamp
+        else:
+            self._update_status(status, METRICS_KINDS[:3])
+
+    def finish(self, timestamp=None):
+        """Ends all spans that are still open (called once the run is finished)."""
+
+        if timestamp is None:
+            timestamp = time.time()
+        self._close_from("env", timestamp)
+
+    def get_durations(self, kind):
+
+        return [duration for k, name, duration in self.spans if k == kind]
+
+    def get_summary(self, top=METRICS_TOP_ROLES):
+        """Returns the statistics for every kind of span, and the roles that took the longest.
+
+        Args:
+          top (int): how many of the slowest roles to include
+
+        Returns:
+          dict: the summary
+        """
+
+        result = {}
+        for kind in METRICS_KINDS:
+            result[kind] = calculate_stats(self.get_durations(kind), self.percentiles)
+
+        roles = {}
+        for kind, name, duration in self.spans:
+            if kind == "role":
+                roles.setdefault(name, []).append(duration)
+        slowest = sorted(roles.items(), key=lambda r: sum(r[1]), reverse=True)[:top]
+        result["slowest_roles"] = [dict(calculate_stats(durations, self.percentiles), name=name) for
+                                   name, durations in slowest]
+
+        return result
+
+    def format_table(self, summary=None):
+        """Formats the summary as a (plain text) table.
+
+        Args:
+          summary (dict): the summary to format, defaults to the current one
+
+        Returns:
+          str: the table
+        """
+
+        if summary is None:
+            summary = self.get_summary()
+
+        columns = ["count", "total", "mean", "max"] + ["p{}".format(p) for p in self.percentiles]
+
+        def format_row(name, stats):
+            values = []
+            for column in columns:
+                value = stats.get(column, None)
+                if value is None:
+                    values.append("{:>10}".format("-"))
+                elif column == "count":
+                    values.append("{:>10}".format(value))
+                else:
+                    values.append("{:>10.3f}".format(value))
+            return "{:<40} {}".format(name[:40], " ".join(values))
+
+        header = "{:<40} {}".format("", " ".join(["{:>10}".format(c) for c in columns]))
+        lines = [header]
+        for kind in METRICS_KINDS:
+            lines.append(format_row("{}s".format(kind), summary[kind]))
+        if summary["slowest_roles"]:
+            lines.append("")
+            lines.append("slowest roles:")
+            for role in summary["slowest_roles"]:
+                lines.append(format_row(role["name"], role))
+
+        return "\n".join(lines)
+
+    def write_json(self, path):
+
+        log.debug("Writing run metrics to: {}".format(path))
+        with open(path, "w") as f:
+            f.write("{}".format(json.dumps(self.get_summary(), sort_keys=True, indent=2)))
+
+    def write_table(self, path):
+
+        with open(path, "w") as f:
+            f.write("{}\n".format(self.format_table()))
@@ -3,26 +3,39 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import json
 import logging
-import shutil
+import shlex
 import signal
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
 
 import click
 from builtins import *
-from cookiecutter.main import cookiecutter
 from frkl.frkl import (EnsurePythonObjectProcessor, EnsureUrlProcessor, Frkl,
                        FrklCallback, FrklProcessor, UrlAbbrevProcessor, dict_merge)
-from jinja2 import Environment, PackageLoader
 
 from .defaults import *
+from .event_bus import CallbackAdapterSink, EventBus, EventLogSink, MetricsSink
+from .event_log import EventLogWriter
+from .lookup_index import LookupIndex
+from .metrics import RunMetrics
+from .progress import JsonlProgressSink
 from .exceptions import NsblException
+from .external_roles import get_role_store_key, lock_external_roles, prune_role_store_if_needed
 from .inventory import NsblInventory, WrapTasksIntoLocalhostEnvProcessor, WrapTasksIntoHostsProcessor
-from .output import CursorOff, NsblLogCallbackAdapter, NsblPrintCallbackAdapter
-from .tasks import NsblCapitalizedBecomeProcessor, NsblDynamicRoleProcessor, NsblTaskProcessor, NsblTasks, add_roles
+from .plan_cache import calculate_plan_key, load_plan, save_plan
+from .render_targets import FileSystemRenderTarget
+from .timing import PhaseTimer
+from .output import CursorOff, MultiplexedDisplay, NsblLogCallbackAdapter, NsblPrintCallbackAdapter, forward_log_messages, \
+    iter_line_batches
+from .tasks import NsblCapitalizedBecomeProcessor, NsblDynamicRoleProcessor, NsblTaskProcessor, NsblTasks, add_roles, \
+    _add_role_check_duplicates
 
 try:
     set
@@ -31,22 +44,172 @@ except NameError:
 
 log = logging.getLogger("nsbl")
 
+# result of the last passwordless sudo check, and when it was done
+SUDO_PROBE_CACHE = {}
+SUDO_PROBE_LOCK = threading.RLock()
+
 
 # ------------------------------
 # util functions
-def can_passwordless_sudo():
-    """Checks if the user can use passwordless sudo on this host."""
+def ignore_sigint():
+    """Ignores the SIGINT signal in a child process (by setting the handler to the standard signal handler SIG_IGN)."""
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def start_new_session():
+    """Puts a child process into its own session (and process group), and ignores SIGINT in it."""
+
+    os.setsid()
+    ignore_sigint()
+
+
+def get_ansible_run_env(run_env):
+    """Adds the folders that might contain ansible to the PATH, same as the 'run_all_plays.sh' script does.
+
+    Args:
+      run_env (dict): the environment variables for the ansible process
+
+    Returns:
+      dict: a copy of the environment variables, with the PATH adjusted
+    """
+
+    result = run_env.copy()
+    paths = []
+    for path in ANSIBLE_PATH_DIRS:
+        path = os.path.expanduser(path)
+        if os.path.isdir(path):
+            paths.append(path)
+    paths.append(result.get("PATH", os.defpath))
+    result["PATH"] = os.pathsep.join(paths)
+
+    return result
+
+
+def create_callback_adapter(nsbl, callback, display_sub_tasks=True, display_skipped_tasks=True,
+                            display_ignore_tasks=[]):
+    """Creates the object that processes the output of an ansible run with the specified callback.
+
+    Args:
+      nsbl (Nsbl): the Nsbl object of the run
+      callback (str): the name of the ansible stdout callback
+      display_sub_tasks (bool): whether to display subtasks in the output
+      display_skipped_tasks (bool): whether to display skipped tasks in the output
+      display_ignore_tasks (list): a list of strings that indicate task titles that should be ignored
+
+    Returns:
+      object: a NsblLogCallbackAdapter for the 'nsbl_internal' callback, a NsblPrintCallbackAdapter otherwise
+    """
+
+    if callback == "nsbl_internal":
+        return NsblLogCallbackAdapter(nsbl.get_lookup_index(), display_sub_tasks=display_sub_tasks,
+                                      display_skipped_tasks=display_skipped_tasks,
+                                      display_ignore_tasks=display_ignore_tasks)
+    else:
+        return NsblPrintCallbackAdapter()
+
+
+def _probe_passwordless_sudo():
+    """Checks if the user can use passwordless sudo on this host, without using the cache."""
 
     if os.geteuid() == 0:
         return True
 
     FNULL = open(os.devnull, 'w')
     # use -k to ignore any existing sudo token
-    p = subprocess.Popen('sudo -k -n true', shell=True, stdout=FNULL, stderr=subprocess.STDOUT, close_fds=True)
+    try:
+        p = subprocess.Popen(['sudo', '-k', '-n', 'true'], stdout=FNULL, stderr=subprocess.STDOUT, close_fds=True)
+    except OSError:
+        # no sudo installed
+        return False
     r = p.wait()
     return r == 0
 
 
+def _read_sudo_probe_cache_file(cache_file, ttl):
+
+    try:
+        if os.stat(cache_file).st_uid != os.getuid():
+            log.debug("Ignoring sudo probe cache file not owned by current user: {}".format(cache_file))
+            return None
+        with open(cache_file) as f:
+            cached = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if cached.get("uid", None) != os.getuid() or time.time() - cached.get("timestamp", 0) > ttl:
+        return None
+
+    return cached.get("result", None)
+
+
+def _write_sudo_probe_cache_file(cache_file, result, timestamp):
+
+    cache_dir = os.path.dirname(os.path.abspath(cache_file))
+    try:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        fd, temp_file = tempfile.mkstemp(dir=cache_dir, prefix=".sudo_probe_")
+        with os.fdopen(fd, "w") as f:
+            f.write(json.dumps({"uid": os.getuid(), "result": result, "timestamp": timestamp}))
+        os.rename(temp_file, cache_file)
+    except (IOError, OSError) as e:
+        log.debug("Could not write sudo probe cache file '{}': {}".format(cache_file, e))
+
+
+def prime_sudo_probe_cache(result=None, cache_file=SUDO_PROBE_CACHE_FILE):
+    """Sets the cached result of the passwordless sudo check.
+
+    Useful for tools that render a lot of environments and already know the answer (or want to check once up front).
+
+    Args:
+      result (bool): the result to cache, if None the check is run
+      cache_file (str): the file to share the result with other processes (optional)
+
+    Returns:
+      bool: the cached result
+    """
+
+    with SUDO_PROBE_LOCK:
+        if result is None:
+            result = _probe_passwordless_sudo()
+        timestamp = time.time()
+        SUDO_PROBE_CACHE["result"] = result
+        SUDO_PROBE_CACHE["timestamp"] = timestamp
+        if cache_file:
+            _write_sudo_probe_cache_file(cache_file, result, timestamp)
+
+    return result
+
+
+def can_passwordless_sudo(ttl=SUDO_PROBE_CACHE_TTL, cache_file=SUDO_PROBE_CACHE_FILE):
+    """Checks if the user can use passwordless sudo on this host.
+
+    The result is cached for 'ttl' seconds within this process, and, if a cache file is specified, also shared
+    with other processes using the same file.
+
+    Args:
+      ttl (int): how long (in seconds) a cached result is valid, 0 to always run the check
+      cache_file (str): the file to share the result with other processes (optional)
+
+    Returns:
+      bool: whether passwordless sudo is possible
+    """
+
+    with SUDO_PROBE_LOCK:
+        if ttl > 0:
+            if SUDO_PROBE_CACHE and time.time() - SUDO_PROBE_CACHE["timestamp"] <= ttl:
+                return SUDO_PROBE_CACHE["result"]
+            if cache_file:
+                result = _read_sudo_probe_cache_file(cache_file, ttl)
+                if result is not None:
+                    SUDO_PROBE_CACHE["result"] = result
+                    SUDO_PROBE_CACHE["timestamp"] = time.time()
+                    return result
+
+        # still holding the lock, so concurrent callers wait for this check instead of running their own
+        return prime_sudo_probe_cache(cache_file=cache_file)
+
 
 def get_git_auto_dest_name(repo, parent_dir="~"):
     """Extracts the package/repo name out of a git repo and returns the suggested path where the local copy should live
@@ -227,9 +390,13 @@ class Nsbl(FrklCallback):
     def create(config, role_repos=[], task_descs=[], include_parent_meta=False, include_parent_vars=False,
                default_env_type=DEFAULT_ENV_TYPE,
                pre_chain=[UrlAbbrevProcessor(), EnsureUrlProcessor(), EnsurePythonObjectProcessor()],
-               wrap_into_hosts=[], additional_roles=[]):
+               wrap_into_hosts=[], additional_roles=[], use_plan_cache=False, plan_cache_dir=PLAN_CACHE_DIR):
         """"Utility method to create a Nsbl object out of the configuration and some metadata about how to process that configuration.
 
+        If 'use_plan_cache' is set, the processed object is cached, keyed by a hash of all inputs (including the
+        content of configuration files and an index of the role repositories). Creating an object with unchanged
+        inputs loads the cached object instead of processing the configuration again.
+
         Args:
           config (list): a list of configuration items
           role_repos (list): a list of all locally available role repos
@@ -240,14 +407,35 @@ class Nsbl(FrklCallback):
           pre_chain (list): the chain of ConfigProcessors to plug in front of the one that is used internally, needs to return a python list
           wrap_into_hosts (list): whether to wrap the input configuration into a a list of hosts, for convenience, default: []
           additional_roles (list): a list of additional roles that should always be added to the ansible environment
+          use_plan_cache (bool): whether to use the plan cache
+          plan_cache_dir (str): the folder that contains the cached plans
         Returns:
           Nsbl: the Nsbl object, already 'processed'
         """
 
+        plan_key = None
+        if use_plan_cache:
+            timer = PhaseTimer()
+            with timer.span("plan_cache"):
+                create_args = {"include_parent_meta": include_parent_meta,
+                               "include_parent_vars": include_parent_vars, "default_env_type": default_env_type,
+                               "pre_chain": [p.__class__.__name__ for p in pre_chain],
+                               "wrap_into_hosts": wrap_into_hosts, "additional_roles": additional_roles}
+                # same role repos as 'validate_init' will use
+                key_role_repos = role_repos if role_repos else calculate_role_repos([], use_default_roles=True)
+                plan_key = calculate_plan_key(config, key_role_repos, task_descs, create_args)
+                nsbl = load_plan(plan_key, plan_cache_dir) if plan_key else None
+            if nsbl is not None:
+                log.debug("Using cached plan: {}".format(plan_key))
+                nsbl.timer = timer
+                return nsbl
+
         init_params = {"task_descs": task_descs, "role_repos": role_repos, "include_parent_meta": include_parent_meta,
                        "include_parent_vars": include_parent_vars, "default_env_type": default_env_type,
                        "additional_roles": additional_roles}
         nsbl = Nsbl(init_params)
+        if use_plan_cache:
+            nsbl.timer = timer
 
         # if not wrap_into_localhost_env:
         if not wrap_into_hosts:
@@ -257,7 +445,11 @@ class Nsbl(FrklCallback):
             wrap_processor = WrapTasksIntoHostsProcessor({ENV_HOSTS_KEY: wrap_into_hosts})
             chain = pre_chain + [wrap_processor, FrklProcessor(NSBL_INVENTORY_BOOTSTRAP_FORMAT)]
         inv_frkl = Frkl(config, chain)
-        temp = inv_frkl.process(nsbl)
+        with nsbl.timer.span("create"):
+            temp = inv_frkl.process(nsbl)
+
+        if plan_key:
+            save_plan(plan_key, nsbl, plan_cache_dir)
 
         return nsbl
 
@@ -282,6 +474,8 @@ class Nsbl(FrklCallback):
         self.inventory = NsblInventory(init_params)
         self.plays = {}
         self.use_become = False
+        # records the time spent in the different phases of creating the environment
+        self.timer = PhaseTimer()
 
     def validate_init(self):
 
@@ -306,7 +500,8 @@ class Nsbl(FrklCallback):
 
     def finished(self):
 
-        self.inventory.finished()
+        with self.timer.span("inventory"):
+            self.inventory.finished()
         # this creates the task-description dictionary which is used to enable easier to use commands, and overlays of parameters
         task_format = generate_nsbl_tasks_format(self.task_descs)
         # we have several task lists, each with its own environment associated
@@ -320,9 +515,11 @@ class Nsbl(FrklCallback):
             init_params = {"role_repos": self.role_repos, "task_descs": self.task_descs, "env_name": env_name,
                            "env_id": env_id, TASKS_META_KEY: meta}
             tasks_collector = NsblTasks(init_params)
-            add_roles(tasks_collector.all_ansible_roles, self.additional_roles, self.role_repos)
+            play_name = "{}_{}".format(env_name, env_id)
+            with self.timer.span("additional_roles", env=play_name):
+                add_roles(tasks_collector.all_ansible_roles, self.additional_roles, self.role_repos)
 
-            self.plays["{}_{}".format(env_name, env_id)] = tasks_collector
+            self.plays[play_name] = tasks_collector
             # we already have python objects as config items here, so no other ConfigProcessors necessary
             chain = [FrklProcessor(task_format), NsblTaskProcessor(init_params), NsblCapitalizedBecomeProcessor(),
                      NsblDynamicRoleProcessor(init_params)]
@@ -340,7 +537,9 @@ class Nsbl(FrklCallback):
             # wrapping the tasks in a list so the 'base-vars' don't get inherited
             tasks_frkl = Frkl([task_config], chain)
 
-            result = tasks_frkl.process(tasks_collector)
+            # resolving the tasks into (dynamic) roles happens in the processors of this chain
+            with self.timer.span("tasks", env=play_name):
+                result = tasks_frkl.process(tasks_collector)
             if tasks_collector.use_become:
                 self.use_become = True
 
@@ -351,9 +550,14 @@ class Nsbl(FrklCallback):
 
     def render(self, env_dir, extra_plugins=None, extract_vars=True, force=False, ask_become_pass="yes",
                ansible_args="", callback='default', force_update_roles=False, add_timestamp_to_env=False,
-               add_symlink_to_env=False):
+               add_symlink_to_env=False, render_target=None, timer=None, write_timings=False, output_to_stderr=False):
         """Creates the ansible environment in the folder provided.
 
+        By default, the environment is written into the local filesystem. Another render target (e.g. an
+        'InMemoryRenderTarget' or a 'TarballRenderTarget') can be provided to create the environment without
+        writing it to disk, in which case 'env_dir' is only used to calculate the paths within the environment.
+        External roles are still downloaded into the (local) role cache.
+
         Args:
           env_dir (str): the folder where the environment should be created
           extra_plugins (str): a path to a repository of extra ansible plugins, if necessary
@@ -365,8 +569,20 @@ class Nsbl(FrklCallback):
           force_update_roles (bool): whether to overwrite external roles that were already downloaded
           add_timestamp_to_env (bool): whether to add a timestamp to the env_dir -- useful for when this is called from other programs (e.g. freckles)
           add_symlink_to_env (bool): whether to add a symlink to the current env from a fixed location (useful to archive all runs/logs)
+          render_target (RenderTarget): the target to write the environment to (default: the local filesystem)
+          timer (PhaseTimer): the timer to record the duration of the render phases in (default: a new one, containing the spans of the creation of this object)
+          write_timings (bool): whether to write the phase durations into a json file in the environment folder
+          output_to_stderr (bool): whether to display the progress of downloading external roles on stderr instead of stdout (e.g. because stdout is used for machine readable output)
+
+        Returns:
+          dict: details about the rendered environment, including the phase durations under the 'timings' key
         """
 
+        if render_target is None:
+            render_target = FileSystemRenderTarget()
+        if timer is None:
+            timer = PhaseTimer(self.timer.spans)
+
         if isinstance(ask_become_pass, bool):
             ask_become_pass = str(ask_become_pass)
 
@@ -388,8 +604,31 @@ class Nsbl(FrklCallback):
         result = {}
         result['env_dir'] = env_dir
 
-        if os.path.exists(env_dir) and force:
-            shutil.rmtree(env_dir)
+        render_target.open(env_dir)
+        try:
+            with timer.span("render"):
+                self._render(result, render_target, timer, extra_plugins=extra_plugins, extract_vars=extract_vars,
+                             force=force, ask_become_pass=ask_become_pass, ansible_args=ansible_args,
+                             callback=callback, force_update_roles=force_update_roles,
+                             add_symlink_to_env=add_symlink_to_env, output_to_stderr=output_to_stderr)
+            result["timings"] = timer.as_dict()
+            if write_timings:
+                render_target.write_file(os.path.join(env_dir, TIMINGS_FILENAME), timer.to_json())
+        finally:
+            render_target.close()
+
+        return result
+
+    def _render(self, result, render_target, timer, extra_plugins, extract_vars, force, ask_become_pass,
+                ansible_args, callback, force_update_roles, add_symlink_to_env, output_to_stderr):
+
+        env_dir = result["env_dir"]
+
+        if render_target.exists(env_dir):
+            if not force:
+                raise NsblException(
+                    "Environment folder '{}' already exists, use 'force' to overwrite it.".format(env_dir))
+            render_target.remove_tree(env_dir)
 
         inventory_dir = os.path.join(env_dir, "inventory")
         result["inventory_dir"] = inventory_dir
@@ -415,6 +654,7 @@ class Nsbl(FrklCallback):
                 ask_sudo = "--ask-become-pass"
         else:
             ask_sudo = ""
+        result["ask_become_pass"] = bool(ask_sudo)
 
         all_plays_name = "all_plays.yml"
         result["default_playbook_name"] = all_plays_name
@@ -459,52 +699,55 @@ class Nsbl(FrklCallback):
 
         template_path = os.path.join(os.path.dirname(__file__), "external", "cookiecutter-ansible-environment")
 
-        cookiecutter(template_path, extra_context=cookiecutter_details, no_input=True)
+        with timer.span("env_template"):
+            render_target.render_template(template_path, cookiecutter_details, os.path.dirname(env_dir))
 
         if add_symlink_to_env:
             link_path = os.path.expanduser(add_symlink_to_env)
-            if os.path.exists(link_path) and force:
-                os.unlink(link_path)
-            link_parent = os.path.abspath(os.path.join(link_path, os.pardir))
-            try:
-                os.makedirs(link_parent)
-            except:
-                pass
-            os.symlink(env_dir, link_path)
+            render_target.link_env(link_path, force=force)
 
         # write inventory
-        if extract_vars:
-            self.inventory.extract_vars(inventory_dir)
-
+        with timer.span("inventory_files"):
+            if extract_vars:
+                self.inventory.extract_vars(inventory_dir, render_target=render_target)
 
-        self.inventory.write_inventory_file_or_script(inventory_dir, extract_vars=extract_vars)
+            self.inventory.write_inventory_file_or_script(inventory_dir, extract_vars=extract_vars,
+                                                          render_target=render_target)
 
 
         # write roles
         all_playbooks = []
-        ext_roles = False
+        playbooks = {}
+        ext_roles = []
         roles_to_copy = {}
         task_details = []
         for play, tasks in self.plays.items():
 
             task_details.append(str(tasks))
-            playbook = tasks.render_playbook(playbook_dir)
+            with timer.span("playbook", env=play):
+                playbook = tasks.render_playbook(playbook_dir, render_target=render_target)
             all_playbooks.append(playbook)
-            tasks.render_roles(roles_base_dir)
+            playbooks[play] = playbook
+            with timer.span("dynamic_roles", env=play):
+                tasks.render_roles(roles_base_dir, render_target=render_target)
             if tasks.roles_to_copy:
                 dict_merge(roles_to_copy, tasks.roles_to_copy, copy_dct=False)
-            if tasks.ext_roles:
-                ext_roles = True
+            for role in tasks.get_external_roles():
+                _add_role_check_duplicates(ext_roles, dict(role))
 
         result["task_details"] = task_details
+        result["playbooks"] = playbooks
 
-        jinja_env = Environment(loader=PackageLoader('nsbl', 'templates'))
-        template = jinja_env.get_template('play.yml')
+        template = get_jinja_env().get_template('play.yml')
         output_text = template.render(playbooks=all_playbooks)
         all_plays_file = os.path.join(env_dir, "plays", all_plays_name)
         result["all_plays_file"] = all_plays_file
-        with open(all_plays_file, "w") as text_file:
-            text_file.write(output_text)
+        render_target.write_file(all_plays_file, output_text)
+
+        # needed to display the event log of a run later on (see 'nsbl replay')
+        lookup_index_file = os.path.join(env_dir, LOOKUP_INDEX_FILENAME)
+        result["lookup_index_file"] = lookup_index_file
+        render_target.write_file(lookup_index_file, json.dumps(self.get_lookup_index().to_list()))
 
         # copy extra_plugins
         library_path = os.path.join(os.path.dirname(__file__), "external", "extra_plugins", "library")
@@ -518,41 +761,61 @@ class Nsbl(FrklCallback):
         if extra_plugins:
             dirs = [o for o in os.listdir(extra_plugins) if os.path.isdir(os.path.join(extra_plugins, o))]
             for d in dirs:
-                shutil.copytree(os.path.join(extra_plugins, d), os.path.join(target_dir, d))
+                render_target.copy_tree(os.path.join(extra_plugins, d), os.path.join(target_dir, d))
 
+        entries_lock = None
         if ext_roles:
-            # download external roles
-            click.echo("\nDownloading external roles...")
-            role_requirement_file = os.path.join(env_dir, "roles", "roles_requirements.yml")
-
-            if not os.path.exists(ANSIBLE_ROLE_CACHE_DIR):
-                os.makedirs(ANSIBLE_ROLE_CACHE_DIR)
-
-            command = ["ansible-galaxy", "install", "-r", role_requirement_file, "-p", ANSIBLE_ROLE_CACHE_DIR]
-            if force_update_roles:
-                command.append("--force")
-            log.debug("Downloading and installing external roles...")
-            my_env = os.environ.copy()
-            my_env["PATH"] = "{}:{}:{}".format(os.path.expanduser("~/.local/bin"),
-                                               os.path.expanduser("~/.local/inaugurate/bin"), my_env["PATH"])
-
-            res = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
-                                   env=my_env)
-            for line in iter(res.stdout.readline, ""):
-                if "already installed" not in line and "--force to change" not in line:
-                    # log.debug("Installing role: {}".format(line.encode('utf8')))
-                    click.echo("  {}".format(line.encode('utf8')), nl=False)
-
-        if roles_to_copy.get("internal", {}):
-            for src, target in roles_to_copy["internal"].items():
-                log.debug("Coping internal role: {} -> {}".format(src, target))
-                shutil.copytree(src, target)
-        if roles_to_copy.get("external", {}):
-            for src, target in roles_to_copy["external"].items():
-                log.debug("Coping external role: {} -> {}".format(src, target))
-                shutil.copytree(src, target)
+            # download external roles, if they are not in the role cache already, and make sure their role store
+            # entries can't be pruned (by any process) before they are copied
+            role_requirement_file = os.path.join(roles_base_dir, ROLE_REQUIREMENTS_FILENAME)
+            result["role_requirements_file"] = role_requirement_file
+            with timer.span("external_roles"):
+                entries_lock = lock_external_roles(ext_roles, role_requirement_file,
+                                                   env_dir=env_dir if render_target.is_local() else None,
+                                                   force_update_roles=force_update_roles,
+                                                   render_target=render_target, output_to_stderr=output_to_stderr)
 
-        return result
+        try:
+            with timer.span("role_copies"):
+                if roles_to_copy.get("internal", {}):
+                    for src, target in roles_to_copy["internal"].items():
+                        log.debug("Coping internal role: {} -> {}".format(src, target))
+                        render_target.copy_tree(src, target)
+                if roles_to_copy.get("external", {}):
+                    for src, target in roles_to_copy["external"].items():
+                        log.debug("Coping external role: {} -> {}".format(src, target))
+                        render_target.copy_tree(src, target)
+        finally:
+            if entries_lock is not None:
+                entries_lock.release()
+
+        if ext_roles:
+            prune_role_store_if_needed(exclude=[get_role_store_key(role) for role in ext_roles])
+
+    def get_play_chains(self):
+        """Splits all plays into chains of plays that can be run in parallel to each other.
+
+        Plays whose environments (groups/hosts) share at least one host end up in the same chain,
+        and will be executed one after the other, in the order they were defined in.
+
+        Returns:
+          list: a list of chains, each one a list of play names
+        """
+
+        chains = []
+        for play, tasks in sorted(self.plays.items(), key=lambda x: x[1].env_id):
+            hosts = self.inventory.get_hosts(tasks.env_name)
+            chain_hosts = set(hosts)
+            chain_plays = []
+            for other_hosts, other_plays in [c for c in chains if c[0] & hosts]:
+                chains.remove((other_hosts, other_plays))
+                chain_hosts |= other_hosts
+                chain_plays.extend(other_plays)
+            chain_plays.append(play)
+            chain_plays.sort(key=lambda p: self.plays[p].env_id)
+            chains.append((chain_hosts, chain_plays))
+
+        return [chain_plays for chain_hosts, chain_plays in chains]
 
     def get_lookup_dict(self):
 
@@ -567,6 +830,28 @@ class Nsbl(FrklCallback):
 
         return result
 
+    def get_lookup_index(self):
+        """Returns a flat index of the names (and descriptions) of all environments, roles and dynamic role tasks.
+
+        This contains only the parts of the lookup dict that are needed to display the output of a run.
+
+        Returns:
+          LookupIndex: the index
+        """
+
+        index = LookupIndex()
+        for play, tasks in self.plays.items():
+            index.add_env(tasks.env_id, tasks.env_name)
+            for role in tasks.roles:
+                index.add_role(tasks.env_id, role.role_id, role.name, role.role_type,
+                               role.meta_dict.get(TASK_DESC_KEY, None))
+                for task in role.tasks:
+                    meta = task[TASKS_META_KEY]
+                    index.add_task(tasks.env_id, role.role_id, meta[DYN_TASK_ID_KEY],
+                                   meta.get(TASK_META_NAME_KEY, None), meta.get(TASK_DESC_KEY, None))
+
+        return index
+
 
 class NsblRunner(object):
     def __init__(self, nsbl):
@@ -580,7 +865,9 @@ class NsblRunner(object):
 
     def run(self, target, force=True, ansible_verbose="", ask_become_pass="true", extra_plugins=None, callback=None,
             add_timestamp_to_env=False, add_symlink_to_env=False, no_run=False, display_sub_tasks=True,
-            display_skipped_tasks=True, display_ignore_tasks=[], pre_run_callback=None):
+            display_skipped_tasks=True, display_ignore_tasks=[], pre_run_callback=None, parallel=False,
+            max_parallel_plays=DEFAULT_MAX_PARALLEL_PLAYS, write_timings=False, write_event_log=True,
+            write_metrics=True, display_metrics=False, event_sinks=[], progress_format="text", progress_file=None):
         """Starts the ansible run, executing all generated playbooks.
 
         By default the 'nsbl_internal' ansible callback is used, which outputs easier to read outputs/results. You can, however,
@@ -600,26 +887,49 @@ class NsblRunner(object):
           extra_plugins (str): a repository of extra ansible plugins to use
           display_ignore_tasks (list): a list of strings that indicate task titles that should be ignored when displaying the task log (using the default nsbl output plugin -- this is ignored with other output callbacks)
           pre_run_callback (function): a callback to execute after the environment is rendered, but before the run is kicked off
+          parallel (bool): whether to run the playbooks of environments that don't share any hosts in parallel, each in its own 'ansible-playbook' process (not possible if a sudo password needs to be asked for)
+          max_parallel_plays (int): the maximum number of 'ansible-playbook' processes to run at the same time in parallel mode
+          write_timings (bool): whether to write the phase durations into a json file in the environment folder
+          write_event_log (bool): whether to write all structured events of the run (only available with the 'nsbl_internal' callback) into a compressed log in the environment folder
+          write_metrics (bool): whether to measure the durations of all environments, roles, tasks and items of the run (only available with the 'nsbl_internal' callback, and not in parallel mode), and write them into the environment folder
+          display_metrics (bool): whether to display a table of the measured durations after the run
+          event_sinks (list): additional 'EventSink' objects (e.g. a 'WebhookSink') that receive the output of the run
+          progress_format (str): 'text' to display the output of the run in the terminal, 'jsonl' to write one json record per finished environment, role, task and item instead (see 'JsonlProgressSink', implies the 'nsbl_internal' callback)
+          progress_file (object): the file object or file descriptor the 'jsonl' progress records are written to, defaults to stdout
 
         Return:
-          dict: the parameters of the run
+          dict: the parameters of the run, including the phase durations under the 'timings' key, the path to the event log (if written) under the 'event_log' key, and the duration metrics (if measured) under the 'metrics' key
         """
+        if progress_format not in PROGRESS_FORMATS:
+            raise NsblException("Invalid progress format '{}', valid: {}".format(progress_format, PROGRESS_FORMATS))
+        text_output = progress_format == "text"
         if callback == None:
-            callback = "default"
-
-        if callback == "nsbl_internal":
-            lookup_dict = self.nsbl.get_lookup_dict()
-            callback_adapter = NsblLogCallbackAdapter(lookup_dict, display_sub_tasks=display_sub_tasks,
-                                                      display_skipped_tasks=display_skipped_tasks,
-                                                      display_ignore_tasks=display_ignore_tasks)
-        else:
-            callback_adapter = NsblPrintCallbackAdapter()
-
+            callback = "default" if text_output else "nsbl_internal"
+        if not text_output and callback != "nsbl_internal":
+            raise NsblException("Progress format '{}' needs the 'nsbl_internal' callback.".format(progress_format))
+
+        timer = PhaseTimer(self.nsbl.timer.spans)
+        parameters = None
+
+        # no terminal handling at all if the output is not text
+        callback_adapter = None
+        if text_output:
+            callback_adapter = create_callback_adapter(self.nsbl, callback, display_sub_tasks=display_sub_tasks,
+                                                       display_skipped_tasks=display_skipped_tasks,
+                                                       display_ignore_tasks=display_ignore_tasks)
+        # ansible's stderr would end up between the progress records otherwise
+        stderr = sys.stdout.fileno() if text_output else sys.stderr.fileno()
+
+        procs = []
+        metrics = None
+        bus = None
+        display = None
         try:
             parameters = self.nsbl.render(target, extract_vars=True, force=force, ansible_args=ansible_verbose,
                                           ask_become_pass=ask_become_pass, extra_plugins=extra_plugins,
                                           callback=callback, add_timestamp_to_env=add_timestamp_to_env,
-                                          add_symlink_to_env=add_symlink_to_env)
+                                          add_symlink_to_env=add_symlink_to_env, timer=timer,
+                                          output_to_stderr=not text_output)
             env_dir = parameters["env_dir"]
             if pre_run_callback:
                 pre_run_callback(env_dir)
@@ -632,37 +942,183 @@ class NsblRunner(object):
             if callback.startswith("nsbl_internal"):
                 run_env['NSBL_ENVIRONMENT'] = "true"
 
-            def preexec_function():
-                # Ignore the SIGINT signal by setting the handler to the standard
-                # signal handler SIG_IGN.
-                signal.signal(signal.SIGINT, signal.SIG_IGN)
+            if parallel and parameters["ask_become_pass"]:
+                log.warning("Can't run plays in parallel when asking for the sudo password, running them sequentially.")
+                parallel = False
+
+            # every sink processes the output in its own thread, so the reader only has to queue it
+            structured_output = not text_output or isinstance(callback_adapter, NsblLogCallbackAdapter)
+            if not text_output:
+                # see below, why durations are meaningless in parallel mode
+                sinks = [JsonlProgressSink(self.nsbl.get_lookup_index(), progress_file, durations=not parallel)]
+            elif parallel and structured_output:
+                # displays the output of every play while it runs, instead of the adapter
+                display = MultiplexedDisplay(self.nsbl.get_lookup_index(), display_sub_tasks=display_sub_tasks,
+                                             display_skipped_tasks=display_skipped_tasks,
+                                             display_ignore_tasks=display_ignore_tasks)
+                sinks = []
+            else:
+                sinks = [CallbackAdapterSink(callback_adapter)]
+            if write_event_log and structured_output:
+                event_log = EventLogWriter(os.path.join(env_dir, EVENT_LOG_FILENAME))
+                sinks.append(EventLogSink(event_log))
+                parameters["event_log"] = event_log.path
+
+            # in parallel mode, the output of a play is only forwarded once it finished, so the time events arrive
+            # at doesn't say anything about how long tasks took
+            if write_metrics and not parallel and structured_output:
+                metrics = RunMetrics(self.nsbl.get_lookup_index())
+                sinks.append(MetricsSink(metrics))
+
+            bus = EventBus(sinks + list(event_sinks))
+
+            if parallel:
+                with CursorOff(enabled=text_output), timer.span("ansible"):
+                    if text_output:
+                        click.echo("")
+                    if display is not None:
+                        display.start()
+                    return_codes = self.run_parallel(parameters, run_env, bus, max_parallel_plays, procs,
+                                                     timer=timer, stderr=stderr, display=display)
+                    if display is not None:
+                        display.close()
+                    bus.finish_up()
+
+                parameters["return_codes"] = return_codes
+                failed = [return_codes[play] for play in sorted(return_codes.keys(),
+                                                                key=lambda p: self.nsbl.plays[p].env_id)
+                          if return_codes[play] != 0]
+                parameters["return_code"] = failed[0] if failed else 0
+                return parameters
 
             script = parameters['run_playbooks_script']
             # proc = subprocess.Popen(script, stdout=subprocess.PIPE, stderr=sys.stdout.fileno(), stdin=subprocess.PIPE, shell=True, env=run_env, preexec_fn=os.setsid)
-            proc = subprocess.Popen(script, stdout=subprocess.PIPE, stderr=sys.stdout.fileno(), stdin=subprocess.PIPE,
-                                    shell=True, env=run_env, preexec_fn=preexec_function)
+            proc = subprocess.Popen(script, stdout=subprocess.PIPE, stderr=stderr, stdin=subprocess.PIPE,
+                                    shell=True, env=run_env, preexec_fn=ignore_sigint)
+            procs.append(proc)
 
-            with CursorOff():
-                click.echo("")
-                for line in iter(proc.stdout.readline, ''):
-                    callback_adapter.add_log_message(line)
+            with CursorOff(enabled=text_output), timer.span("ansible"):
+                if text_output:
+                    click.echo("")
+                for lines in iter_line_batches(proc.stdout):
+                    bus.add_log_messages(lines)
 
-                callback_adapter.finish_up()
+                bus.finish_up()
 
-            while proc.poll() is None:
-                # Process hasn't exited yet, let's wait some
-                time.sleep(0.5)
-
-            # Get return code from process
-            return_code = proc.returncode
+                # stdout is closed, so the process is about to exit (or has already)
+                return_code = proc.wait()
 
             parameters["return_code"] = return_code
 
         except KeyboardInterrupt:
             # proc.terminate()
-            os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
+            for proc in procs:
+                if proc.poll() is None:
+                    os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
             # proc.send_signal(signal.SIGINT)
-            callback_adapter.add_error_message("\n\nKeyboard interrupt received. Exiting...\n")
-            pass
+            message = "\n\nKeyboard interrupt received. Exiting...\n"
+            if display is not None:
+                display.close()
+                click.echo(message)
+            elif bus is not None:
+                bus.add_error_message(message)
+            elif callback_adapter is not None:
+                callback_adapter.add_error_message(message)
+        finally:
+            if display is not None:
+                display.close()
+            if bus is not None:
+                # only still open if the run didn't finish
+                bus.close(aborted=True)
+            if metrics is not None and parameters is not None:
+                summary = metrics.get_summary()
+                parameters["metrics"] = summary
+                metrics.write_json(os.path.join(parameters["env_dir"], METRICS_FILENAME))
+                metrics.write_table(os.path.join(parameters["env_dir"], METRICS_TABLE_FILENAME))
+                if display_metrics and text_output:
+                    click.echo("")
+                    click.echo(metrics.format_table(summary))
+            if parameters is not None:
+                parameters["timings"] = timer.as_dict()
+                if write_timings:
+                    timer.write_json(os.path.join(parameters["env_dir"], TIMINGS_FILENAME))
 
         return parameters
+
+    def run_parallel(self, parameters, run_env, callback_adapter, max_parallel_plays=DEFAULT_MAX_PARALLEL_PLAYS,
+                     procs=None, timer=None, stderr=None, display=None):
+        """Runs the playbook of every environment in its own 'ansible-playbook' process.
+
+        Plays whose environments share hosts are run one after the other (see 'Nsbl.get_play_chains'),
+        if one of those fails, the remaining plays of its chain are not started. Independent chains are run
+        in parallel. The output of every play is forwarded to the callback adapter once the play finished,
+        so the output of different plays doesn't get mixed up. If a display is provided, the output of every play
+        is also forwarded to it (via its own adapter) while the play runs.
+
+        Args:
+          parameters (dict): the result of the 'Nsbl.render' call for the environment
+          run_env (dict): the environment variables for the 'ansible-playbook' processes
+          callback_adapter (object): the adapter that handles the output of the processes
+          max_parallel_plays (int): the maximum number of 'ansible-playbook' processes to run at the same time
+          procs (list): an (optional) list all started processes are added to
+          timer (PhaseTimer): an (optional) timer to record the duration of every play in
+          stderr (int): the file descriptor the stderr of the processes is sent to, defaults to the one of stdout
+          display (MultiplexedDisplay): an (optional) display the output of every play is forwarded to while it runs
+
+        Returns:
+          dict: the play names as keys, the return codes of the plays as values (None if the play was not started)
+        """
+
+        if procs is None:
+            procs = []
+        if timer is None:
+            timer = PhaseTimer()
+        if stderr is None:
+            stderr = sys.stdout.fileno()
+
+        playbook_dir = parameters["playbook_dir"]
+        ansible_args = shlex.split(parameters["ansible_playbook_cli_args"] or "")
+        run_env = get_ansible_run_env(run_env)
+        output_lock = threading.Lock()
+        return_codes = {}
+
+        def run_chain(chain):
+            for play in chain:
+                if any((return_codes.get(p, 0) != 0 for p in chain)):
+                    log.debug("Not running play '{}', a previous play of the same hosts failed.".format(play))
+                    return_codes[play] = None
+                    continue
+
+                command = ["ansible-playbook"] + ansible_args + [parameters["playbooks"][play]]
+                log.debug("Running play '{}': {}".format(play, command))
+                with timer.span("play", env=play):
+                    env_adapter = None
+                    if display is not None:
+                        env_adapter = display.add_env(play, self.nsbl.plays[play].env_id)
+                    proc = subprocess.Popen(command, cwd=playbook_dir, stdout=subprocess.PIPE,
+                                            stderr=stderr, stdin=subprocess.PIPE, env=run_env,
+                                            preexec_fn=start_new_session)
+                    procs.append(proc)
+                    output = []
+                    for lines in iter_line_batches(proc.stdout):
+                        output.extend(lines)
+                        if env_adapter is not None:
+                            forward_log_messages(env_adapter, lines)
+                    return_code = proc.wait()
+                    if env_adapter is not None:
+                        env_adapter.finish_up()
+                        display.finish_env(play)
+
+                with output_lock:
+                    forward_log_messages(callback_adapter, output)
+                return_codes[play] = return_code
+
+        chains = self.nsbl.get_play_chains()
+        pool = ThreadPool(max(1, min(max_parallel_plays, len(chains))))
+        try:
+            # using 'map_async' so a KeyboardInterrupt doesn't get swallowed while waiting
+            pool.map_async(run_chain, chains).get(PARALLEL_PLAYS_TIMEOUT)
+        finally:
+            pool.close()
+
+        return return_codes
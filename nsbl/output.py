@@ -2,15 +2,26 @@
 
 import json
 import logging
+import os
+import pickle
 import pprint
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 
 import click
 import cursor
-from six import string_types
+from six import binary_type, string_types, text_type
 
 from .defaults import *
+from .lookup_index import LookupIndex
+
+try:
+    import ujson as fast_json
+except ImportError:
+    fast_json = None
 
 log = logging.getLogger("nsbl")
 
@@ -19,12 +30,85 @@ if not ENCODING:
     ENCODING = "utf-8"
 
 
+def decode_event(line):
+    """Decodes a (json) event line, using a faster json parser if one is installed.
+
+    Args:
+      line (str): the line
+
+    Returns:
+      dict: the event
+    """
+
+    if fast_json is not None:
+        try:
+            return fast_json.loads(line)
+        except ValueError:
+            # the standard parser is a bit more lenient, and has better error messages
+            pass
+
+    return json.loads(line)
+
+
+def encode_output_line(line):
+
+    return line.encode(ENCODING, errors='replace').strip()
+
+
+def iter_line_batches(stream, chunk_size=OUTPUT_READ_CHUNK_SIZE):
+    """Reads a stream in chunks, and yields all complete lines of every chunk as one batch.
+
+    This doesn't wait until a whole chunk could be read, so lines are yielded as soon as they are available.
+
+    Args:
+      stream (file): the stream to read (e.g. the stdout pipe of a process)
+      chunk_size (int): maximum number of bytes to read at once
+
+    Returns:
+      generator: lists of lines (including their line endings)
+    """
+
+    fd = stream.fileno()
+    rest = b""
+    while True:
+        chunk = os.read(fd, chunk_size)
+        if not chunk:
+            break
+        lines = (rest + chunk).splitlines(True)
+        if lines[-1].endswith(b"\n"):
+            rest = b""
+        else:
+            rest = lines.pop()
+        if lines:
+            yield lines
+
+    if rest:
+        yield [rest]
+
+
+def forward_log_messages(callback_adapter, lines):
+    """Forwards a batch of output lines to a callback adapter, in one call if the adapter supports that."""
+
+    add_log_messages = getattr(callback_adapter, "add_log_messages", None)
+    if add_log_messages is not None:
+        add_log_messages(lines)
+    else:
+        for line in lines:
+            callback_adapter.add_log_message(line)
+
+
 class CursorOff(object):
+    def __init__(self, enabled=True):
+
+        self.enabled = enabled
+
     def __enter__(self):
-        cursor.hide()
+        if self.enabled:
+            cursor.hide()
 
     def __exit__(self, *args):
-        cursor.show()
+        if self.enabled:
+            cursor.show()
 
 
 def get_terminal_width():
@@ -39,27 +123,377 @@ def get_terminal_width():
         return width
 
 
+class BufferedTerminalWriter(object):
+    def __init__(self, file=None, refresh_interval=OUTPUT_REFRESH_INTERVAL, max_buffer_size=OUTPUT_MAX_BUFFER_SIZE):
+        """Merges many small writes to the terminal into few large ones.
+
+        Buffered output is written when a line is finished and the last write was at least 'refresh_interval'
+        seconds ago, when the buffer gets bigger than 'max_buffer_size', or when 'flush' is called. Output
+        that is not written that way (e.g. an unfinished line while a task is running) is written by a
+        background timer at most 'refresh_interval' seconds later.
+
+        Args:
+          file (file): the file to write to (defaults to stdout)
+          refresh_interval (float): minimum time (in seconds) between two writes
+          max_buffer_size (int): number of buffered characters that triggers a write
+        """
+
+        self.file = file
+        self.refresh_interval = refresh_interval
+        self.max_buffer_size = max_buffer_size
+
+        self.buffer = []
+        self.buffer_size = 0
+        self.last_flush = 0
+        self.timer = None
+        self.lock = threading.RLock()
+
+    def write(self, message=u"", nl=True):
+        """Adds a message to the buffer, the arguments have the same meaning as for 'click.echo'."""
+
+        if isinstance(message, binary_type):
+            message = message.decode(ENCODING, "replace")
+        elif not isinstance(message, text_type):
+            message = text_type(message)
+        if nl:
+            message = message + u"\n"
+        if not message:
+            return
+
+        with self.lock:
+            self.buffer.append(message)
+            self.buffer_size += len(message)
+
+            if self.buffer_size >= self.max_buffer_size or (
+                        u"\n" in message and time.time() - self.last_flush >= self.refresh_interval):
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.refresh_interval, self.flush)
+                self.timer.start()
+
+    def flush(self):
+        """Writes all buffered output."""
+
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.buffer:
+                return
+            output = u"".join(self.buffer)
+            self.buffer = []
+            self.buffer_size = 0
+            self.last_flush = time.time()
+            click.echo(output, nl=False, file=self.file)
+
+
+class SpillingLineBuffer(object):
+    def __init__(self, max_size=OUTPUT_SPILL_THRESHOLD):
+        """A list of output lines that keeps at most (about) 'max_size' characters in memory.
+
+        Once there are more, the lines in memory are appended to a temporary file, and only read back when the
+        buffer is iterated over (e.g. to display the output of a failed task).
+
+        Args:
+          max_size (int): the number of characters to keep in memory
+        """
+
+        self.max_size = max_size
+        self.lines = []
+        self.size = 0
+        self.length = 0
+        self.spill_file = None
+
+    def append(self, line):
+
+        self.lines.append(line)
+        self.length += 1
+        self.size += len(line)
+        if self.size > self.max_size:
+            self.spill()
+
+    def extend(self, lines):
+
+        for line in lines:
+            self.append(line)
+
+    def spill(self):
+        """Moves all lines that are in memory to the temporary file."""
+
+        if not self.lines:
+            return
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix="nsbl_output_")
+        self.spill_file.seek(0, os.SEEK_END)
+        pickle.dump(self.lines, self.spill_file, pickle.HIGHEST_PROTOCOL)
+        self.lines = []
+        self.size = 0
+
+    def __iter__(self):
+
+        if self.spill_file is not None:
+            self.spill_file.seek(0)
+            while True:
+                try:
+                    lines = pickle.load(self.spill_file)
+                except EOFError:
+                    break
+                for line in lines:
+                    yield line
+        for line in list(self.lines):
+            yield line
+
+    def __len__(self):
+
+        return self.length
+
+    def __bool__(self):
+
+        return self.length > 0
+
+    __nonzero__ = __bool__
+
+    def close(self):
+
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+        self.lines = []
+        self.size = 0
+        self.length = 0
+
+
+def clean_status_line(text):
+    """Applies the backspaces and carriage returns of a line of terminal output, and removes escape sequences."""
+
+    text = text.replace(u"\u001b[2K", u"")
+    if u"\r" in text:
+        text = text.rsplit(u"\r", 1)[1]
+    result = []
+    for char in text:
+        if char == u"\b":
+            if result:
+                result.pop()
+        elif char >= u" ":
+            result.append(char)
+    return u"".join(result).strip()
+
+
+class EnvOutputRecorder(object):
+    def __init__(self, display, key):
+        """Writer for a 'ClickStdOutput' that records the output of one environment for a 'MultiplexedDisplay'."""
+
+        self.display = display
+        self.key = key
+
+    def write(self, message=u"", nl=True):
+
+        if isinstance(message, binary_type):
+            message = message.decode(ENCODING, "replace")
+        elif not isinstance(message, text_type):
+            message = text_type(message)
+        if nl:
+            message = message + u"\n"
+        if message:
+            self.display.add_output(self.key, message)
+
+    def flush(self):
+
+        pass
+
+
+class MultiplexedDisplay(object):
+    def __init__(self, lookup_index, file=None, refresh_interval=MULTIPLEX_REFRESH_INTERVAL,
+                 max_status_lines=MULTIPLEX_MAX_STATUS_LINES, live=None, **adapter_args):
+        """Displays the output of several environments that run at the same time.
+
+        Every environment gets its own 'NsblLogCallbackAdapter' (see 'add_env'), which records its output instead of
+        printing it. At the bottom of the terminal, there is one status line per running environment (showing the
+        last line of its output), which is redrawn at most every 'refresh_interval' seconds. Once an environment is
+        finished, its complete output is printed above the status lines, in one piece, so the output of different
+        environments never gets mixed up.
+
+        If the output is not a terminal, no status lines are displayed.
+
+        Args:
+          lookup_index (LookupIndex): the lookup index of the run (see 'Nsbl.get_lookup_index')
+          file (file): the file to write to (defaults to stdout)
+          refresh_interval (float): minimum time (in seconds) between two updates of the status lines
+          max_status_lines (int): the maximum number of status lines
+          live (bool): whether to display status lines, defaults to whether the output is a terminal
+          **adapter_args: other arguments for the 'NsblLogCallbackAdapter' of every environment
+        """
+
+        if not isinstance(lookup_index, LookupIndex):
+            lookup_index = LookupIndex.from_lookup_dict(lookup_index)
+        self.lookup_index = lookup_index
+        self.file = file
+        self.refresh_interval = refresh_interval
+        self.max_status_lines = max_status_lines
+        if live is None:
+            live = click.get_text_stream("stdout").isatty() if file is None else file.isatty()
+        self.live = live
+        self.adapter_args = adapter_args
+
+        width = get_terminal_width()
+        # status lines must never wrap, otherwise they couldn't be cleared again
+        self.max_line_length = (width if width > 0 else 80) - 1
+
+        self.envs = []
+        self.finished = []
+        self.status_lines = 0
+        self.dirty = False
+        self.last_render = 0
+        self.lock = threading.RLock()
+        self.closed = threading.Event()
+        self.thread = None
+
+    def start(self):
+
+        if self.live:
+            self.thread = threading.Thread(target=self._refresh, name="nsbl-display")
+            self.thread.daemon = True
+            self.thread.start()
+        return self
+
+    def add_env(self, key, env_id):
+        """Adds an environment that is about to start.
+
+        Args:
+          key (str): the key of the environment (e.g. the name of its play)
+          env_id (int): the id of the environment
+
+        Returns:
+          NsblLogCallbackAdapter: the adapter the output of the environment has to be forwarded to
+        """
+
+        with self.lock:
+            self.envs.append({"key": key, "name": self.lookup_index.get_env_name(env_id, key), "output": [],
+                              "partial_line": u"", "last_line": u"", "start": time.time()})
+            self.dirty = True
+
+        return NsblLogCallbackAdapter(self.lookup_index, writer=EnvOutputRecorder(self, key), env_id=env_id,
+                                      **self.adapter_args)
+
+    def _get_env(self, key):
+
+        for env in self.envs:
+            if env["key"] == key:
+                return env
+        raise KeyError(key)
+
+    def add_output(self, key, text):
+
+        with self.lock:
+            env = self._get_env(key)
+            env["output"].append(text)
+            lines = (env["partial_line"] + text).split(u"\n")
+            env["partial_line"] = lines[-1]
+            if len(lines) > 1:
+                env["last_line"] = lines[-2]
+            self.dirty = True
+
+    def finish_env(self, key):
+        """Marks an environment as finished, its output will be displayed with the next update."""
+
+        with self.lock:
+            env = self._get_env(key)
+            self.envs.remove(env)
+            self.finished.append(env)
+            self.dirty = True
+        if not self.live:
+            self.render()
+
+    def format_status_line(self, env, now):
+
+        # the unfinished line, or the last finished one
+        status = clean_status_line(env["partial_line"]) or clean_status_line(env["last_line"])
+        line = u" [{:>4}s] {}: {}".format(int(now - env["start"]), env["name"], status)
+        return line[:self.max_line_length]
+
+    def render(self):
+        """Writes the output of all finished environments, and redraws the status lines (in one write)."""
+
+        with self.lock:
+            output = []
+            if self.status_lines:
+                # back to the first status line, and clear everything below
+                output.append(u"\u001b[{}A\r\u001b[J".format(self.status_lines))
+            for env in self.finished:
+                text = u"".join(env["output"])
+                if text and not text.endswith(u"\n"):
+                    text = text + u"\n"
+                output.append(text)
+            self.finished = []
+
+            status_lines = []
+            if self.live and not self.closed.is_set():
+                now = time.time()
+                envs = self.envs
+                if len(envs) > self.max_status_lines:
+                    envs = envs[:self.max_status_lines - 1]
+                for env in envs:
+                    status_lines.append(self.format_status_line(env, now))
+                if len(envs) < len(self.envs):
+                    status_lines.append(u" ... and {} more".format(len(self.envs) - len(envs)))
+            output.extend([u"{}\n".format(line) for line in status_lines])
+            self.status_lines = len(status_lines)
+            self.dirty = False
+            self.last_render = time.time()
+
+            output = u"".join(output)
+            if output:
+                # click would strip the escape sequences if the output is not a terminal
+                click.echo(output, nl=False, file=self.file, color=True if self.live else None)
+
+    def _refresh(self):
+
+        while not self.closed.wait(self.refresh_interval):
+            # the elapsed time changes every second, even without new output
+            if self.dirty or time.time() - self.last_render >= 1:
+                self.render()
+
+    def close(self):
+        """Stops updating the status lines, and writes the output of all environments that are not displayed yet."""
+
+        self.closed.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            self.finished.extend(self.envs)
+            self.envs = []
+            self.render()
+
+
 class NsblPrintCallbackAdapter(object):
     def add_error_message(self, line):
-        click.error(line)
+        click.echo(line, err=True)
 
     def add_log_message(self, line):
         click.echo(line, nl=False)
 
+    def add_log_messages(self, lines):
+        click.echo(b"".join(lines), nl=False)
+
     def finish_up(self):
         pass
 
 
 class NsblLogCallbackAdapter(object):
-    def __init__(self, lookup_dict, display_sub_tasks=True, display_skipped_tasks=True, display_unchanged_tasks=True,
-                 display_ignore_tasks=[]):
+    def __init__(self, lookup_index, display_sub_tasks=True, display_skipped_tasks=True, display_unchanged_tasks=True,
+                 display_ignore_tasks=[], max_output_size=OUTPUT_SPILL_THRESHOLD, writer=None, env_id=None):
 
         self.display_utility_tasks = False
         self.display_sub_tasks = display_sub_tasks
         self.display_skipped_tasks = display_skipped_tasks
         self.display_ignore_tasks = display_ignore_tasks
 
-        self.lookup_dict = lookup_dict
+        if not isinstance(lookup_index, LookupIndex):
+            # a (nested) lookup dict, as returned by 'Nsbl.get_lookup_dict'
+            lookup_index = LookupIndex.from_lookup_dict(lookup_index)
+        self.lookup_index = lookup_index
+        # the id of the environment if the output only contains one (e.g. in parallel mode)
+        self.env_id = env_id
         self.new_line = True
 
         self.current_env_id = None
@@ -75,9 +509,12 @@ class NsblLogCallbackAdapter(object):
         self.current_ansible_task_name = None
         self.saved_item = None
         self.last_action = None
-        self.msgs = []
-        self.stderrs = []
-        self.stdouts = []
+        # stdout/stderr/messages of the current task, only displayed if it fails
+        self.max_output_size = max_output_size
+        self.msgs = None
+        self.stderrs = None
+        self.stdouts = None
+        self.reset_output()
 
         self.failed = False
         self.skipped = True
@@ -85,20 +522,36 @@ class NsblLogCallbackAdapter(object):
 
         self.output = ClickStdOutput(display_sub_tasks=self.display_sub_tasks,
                                      display_skipped_tasks=self.display_skipped_tasks,
-                                     display_ignore_tasks=self.display_ignore_tasks)
+                                     display_ignore_tasks=self.display_ignore_tasks, writer=writer)
+
+    def reset_output(self):
+
+        for buffer in (self.msgs, self.stdouts, self.stderrs):
+            if buffer is not None:
+                buffer.close()
+        self.msgs = SpillingLineBuffer(self.max_output_size)
+        self.stdouts = SpillingLineBuffer(self.max_output_size)
+        self.stderrs = SpillingLineBuffer(self.max_output_size)
 
     def add_error_message(self, line):
 
-        click.echo(line)
+        self.output.echo(line)
+        self.output.flush()
+
+    def add_log_messages(self, lines):
+
+        for line in lines:
+            self.add_log_message(line)
 
     def add_log_message(self, line):
 
         try:
-            details = json.loads(line)
+            details = decode_event(line)
         except (Exception) as e:
             self.output.print_error(line, e)
             return
 
+
         category = details["category"]
         # print("")
         # print(category)
@@ -118,7 +571,7 @@ class NsblLogCallbackAdapter(object):
             self.current_env_id = None
             self.current_dyn_task_id = None
             self.current_task_name = None
-            name = self.lookup_dict[0][ENV_NAME_KEY]
+            name = self.lookup_index.get_env_name(0 if self.env_id is None else self.env_id)
             self.output.start_env(name)
             # click.echo("")
             return
@@ -160,7 +613,7 @@ class NsblLogCallbackAdapter(object):
             self.current_role_id = role_id
             self.current_dyn_task_id = dyn_task_id
 
-            self.current_role = self.lookup_dict[self.current_env_id][TASKS_KEY][self.current_role_id]
+            self.current_role = self.lookup_index.get(self.current_env_id, self.current_role_id)
 
             self.output.start_role(self.current_role)
 
@@ -171,9 +624,7 @@ class NsblLogCallbackAdapter(object):
 
             self.task_has_items = False
             self.task_has_nsbl_items = False
-            self.stdouts = []
-            self.stderrs = []
-            self.msgs = []
+            self.reset_output()
 
         if task_changed:
             if self.current_task_name != None and not role_changed:
@@ -183,7 +634,8 @@ class NsblLogCallbackAdapter(object):
             self.current_task_name = task_name
             self.current_dyn_task_id = dyn_task_id
             if self.current_dyn_task_id != None:
-                self.current_task = self.current_role[TASKS_KEY][self.current_dyn_task_id]
+                self.current_task = self.lookup_index.get(self.current_env_id, self.current_role_id,
+                                                          self.current_dyn_task_id)
                 self.current_task_is_dyn_role = True
             else:
                 self.current_task_is_dyn_role = False
@@ -191,9 +643,7 @@ class NsblLogCallbackAdapter(object):
             self.output.start_task(self.current_task_name, self.current_role, self.current_task_is_dyn_role)
 
             self.saved_item = None
-            self.msgs = []
-            self.stdouts = []
-            self.stderrs = []
+            self.reset_output()
 
             self.task_has_items = False
             self.task_has_nsbl_items = False
@@ -219,14 +669,11 @@ class NsblLogCallbackAdapter(object):
         if msg:
             self.msgs.append(msg)
 
+        # stdout/stderr are only displayed if the role fails, so they are only encoded when that happens
         if stdout:
-            for s in stdout:
-                s = s.encode(ENCODING, errors='replace').strip()
-                self.stdouts.append(s)
+            self.stdouts.extend(stdout)
         if stderr:
-            for s in stderr:
-                s = s.encode(ENCODING, errors='replace').strip()
-                self.stderrs.append(s)
+            self.stderrs.extend(stderr)
 
         event = {"category": category, "task_name": task_name, "task_desc": task_desc, "status": status, "item": item,
                  "msg": msg, "skipped": skipped, "ignore_errors": ignore_errors, "ansible_task_name": ansible_task_name,
@@ -257,42 +704,61 @@ class NsblLogCallbackAdapter(object):
         self.output.process_task_changed(self.task_has_items, self.task_has_nsbl_items, self.saved_item,
                                          self.current_task_is_dyn_role)
         self.output.process_role_changed(self.failed, self.skipped, self.changed, self.msgs, self.stdouts, self.stderrs)
+        self.output.flush()
+        self.reset_output()
 
 
 class ClickStdOutput(object):
     def __init__(self, display_sub_tasks=True, display_skipped_tasks=True, display_unchanged_tasks=True,
-                 display_ignore_tasks=[]):
+                 display_ignore_tasks=[], writer=None):
 
         self.new_line = True
         self.display_sub_tasks = display_sub_tasks
         self.display_skipped_tasks = display_skipped_tasks
         self.display_unchanged_tasks = display_unchanged_tasks
         self.terminal_width = get_terminal_width()
+        if self.terminal_width > 0:
+            # 2 characters are reserved at the end of the line
+            self.max_task_string_length = self.terminal_width - 2
+        else:
+            self.max_task_string_length = None
         self.ignore_strings = display_ignore_tasks
+        self.ignore_prefixes = tuple([u"   - ["] + [u"   - {}".format(token) for token in self.ignore_strings])
         self.last_string_ignored = False
         self.current_role = None
+        if writer is None:
+            writer = BufferedTerminalWriter()
+        self.writer = writer
+
+    def echo(self, message=u"", nl=True):
+
+        self.writer.write(message, nl=nl)
+
+    def flush(self):
+
+        self.writer.flush()
 
     def start_new_line(self):
 
-        click.echo("")
+        self.echo("")
         self.new_line = True
 
     def print_error(self, line, error):
 
-        click.echo(u"\n\nEXECUTION ERROR: {}:\n{}\n\n".format(error.message, line))
+        self.echo(u"\n\nEXECUTION ERROR: {}:\n{}\n\n".format(error.message, line))
 
     def start_env(self, env_name):
 
-        click.echo(u"* starting tasks (on '{}')...".format(env_name))
+        self.echo(u"* starting tasks (on '{}')...".format(env_name))
 
     def start_role(self, current_role):
 
         self.current_role = current_role
 
         if current_role["role_type"] == DYN_ROLE_TYPE:
-            click.echo(" * starting custom tasks:")
+            self.echo(" * starting custom tasks:")
         else:
-            msg = current_role.get("meta", {}).get("task-desc", None)
+            msg = current_role.get(TASK_DESC_KEY, None)
             if not msg:
                 msg = u"applying role '{}'...".format(current_role["name"])
             msg = u" * {}...".format(msg)
@@ -302,30 +768,27 @@ class ClickStdOutput(object):
 
     def print_task_string(self, task_str):
 
-        if task_str.startswith("   - [") or any(
-            (task_str.startswith(u"   - {}".format(token)) for token in self.ignore_strings)):
+        if task_str.startswith(self.ignore_prefixes):
             self.last_string_ignored = True
             self.new_line = True
             return
 
-        if self.terminal_width > 0:
-            reserve = 2
-            if len(task_str) > self.terminal_width - reserve:
-                task_str = u"{}...".format(task_str[0:self.terminal_width - reserve - 3])
-        click.echo(task_str, nl=False)
+        if self.max_task_string_length is not None and len(task_str) > self.max_task_string_length:
+            task_str = u"{}...".format(task_str[0:self.max_task_string_length - 3])
+        self.echo(task_str, nl=False)
         self.new_line = False
 
     def start_task(self, task_name, current_role, current_is_dyn_role):
         if current_is_dyn_role:
             if not self.new_line:
-                click.echo("")
+                self.echo("")
             self.print_task_string(u"     * {}... ".format(task_name))
             # click.echo("     * {}... ".format(task_name), nl=False)
             self.new_line = False
         else:
             if self.display_sub_tasks:
                 if not self.new_line:
-                    click.echo("")
+                    self.echo("")
                 self.print_task_string(u"   - {} => ".format(task_name))
                 # click.echo("   - {} => ".format(task_name), nl=False)
 
@@ -362,7 +825,7 @@ class ClickStdOutput(object):
         item = self.pretty_print_item(ev["item"])
         if ev["category"] == "nsbl_item_started":
             if not self.new_line:
-                click.echo("")
+                self.echo("")
 
             output = u"       - {} => ".format(item)
             self.print_task_string(output)
@@ -379,13 +842,13 @@ class ClickStdOutput(object):
                     msg = "changed"
                 else:
                     if not self.display_unchanged_tasks:
-                        click.echo(u"\u001b[2K\r", nl=False)
+                        self.echo(u"\u001b[2K\r", nl=False)
                         self.new_line = True
                         return
 
                     msg = "no change"
             output = u"ok ({})".format(msg)
-            click.echo(output)
+            self.echo(output)
         elif ev["category"] == "nsbl_item_failed":
             msg = ev.get('msg', None)
             if not msg:
@@ -397,7 +860,7 @@ class ClickStdOutput(object):
             # output = "failed: {}".format(msg)
             # click.echo(output)
             output = "failed:"
-            click.echo(output)
+            self.echo(output)
             self.format_error(msg)
 
         self.new_line = True
@@ -409,12 +872,12 @@ class ClickStdOutput(object):
         for msg in msgs:
             for m in msg.split("\n"):
                 try:
-                    click.echo(u"\t\t{}".format(m.strip()))
+                    self.echo(u"\t\t{}".format(m.strip()))
                 except:
                     try:
-                        click.echo(u"\t\t{}".format(m.decode('utf-8').strip()))
+                        self.echo(u"\t\t{}".format(m.decode('utf-8').strip()))
                     except:
-                        click.echo("... error decoding string ... ignoring ...")
+                        self.echo("... error decoding string ... ignoring ...")
 
     def display_item(self, ev, current_is_dyn_role):
 
@@ -426,7 +889,7 @@ class ClickStdOutput(object):
 
         item = self.pretty_print_item(ev["item"])
         if not self.new_line:
-            click.echo("")
+            self.echo("")
 
         if ev["category"] == "item_ok":
             skipped = ev["skipped"]
@@ -437,13 +900,13 @@ class ClickStdOutput(object):
                     msg = "changed"
                 else:
                     if not self.display_unchanged_tasks:
-                        click.echo(u"\u001b[2K\r", nl=False)
+                        self.echo(u"\u001b[2K\r", nl=False)
                         self.new_line = True
                         return
 
                     msg = "no change"
             output = u"       - {} => ok ({})".format(item, msg)
-            click.echo(output)
+            self.echo(output)
         elif ev["category"] == "item_failed":
             msg = ev.get('msg', None)
             if not msg:
@@ -454,11 +917,11 @@ class ClickStdOutput(object):
             # output = "       - {} => failed: {}".format(item, msg)
             # click.echo(output)
             output = u"       - {} => failed:".format(item)
-            click.echo(output)
+            self.echo(output)
             self.format_error(msg)
         elif ev["category"] == "item_skipped":
             output = u"       - {} => skipped".format(item)
-            click.echo(output)
+            self.echo(output)
 
         self.new_line = True
 
@@ -475,7 +938,7 @@ class ClickStdOutput(object):
             return
         if ev["ansible_task_name"].startswith("nsbl_finished="):
             output = u"no task information available"
-            click.echo(output)
+            self.echo(output)
             self.new_line = True
         else:
             if ev["category"] == "ok":
@@ -487,13 +950,13 @@ class ClickStdOutput(object):
                         msg = "changed"
                     else:
                         if not self.display_unchanged_tasks:
-                            click.echo(u"\u001b[2K\r", nl=False)
+                            self.echo(u"\u001b[2K\r", nl=False)
                             self.new_line = True
                             return
 
                         msg = "no change"
                 output = u"ok ({})".format(msg)
-                click.echo(output)
+                self.echo(output)
                 self.new_line = True
             elif ev["category"] == "failed":
                 if ev["msg"]:
@@ -504,29 +967,29 @@ class ClickStdOutput(object):
                     else:
                         msg = "(no error details)"
                     output = u"failed: {}".format(msg)
-                click.echo(output)
+                self.echo(output)
                 self.new_line = True
             elif ev["category"] == "skipped":
                 if not self.display_skipped_tasks:
-                    click.echo(u"\u001b[2K\r", nl=False)
+                    self.echo(u"\u001b[2K\r", nl=False)
                     self.new_line = True
                     return
                 output = "skipped"
-                click.echo(output)
+                self.echo(output)
                 self.new_line = True
 
     def process_role_changed(self, failed, skipped, changed, msgs, stdouts, stderrs):
 
         if not self.new_line:
-            click.echo("\b\b\b  => ", nl=False)
+            self.echo("\b\b\b  => ", nl=False)
         else:
-            click.echo("   => ", nl=False)
+            self.echo("   => ", nl=False)
 
         if failed:
 
             msg = ["n/a"]
 
-            click.echo("")
+            self.echo("")
             output = []
             if msgs:
                 if len(msgs) < 2:
@@ -542,32 +1005,32 @@ class ClickStdOutput(object):
             if stdouts:
                 output.append("      stdout:")
                 for e in stdouts:
-                    output.append(u"        -> {}".format(e))
+                    output.append(u"        -> {}".format(encode_output_line(e)))
             if stderrs:
                 output.append("      stderr:")
                 for e in stderrs:
-                    output.append(u"        -> {}".format(e))
+                    output.append(u"        -> {}".format(encode_output_line(e)))
 
             output = "\n".join(output)
-            click.echo(output)
-            click.echo("")
+            self.echo(output)
+            self.echo("")
 
         elif skipped:
 
             output = "skipped"
-            click.echo(output)
+            self.echo(output)
 
         elif changed:
             output = "ok (changed)"
-            click.echo(output)
+            self.echo(output)
         else:
             if not self.display_unchanged_tasks:
-                click.echo(u"\u001b[2K\r", nl=False)
+                self.echo(u"\u001b[2K\r", nl=False)
                 self.new_line = True
                 return
 
             output = "ok (no change)"
-            click.echo(output)
+            self.echo(output)
 
             # click.echo("")
 
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import hashlib
+import json
+import logging
+import pickle
+import tempfile
+
+from builtins import *
+from six import string_types
+
+from . import __version__ as VERSION
+from .defaults import *
+from .tasks import find_roles_in_repo
+
+log = logging.getLogger("nsbl")
+
+# pickle protocol used for cached plans (the highest one that works on Python 2)
+PLAN_PICKLE_PROTOCOL = 2
+# version of the structure of the cached objects, plans cached with a different version are not used
+PLAN_FORMAT_VERSION = 2
+
+
+def _file_fingerprint(path):
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
+def get_role_repo_index_version(role_repo):
+    """Returns a json-serializable fingerprint of the roles in a role repository.
+
+    The fingerprint contains the names and locations of all roles in the repo, and modification time and size
+    of their meta files as well as of the task descriptions file of the repo. Changes to other files of a role don't
+    change the processed Nsbl object (roles are only copied at render time), so they are not included.
+
+    Args:
+      role_repo (str): the path to the role repository
+
+    Returns:
+      list: the fingerprint
+    """
+
+    repo_path = os.path.expanduser(role_repo)
+    result = [repo_path, _file_fingerprint(os.path.join(repo_path, TASK_DESC_DEFAULT_FILENAME))]
+    roles = find_roles_in_repo(repo_path)
+    for role_name in sorted(roles.keys()):
+        path = roles[role_name]
+        result.append([role_name, path, _file_fingerprint(os.path.join(path, "meta", "main.yml")),
+                       _file_fingerprint(os.path.join(path, ROLE_META_FILENAME))])
+
+    return result
+
+
+def _config_fingerprint(config_item):
+
+    if isinstance(config_item, string_types):
+        path = os.path.expanduser(config_item)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                return ["file", os.path.abspath(path), hashlib.sha1(f.read()).hexdigest()]
+        if ":" in config_item or "/" in config_item:
+            # most likely a (possibly abbreviated) url, the content of which can change at any time
+            return None
+        return ["string", config_item]
+
+    return ["object", config_item]
+
+
+def calculate_plan_key(config, role_repos, task_descs, create_args):
+    """Calculates the key of the plan for the provided inputs of 'Nsbl.create'.
+
+    Args:
+      config (list): a list of configuration items
+      role_repos (list): the role repos (as calculated by 'calculate_role_repos')
+      task_descs (list): the additional task descriptions
+      create_args (dict): all other (json-serializable) arguments of 'Nsbl.create'
+
+    Returns:
+      str: the key, or None if the inputs can't be cached (e.g. because a configuration item is a remote url)
+    """
+
+    if isinstance(config, (string_types, dict)):
+        config = [config]
+    if isinstance(task_descs, (string_types, dict)):
+        task_descs = [task_descs]
+
+    fingerprints = []
+    for item in list(config) + list(task_descs or []):
+        fingerprint = _config_fingerprint(item)
+        if fingerprint is None:
+            log.debug("Not caching plan, config item can't be fingerprinted: {}".format(item))
+            return None
+        fingerprints.append(fingerprint)
+
+    inputs = {
+        "version": VERSION,
+        "format": PLAN_FORMAT_VERSION,
+        "config": fingerprints,
+        "role_repos": [get_role_repo_index_version(repo) for repo in role_repos],
+        "args": create_args
+    }
+    try:
+        serialized = json.dumps(inputs, sort_keys=True)
+    except (TypeError, ValueError) as e:
+        log.debug("Not caching plan, inputs are not serializable: {}".format(e))
+        return None
+
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+
+def get_plan_file(key, plan_cache_dir=PLAN_CACHE_DIR):
+
+    return os.path.join(os.path.expanduser(plan_cache_dir), "{}.pickle".format(key))
+
+
+def load_plan(key, plan_cache_dir=PLAN_CACHE_DIR):
+    """Loads a cached, processed Nsbl object.
+
+    Args:
+      key (str): the key of the plan (see 'calculate_plan_key')
+      plan_cache_dir (str): the folder that contains the cached plans
+
+    Returns:
+      Nsbl: the Nsbl object, or None if it isn't cached (or can't be loaded)
+    """
+
+    plan_file = get_plan_file(key, plan_cache_dir)
+    try:
+        if os.stat(plan_file).st_uid != os.getuid():
+            log.warning("Ignoring cached plan not owned by current user: {}".format(plan_file))
+            return None
+        with open(plan_file, "rb") as f:
+            return pickle.load(f)
+    except (IOError, OSError):
+        return None
+    except Exception as e:
+        log.debug("Could not load cached plan '{}': {}".format(plan_file, e))
+        return None
+
+
+def save_plan(key, nsbl, plan_cache_dir=PLAN_CACHE_DIR):
+    """Stores a processed Nsbl object in the plan cache.
+
+    Args:
+      key (str): the key of the plan (see 'calculate_plan_key')
+      nsbl (Nsbl): the processed Nsbl object
+      plan_cache_dir (str): the folder that contains the cached plans
+    """
+
+    plan_file = get_plan_file(key, plan_cache_dir)
+    cache_dir = os.path.dirname(plan_file)
+    try:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        fd, temp_file = tempfile.mkstemp(dir=cache_dir, prefix=".plan_")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(nsbl, f, PLAN_PICKLE_PROTOCOL)
+        os.rename(temp_file, plan_file)
+    except Exception as e:
+        log.debug("Could not cache plan '{}': {}".format(plan_file, e))
@@ -7,10 +7,9 @@ import sys
 import click
 import click_log
 import logging
-import yaml
 
 from . import __version__ as VERSION
-from .nsbl import Nsbl, NsblRunner
+from .defaults import DEFAULT_MAX_PARALLEL_PLAYS
 
 logger = logging.getLogger("nsbl")
 click_log.basic_config(logger)
@@ -31,23 +30,34 @@ click_log.basic_config(logger)
               default=False)
 @click.option('--ask-become-pass', help='whether to ask the user for a sudo password if necessary', is_flag=True,
               default=True)
+@click.option('--parallel', help="run the plays of environments that don't share any hosts in parallel", is_flag=True,
+              default=False)
+@click.option('--max-parallel-plays', help="maximum number of plays to run at the same time (with '--parallel')",
+              type=int, default=DEFAULT_MAX_PARALLEL_PLAYS)
 @click_log.simple_verbosity_option(logger)
-def cli(version, role_repo, task_desc, stdout_callback, target, force, config, no_run, ask_become_pass):
+def cli(version, role_repo, task_desc, stdout_callback, target, force, config, no_run, ask_become_pass, parallel,
+        max_parallel_plays):
     """Console script for nsbl"""
 
     if version:
         click.echo(VERSION)
         sys.exit(0)
 
+    # imported here, so '--version' and '--help' don't have to wait for it
+    from .nsbl import Nsbl, NsblRunner
+
     nsbl_obj = Nsbl.create(config, role_repo, task_desc)
 
     runner = NsblRunner(nsbl_obj)
     runner.run(target, force=force, ansible_verbose="", ask_become_pass=ask_become_pass, callback=stdout_callback,
-               add_timestamp_to_env=True, add_symlink_to_env="~/.nsbl/runs/current", no_run=no_run)
+               add_timestamp_to_env=True, add_symlink_to_env="~/.nsbl/runs/current", no_run=no_run,
+               parallel=parallel, max_parallel_plays=max_parallel_plays)
 
 
 def output(python_object, format="raw", pager=False):
     if format == 'yaml':
+        import yaml
+
         output = yaml.safe_dump(python_object, default_flow_style=False, encoding='utf-8', allow_unicode=True)
     elif format == 'json':
         output = json.dumps(python_object, sort_keys=4, indent=4)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import json
+import logging
+import sys
+
+from builtins import *
+from six import binary_type
+
+from .defaults import *
+from .event_bus import EventSink, decode_events
+from .metrics import METRICS_STATUS, RunMetrics
+
+log = logging.getLogger("nsbl")
+
+
+def open_progress_file(progress_file=None):
+    """Returns a (text) file object for the progress records.
+
+    Args:
+      progress_file (object): a file object, a file descriptor (int), or None for stdout
+
+    Returns:
+      file: the file object
+    """
+
+    if progress_file is None:
+        return sys.stdout
+    if isinstance(progress_file, int):
+        return io.open(progress_file, "w", encoding="utf-8", closefd=False)
+    return progress_file
+
+
+class JsonlProgressSink(EventSink):
+    def __init__(self, lookup_index, progress_file=None, durations=True):
+        """Writes one json record per line for every environment, role, task and item of a run once it's finished.
+
+        Every record has the keys 'type' (env, role, task or item), 'env', 'role', 'task', 'item' (the names,
+        as far as applicable), the matching '*_id' keys, 'status' (skipped, ok, changed or failed), 'duration'
+        and 'timestamp'. Errors are written as records of type 'error', and the last record has the type 'run'.
+        Nothing else is written, and no terminal handling is done, so the output can be consumed by other tools.
+
+        Args:
+          lookup_index (LookupIndex): the lookup index of the run (see 'Nsbl.get_lookup_index')
+          progress_file (object): a file object, a file descriptor (int), or None for stdout
+          durations (bool): whether the events arrive while the run happens, if not the 'duration' of every record
+            is None
+        """
+
+        self.file = open_progress_file(progress_file)
+        self.durations = durations
+        self.metrics = RunMetrics(lookup_index, listener=self.add_span)
+        self.status = None
+
+    def write_record(self, record):
+
+        self.file.write("{}\n".format(json.dumps(record, default=repr)))
+
+    def add_span(self, kind, record):
+
+        record["type"] = kind
+        if not self.durations:
+            record["duration"] = None
+        if kind == "env" and record.get("status", None) is not None:
+            if self.status is None or METRICS_STATUS.index(record["status"]) > METRICS_STATUS.index(self.status):
+                self.status = record["status"]
+        self.write_record(record)
+
+    def process_lines(self, timestamp, lines):
+
+        for line, event in decode_events(lines):
+            self.metrics.add_event(event, timestamp=timestamp)
+        self.file.flush()
+
+    def process_error(self, timestamp, line):
+
+        if isinstance(line, binary_type):
+            line = line.decode("utf-8", "replace")
+        self.write_record({"type": "error", "message": line.strip(), "timestamp": timestamp})
+        self.file.flush()
+
+    def close(self, timestamp, aborted=False):
+
+        self.metrics.finish(timestamp=timestamp)
+        self.write_record({"type": "run", "status": "aborted" if aborted else self.status or "ok",
+                           "timestamp": timestamp})
+        self.file.flush()
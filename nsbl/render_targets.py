@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import logging
+import shutil
+import stat
+import tarfile
+import time
+
+from builtins import *
+from six import PY2, text_type
+
+from .defaults import *
+
+log = logging.getLogger("nsbl")
+
+# permissions of files/folders that are written without explicit mode
+DEFAULT_FILE_MODE = 0o644
+DEFAULT_DIR_MODE = 0o755
+
+
+def render_cookiecutter_template(template_dir, extra_context, output_dir, render_target):
+    """Renders a cookiecutter template into a render target.
+
+    This creates the same files as running 'cookiecutter' on the template (without user input, and
+    without running hooks), but doesn't need a local output folder. In contrast to 'cookiecutter' it
+    never changes the working directory of the process, so templates can be rendered in several threads
+    at the same time.
+
+    Args:
+      template_dir (str): the (local) cookiecutter template
+      extra_context (dict): the values for the template variables
+      output_dir (str): the folder (within the render target) to render the template into
+      render_target (RenderTarget): the target to write the files to
+
+    Returns:
+      str: the path of the rendered project folder
+    """
+
+    # only needed for templates, which most render targets (and commands) never use
+    from binaryornot.check import is_binary
+    from cookiecutter.environment import StrictEnvironment
+    from cookiecutter.find import find_template
+    from cookiecutter.generate import generate_context, is_copy_only_path
+    from cookiecutter.prompt import prompt_for_config
+    from jinja2 import FileSystemLoader
+
+    context = generate_context(os.path.join(template_dir, "cookiecutter.json"), extra_context=extra_context)
+    context["cookiecutter"] = prompt_for_config(context, no_input=True)
+    context["cookiecutter"]["_template"] = template_dir
+
+    project_template = find_template(template_dir)
+    env = StrictEnvironment(context=context, keep_trailing_newline=True)
+    env.loader = FileSystemLoader(project_template)
+
+    def render_path(path):
+        return env.from_string(path).render(**context)
+
+    project_dir = os.path.normpath(os.path.join(output_dir, render_path(os.path.basename(project_template))))
+    render_target.makedirs(project_dir)
+
+    for root, dirs, files in os.walk(project_template):
+        rel_root = os.path.relpath(root, project_template)
+
+        render_dirs = []
+        for d in dirs:
+            rel_dir = os.path.normpath(os.path.join(rel_root, d))
+            if is_copy_only_path(rel_dir, context):
+                render_target.copy_tree(os.path.join(root, d), os.path.join(project_dir, rel_dir))
+            else:
+                render_dirs.append(d)
+                render_target.makedirs(os.path.join(project_dir, render_path(rel_dir)))
+        dirs[:] = render_dirs
+
+        for f in files:
+            rel_file = os.path.normpath(os.path.join(rel_root, f))
+            src = os.path.join(root, f)
+            target = os.path.join(project_dir, render_path(rel_file))
+            mode = stat.S_IMODE(os.stat(src).st_mode)
+
+            if is_copy_only_path(rel_file, context) or is_binary(src):
+                with open(src, "rb") as input_file:
+                    content = input_file.read()
+            else:
+                content = env.get_template(rel_file.replace(os.path.sep, "/")).render(**context)
+
+            render_target.write_file(target, content, mode=mode)
+
+    return project_dir
+
+
+class RenderTarget(object):
+    """Base class for the targets an ansible environment can be rendered into.
+
+    All paths are the paths the files would have if the environment was rendered into the local filesystem.
+    """
+
+    def open(self, env_dir):
+        """Called before the environment gets rendered.
+
+        Args:
+          env_dir (str): the (root) folder of the environment
+        """
+
+        self.env_dir = env_dir
+
+    def close(self):
+        """Called after the environment was rendered."""
+
+        pass
+
+    def is_local(self):
+        """Whether the rendered files end up in the local filesystem."""
+
+        return False
+
+    def exists(self, path):
+        raise NotImplementedError()
+
+    def makedirs(self, path):
+        raise NotImplementedError()
+
+    def write_file(self, path, content, mode=None):
+        """Writes a file.
+
+        Args:
+          path (str): the path of the file
+          content (str, bytes): the content of the file, text will be utf-8 encoded
+          mode (int): the permissions of the file, if not specified the default ones are used
+        """
+
+        raise NotImplementedError()
+
+    def copy_tree(self, src, target):
+        """Copies a local folder (recursively) into the render target.
+
+        Args:
+          src (str): the local source folder
+          target (str): the path of the folder in the render target
+        """
+
+        for root, dirs, files in os.walk(src, followlinks=True):
+            rel_root = os.path.relpath(root, src)
+            self.makedirs(os.path.normpath(os.path.join(target, rel_root)))
+            for f in files:
+                src_file = os.path.join(root, f)
+                with open(src_file, "rb") as input_file:
+                    content = input_file.read()
+                self.write_file(os.path.normpath(os.path.join(target, rel_root, f)), content,
+                                mode=stat.S_IMODE(os.stat(src_file).st_mode))
+
+    def remove_tree(self, path):
+        raise NotImplementedError()
+
+    def link_env(self, link_path, force=False):
+        """Adds a symlink to the environment folder, if supported by the render target.
+
+        Args:
+          link_path (str): the path of the symlink
+          force (bool): whether to replace an already existing symlink
+        """
+
+        log.debug("Render target doesn't support symlinks, not linking '{}'".format(link_path))
+
+    def render_template(self, template_dir, extra_context, output_dir):
+        """Renders a cookiecutter template into this target (see 'render_cookiecutter_template')."""
+
+        return render_cookiecutter_template(template_dir, extra_context, output_dir, self)
+
+
+class FileSystemRenderTarget(RenderTarget):
+    """Renders the environment into the local filesystem (the default)."""
+
+    def is_local(self):
+
+        return True
+
+    def exists(self, path):
+
+        return os.path.exists(path)
+
+    def makedirs(self, path):
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def write_file(self, path, content, mode=None):
+
+        self.makedirs(os.path.dirname(path))
+        if isinstance(content, text_type):
+            with io.open(path, "w", encoding="utf-8") as output_file:
+                output_file.write(content)
+        else:
+            with io.open(path, "wb") as output_file:
+                output_file.write(content)
+        if mode is not None:
+            os.chmod(path, mode)
+
+    def copy_tree(self, src, target):
+
+        shutil.copytree(src, target)
+
+    def remove_tree(self, path):
+
+        shutil.rmtree(path)
+
+    def link_env(self, link_path, force=False):
+
+        if os.path.exists(link_path) and force:
+            os.unlink(link_path)
+        link_parent = os.path.abspath(os.path.join(link_path, os.pardir))
+        try:
+            os.makedirs(link_parent)
+        except:
+            pass
+        os.symlink(self.env_dir, link_path)
+
+
+class InMemoryRenderTarget(RenderTarget):
+    """Keeps all rendered files in memory.
+
+    After rendering, 'files' contains the content (bytes) of every file, and 'modes' their permissions, keyed
+    by the path relative to the environment folder.
+    """
+
+    def __init__(self):
+
+        self.env_dir = None
+        self.files = {}
+        self.modes = {}
+        self.dirs = set()
+
+    def _rel_path(self, path):
+
+        return os.path.relpath(os.path.normpath(path), self.env_dir)
+
+    def exists(self, path):
+
+        rel_path = self._rel_path(path)
+        return rel_path in self.files.keys() or rel_path in self.dirs
+
+    def makedirs(self, path):
+
+        rel_path = self._rel_path(path)
+        while rel_path and rel_path != "." and rel_path not in self.dirs:
+            self.dirs.add(rel_path)
+            rel_path = os.path.dirname(rel_path)
+
+    def write_file(self, path, content, mode=None):
+
+        if isinstance(content, text_type):
+            content = content.encode("utf-8")
+        self.makedirs(os.path.dirname(path))
+        rel_path = self._rel_path(path)
+        self.files[rel_path] = content
+        self.modes[rel_path] = mode if mode is not None else DEFAULT_FILE_MODE
+
+    def remove_tree(self, path):
+
+        rel_path = self._rel_path(path)
+        prefix = rel_path + os.path.sep
+        for key in [k for k in self.files.keys() if k == rel_path or k.startswith(prefix)]:
+            del self.files[key]
+            del self.modes[key]
+        self.dirs = set([d for d in self.dirs if d != rel_path and not d.startswith(prefix)])
+
+    def read_file(self, path):
+        """Returns the content of a file, relative to the environment folder."""
+
+        return self.files[os.path.normpath(path)]
+
+
+class TarballRenderTarget(RenderTarget):
+    """Streams all rendered files into a tar archive, without buffering the whole archive.
+
+    The archive contains one top-level folder, named like the environment folder.
+    """
+
+    def __init__(self, fileobj, compression="gz"):
+        """Creates the render target.
+
+        Args:
+          fileobj (object): a writable file-like object (doesn't need to be seekable)
+          compression (str): the compression of the archive ('gz', 'bz2', or '' for none)
+        """
+
+        self.env_dir = None
+        self.fileobj = fileobj
+        self.compression = compression
+        self.tar = None
+        self.dirs = set()
+        self.paths = set()
+
+    def open(self, env_dir):
+
+        super(TarballRenderTarget, self).open(env_dir)
+        self.tar = tarfile.open(fileobj=self.fileobj, mode="w|{}".format(self.compression))
+
+    def close(self):
+
+        self.tar.close()
+
+    def _arcname(self, path):
+
+        return os.path.relpath(os.path.normpath(path), os.path.dirname(self.env_dir))
+
+    def _tarinfo(self, arcname):
+
+        if PY2:
+            # tarfile on Python 2 can only deal with byte strings
+            arcname = arcname.encode("utf-8")
+        info = tarfile.TarInfo(arcname)
+        info.mtime = time.time()
+        return info
+
+    def exists(self, path):
+
+        arcname = self._arcname(path)
+        return arcname in self.paths or arcname in self.dirs
+
+    def makedirs(self, path):
+
+        missing = []
+        arcname = self._arcname(path)
+        while arcname and arcname != "." and arcname not in self.dirs:
+            missing.insert(0, arcname)
+            arcname = os.path.dirname(arcname)
+
+        for arcname in missing:
+            info = self._tarinfo(arcname)
+            info.type = tarfile.DIRTYPE
+            info.mode = DEFAULT_DIR_MODE
+            self.tar.addfile(info)
+            self.dirs.add(arcname)
+
+    def write_file(self, path, content, mode=None):
+
+        if isinstance(content, text_type):
+            content = content.encode("utf-8")
+        self.makedirs(os.path.dirname(path))
+        arcname = self._arcname(path)
+        if arcname in self.paths:
+            log.debug("File '{}' written twice into tarball, the last one wins when extracting.".format(arcname))
+
+        info = self._tarinfo(arcname)
+        info.size = len(content)
+        info.mode = mode if mode is not None else DEFAULT_FILE_MODE
+        self.tar.addfile(info, io.BytesIO(content))
+        self.paths.add(arcname)
+
+    def remove_tree(self, path):
+
+        log.debug("Can't remove '{}' from a tarball stream, ignoring.".format(path))
@@ -6,17 +6,23 @@ from __future__ import (absolute_import, division, print_function,
 
 import copy
 import fnmatch
+import hashlib
+import json
+import logging
 import re
+import threading
 
 import yaml
 from builtins import *
-from cookiecutter.main import cookiecutter
-from jinja2 import Environment, PackageLoader
 
 from .defaults import *
 from .exceptions import NsblException
+from .external_roles import get_role_store_path
+from .render_targets import FileSystemRenderTarget
 from frkl.frkl import Frkl, PLACEHOLDER, UrlAbbrevProcessor, dict_merge, FrklProcessor
+from frkl import frkl
 
+log = logging.getLogger("nsbl")
 
 DEFAULT_TASKS_PRE_CHAIN = [frkl.UrlAbbrevProcessor(), frkl.EnsureUrlProcessor(), frkl.EnsurePythonObjectProcessor()]
 DEFAULT_EXCLUDE_DIRS = [".git", ".tox", ".cache"]
@@ -27,11 +33,6 @@ ROLE_CACHE = {}
 ABBREV_VERBOSE = True
 ABBREV_WARN = True
 
-def to_nice_yaml(var):
-    """util function to convert to yaml in a jinja template"""
-    return yaml.safe_dump(var, default_flow_style=False)
-
-
 def expand_string_to_git_repo(value, default_abbrevs):
     if isinstance(value, string_types):
         is_string = True
@@ -412,6 +413,29 @@ def get_internal_role_path(role, role_repos=[]):
     return False
 
 
+def calculate_dyn_role_hash(tasks):
+    """Calculates a hash of everything that ends up in the rendered files of a dynamic role.
+
+    The name of the role and the ids of its tasks are not part of the hash, neither are the values of the task
+    variables (those are set in the playbook, the role only contains their keys).
+
+    Args:
+      tasks (list): list of tasks, including the tasks own 'meta' and 'vars' dicts
+
+    Returns:
+      str: the (shortened) hash
+    """
+
+    content = []
+    for task in tasks:
+        meta = dict((key, value) for key, value in task[TASKS_META_KEY].items() if
+                    key not in [ROLE_NAME_KEY, DYN_TASK_ID_KEY])
+        content.append({"meta": meta, "var_keys": sorted(task.get(VARS_KEY, {}).keys())})
+
+    serialized = json.dumps(content, sort_keys=True, default=repr)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()[:DYN_ROLE_HASH_LENGTH]
+
+
 class NsblTasks(frkl.FrklCallback):
     def create(config, role_repos, task_descs, env_name=None, env_id=None, meta={}, pre_chain=DEFAULT_TASKS_PRE_CHAIN):
         """
@@ -500,21 +524,25 @@ class NsblTasks(frkl.FrklCallback):
 
         return None
 
+    def get_dyn_role(self, src):
+
+        for role in self.roles:
+            if role.role_type == DYN_ROLE_TYPE and role.src == src:
+                return role
+
+        return None
+
     def get_role_names(self):
 
         names = [role.role_name for role in self.roles]
         return names
 
-    def render_playbook(self, playbook_dir, playbook_name=None, add_ids=True):
+    def render_playbook(self, playbook_dir, playbook_name=None, add_ids=True, render_target=None):
 
-        if not os.path.exists(playbook_dir):
-            os.makedirs(playbook_dir)
+        if render_target is None:
+            render_target = FileSystemRenderTarget()
 
-        jinja_env = Environment(loader=PackageLoader('nsbl', 'templates'))
-        jinja_env = Environment(loader=PackageLoader('nsbl', 'templates'))
-        jinja_env.filters['to_nice_yaml'] = to_nice_yaml
-
-        template = jinja_env.get_template('playbook.yml')
+        template = get_jinja_env().get_template('playbook.yml')
         output_text = template.render(groups=self.env_name, roles=self.roles, meta=self.meta, env_id=self.env_id,
                                       add_ids=add_ids)
 
@@ -524,30 +552,32 @@ class NsblTasks(frkl.FrklCallback):
             # playbook_name = "play_{}.yml".format(self.env_name)
             playbook_file = os.path.join(playbook_dir, playbook_name)
 
-        with open(playbook_file, "w") as text_file:
-            text_file.write(output_text)
+        render_target.write_file(playbook_file, output_text)
 
         return playbook_name
 
-    def render_roles(self, role_base_dir):
+    def render_roles(self, role_base_dir, render_target=None):
         """Renders all roles into the generated ansible environment folder.
 
-        External roles are added to the 'roles_requirements.txt' files to be
-        downloaded at execution time into the 'external' subfolder, internal
+        External roles are marked to be copied from the role store into the
+        'external' subfolder (the requirements file used to download them is
+        written once for all plays, see 'get_external_roles'), internal
         roles (roles that are present locally, either in a folder or a roles
         repository) are copied into the 'internal' sub-folder, and sets of
         tasks are put into dynamically generated roles which in turn are
-        rendered into the 'dynamic' sub-folder.
+        rendered into the 'dynamic' sub-folder. Dynamic roles that are named
+        after their content are only rendered once, even if they are used in
+        several plays.
 
         Args:
           role_base_dir (str): the base dir where all roles should live
+          render_target (RenderTarget): the target to write the dynamic roles to (default: the local filesystem)
         """
 
-        jinja_env = Environment(loader=PackageLoader('nsbl', 'templates'))
-        roles_requirements_file = os.path.join(role_base_dir, "roles_requirements.yml")
+        if render_target is None:
+            render_target = FileSystemRenderTarget()
 
-        if not os.path.exists(role_base_dir):
-            os.makedirs(role_base_dir)
+        render_target.makedirs(role_base_dir)
 
         for role in self.all_ansible_roles:
             role_type = role["type"]
@@ -559,21 +589,25 @@ class NsblTasks(frkl.FrklCallback):
                 target = os.path.join(role_base_dir, "internal", name)
                 self.roles_to_copy.setdefault("internal", {})[src] = target
             elif role_type == REMOTE_ROLE_TYPE:
-                role_src = os.path.join(ANSIBLE_ROLE_CACHE_DIR, role["name"])
+                role_src = get_role_store_path(role)
                 target = os.path.join(role_base_dir, "external", role["name"])
                 self.roles_to_copy.setdefault("external", {})[role_src] = target
-                template = jinja_env.get_template('external_role.yml')
-                output_text = template.render(role=role)
-                with open(roles_requirements_file, "a") as myfile:
-                    myfile.write(output_text)
             elif role_type == DYN_ROLE_TYPE:
-                role_id = int(src.split("_")[-1])
-                task_role = self.get_role(role_id)
+                task_role = self.get_dyn_role(src)
                 target_folder = os.path.join(role_base_dir, "dynamic")
-                task_role.create_role(target_folder)
+                if task_role.content_hashed_name and render_target.exists(os.path.join(target_folder, name)):
+                    # identical role, already rendered for another play
+                    log.debug("Re-using already rendered dynamic role: {}".format(name))
+                    continue
+                task_role.create_role(target_folder, render_target=render_target)
             else:
                 raise NsblException("Role type '{}' not valid".format(role_type))
 
+    def get_external_roles(self):
+        """Returns the descriptions of all external roles that need to be downloaded for this play."""
+
+        return [role for role in self.all_ansible_roles if role["type"] == REMOTE_ROLE_TYPE]
+
     def callback(self, role):
 
         self.roles.append(role)
@@ -850,7 +884,7 @@ class NsblExternalRole(NsblRole):
 
 
 class NsblDynRole(NsblRole):
-    def __init__(self, tasks, role_id, role_repos={}):
+    def __init__(self, tasks, role_id, role_repos={}, content_hashed_name=False):
         """Class to describe nsbl dynamically created roles.
 
         In order to support both roles and tasks in NsblTask lists, there needs to
@@ -864,20 +898,29 @@ class NsblDynRole(NsblRole):
           tasks (list): list of tasks, including the tasks own 'meta' and 'vars' dicts
           role_id (str): the id of the role, used to look up role details later
           role_repos (list): a list of all locally available role repos, used to lookup task detail overlays
+          content_hashed_name (bool): whether to name the role after a hash of its content (instead of the role name in the tasks 'meta' dicts), so identical roles can share the same rendered role
         """
         self.tasks = tasks
         self.role_id = role_id
         self.role_type = DYN_ROLE_TYPE
         self.role_repos = role_repos
         self.use_become = False
-        self.role_name = self.tasks[0][TASKS_META_KEY][ROLE_NAME_KEY]
+        self.content_hashed_name = content_hashed_name
+        if self.content_hashed_name:
+            self.role_name = "{}_{}".format(DYN_ROLE_TYPE, calculate_dyn_role_hash(self.tasks))
+            for t in self.tasks:
+                t[TASKS_META_KEY][ROLE_NAME_KEY] = self.role_name
+            self.src = self.role_name
+        else:
+            self.role_name = self.tasks[0][TASKS_META_KEY][ROLE_NAME_KEY]
+            self.src = "{}_{}".format(DYN_ROLE_TYPE, self.role_id)
         self.roles = []
         self.meta_dict = {}
         self.vars_dict = {}
         self.task_names = []
         self.parse_tasks()
         self.name = self.role_name
-        add_roles(self.roles, {"src": "{}_{}".format(DYN_ROLE_TYPE, self.role_id), "name": self.role_name})
+        add_roles(self.roles, {"src": self.src, "name": self.role_name})
 
     def __repr__(self):
         return "NsblRole(name={}, role_name={}, type={}, role_id={}, task_names={})".format(self.name, self.role_name,
@@ -918,10 +961,12 @@ class NsblDynRole(NsblRole):
             if t[TASKS_META_KEY].get(TASK_BECOME_KEY, False):
                 self.use_become = True
 
-    def create_role(self, target_folder):
+    def create_role(self, target_folder, render_target=None):
+
+        if render_target is None:
+            render_target = FileSystemRenderTarget()
 
-        if not os.path.exists(target_folder):
-            os.makedirs(target_folder)
+        render_target.makedirs(target_folder)
 
         role_template_local_path = os.path.join(os.path.dirname(__file__), "external", "ansible-role-template")
         # cookiecutter doesn't like input lists, so converting to dict
@@ -955,20 +1000,26 @@ class NsblDynRole(NsblRole):
             "dependencies": ""
         }
 
-        current_dir = os.getcwd()
-        os.chdir(target_folder)
-
         # empty "vars" dicts, as we don't need them and they might contain template strings cookiecutter wouldn't like
         for role_name, role_details in role_dict.get("tasks", {}).items():
             for var_key in role_details.get("vars", {}).keys():
                 role_details["vars"][var_key] = ""
 
-        cookiecutter(role_template_local_path, extra_context=role_dict, no_input=True)
-        os.chdir(current_dir)
+        render_target.render_template(role_template_local_path, role_dict, target_folder)
 
 
 class NsblDynamicRoleProcessor(frkl.ConfigProcessor):
     role_id = 0
+    role_id_lock = threading.Lock()
+
+    @classmethod
+    def next_role_id(cls):
+        """Returns a new, unique role id (ids are unique per process, so Nsbl objects can be created in parallel)."""
+
+        with cls.role_id_lock:
+            role_id = cls.role_id
+            cls.role_id += 1
+        return role_id
 
     def __init__(self, init_params=None):
         """Processor to extract and pre-process single tasks to merge them into one or several roles later on.
@@ -988,6 +1039,8 @@ class NsblDynamicRoleProcessor(frkl.ConfigProcessor):
         super(NsblDynamicRoleProcessor, self).__init__(init_params)
         self.current_tasks = []
         self.current_role_name = None
+        # whether the current role name was generated (in which case the role will be named after its content)
+        self.current_role_name_generated = False
 
     def validate_init(self):
 
@@ -1010,8 +1063,8 @@ class NsblDynamicRoleProcessor(frkl.ConfigProcessor):
                 role_name = new_config[TASKS_META_KEY].get(ROLE_NAME_KEY, None)
                 if not role_name:
                     if not self.current_role_name:
-                        self.current_role_name = "{}_{}".format(DYN_ROLE_TYPE, NsblDynamicRoleProcessor.role_id)
-                        NsblDynamicRoleProcessor.role_id += 1
+                        self.current_role_name = "{}_{}".format(DYN_ROLE_TYPE, NsblDynamicRoleProcessor.next_role_id())
+                        self.current_role_name_generated = True
                     role_name = self.current_role_name
                     new_config[TASKS_META_KEY][ROLE_NAME_KEY] = role_name
                     self.current_tasks.append(new_config)
@@ -1019,14 +1072,15 @@ class NsblDynamicRoleProcessor(frkl.ConfigProcessor):
                 else:
                     if role_name != self.current_role_name:
                         if self.current_tasks:
-                            dyn_role = NsblDynRole(self.current_tasks, NsblDynamicRoleProcessor.role_id,
-                                                   self.role_repos)
-                            NsblDynamicRoleProcessor.role_id += 1
+                            dyn_role = NsblDynRole(self.current_tasks, NsblDynamicRoleProcessor.next_role_id(),
+                                                   self.role_repos, self.current_role_name_generated)
                             self.current_tasks = [new_config]
                             self.current_role_name = role_name
+                            self.current_role_name_generated = False
                             yield dyn_role
                         else:
                             self.current_role_name = role_name
+                            self.current_role_name_generated = False
                             self.current_tasks.append(new_config)
                             yield None
                     else:
@@ -1035,22 +1089,23 @@ class NsblDynamicRoleProcessor(frkl.ConfigProcessor):
 
             elif new_config[TASKS_META_KEY][TASK_TYPE_KEY] in [INT_ROLE_TASK_TYPE, EXT_ROLE_TASK_TYPE]:
                 if len(self.current_tasks) > 0:
-                    dyn_role = NsblDynRole(self.current_tasks, NsblDynamicRoleProcessor.role_id, self.role_repos)
-                    NsblDynamicRoleProcessor.role_id += 1
+                    dyn_role = NsblDynRole(self.current_tasks, NsblDynamicRoleProcessor.next_role_id(), self.role_repos,
+                                           self.current_role_name_generated)
                     self.current_tasks = []
                     self.current_role_name = None
+                    self.current_role_name_generated = False
                     yield dyn_role
                 if new_config[TASKS_META_KEY][TASK_TYPE_KEY] == INT_ROLE_TASK_TYPE:
                     role = NsblInternalRole(new_config[TASKS_META_KEY], new_config.get(VARS_KEY, {}),
-                                            NsblDynamicRoleProcessor.role_id)
-                    NsblDynamicRoleProcessor.role_id += 1
+                                            NsblDynamicRoleProcessor.next_role_id())
                     self.current_role_name = None
+                    self.current_role_name_generated = False
                     yield role
                 else:
                     role = NsblExternalRole(new_config[TASKS_META_KEY], new_config.get(VARS_KEY, {}),
-                                            NsblDynamicRoleProcessor.role_id)
-                    NsblDynamicRoleProcessor.role_id += 1
+                                            NsblDynamicRoleProcessor.next_role_id())
                     self.current_role_name = None
+                    self.current_role_name_generated = False
                     yield role
 
             else:
@@ -1063,7 +1118,8 @@ class NsblDynamicRoleProcessor(frkl.ConfigProcessor):
 
         else:
             if len(self.current_tasks) > 0:
-                role = NsblDynRole(self.current_tasks, NsblDynamicRoleProcessor.role_id, self.role_repos)
+                role = NsblDynRole(self.current_tasks, NsblDynamicRoleProcessor.next_role_id(), self.role_repos,
+                                   self.current_role_name_generated)
                 yield role
             else:
                 yield None
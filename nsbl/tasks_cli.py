@@ -1,20 +1,23 @@
 # -*- coding: utf-8 -*-
 
 import json
+import logging
 import pprint
 import sys
 
 import click
 import click_log
-import yaml
 
 from . import __version__ as VERSION
 from .defaults import *
-from .nsbl import Nsbl, NsblRunner
+
+logger = logging.getLogger('nsbl')
 
 
 def output(python_object, format="raw", pager=False):
     if format == 'yaml':
+        import yaml
+
         output_string = yaml.safe_dump(python_object, default_flow_style=False, encoding='utf-8', allow_unicode=True)
     elif format == 'json':
         output_string = json.dumps(python_object, sort_keys=4, indent=4)
@@ -35,9 +38,8 @@ def output(python_object, format="raw", pager=False):
 @click.option('--version', help='the version of frkl you are using', is_flag=True)
 @click.option('--role-repo', '-r', help='path to a local folder containing ansible roles', multiple=True)
 @click.option('--task-desc', '-t', help='path to a local task description yaml file', multiple=True)
-@click_log.simple_verbosity_option()
+@click_log.simple_verbosity_option(logger)
 @click.pass_context
-@click_log.init("nsbl")
 def cli(ctx, version, role_repo, task_desc):
     """Console script for nsbl"""
 
@@ -45,9 +47,7 @@ def cli(ctx, version, role_repo, task_desc):
         click.echo(VERSION)
         sys.exit(0)
 
-    ctx.obj = {}
-    ctx.obj['role-repos'] = calculate_role_repos(role_repo, use_default_roles=True)
-    ctx.obj['task-desc'] = calculate_task_descs(task_desc, ctx.obj['role-repos'])
+    ctx.obj = {"role-repo-args": list(role_repo), "task-desc-args": list(task_desc)}
 
 
 @cli.command('execute')
@@ -61,7 +61,11 @@ def cli(ctx, version, role_repo, task_desc):
 @click.option('--force', '-f', is_flag=True, help="delete potentially existing target directory", default=False)
 @click.pass_context
 def execute(ctx, config, stdout_callback, target, force):
-    nsbl = Nsbl.create(config, ctx.obj['role-repos'], ctx.obj['task-desc'], wrap_into_hosts=["localhost"])
+    from .nsbl import Nsbl, NsblRunner
+
+    role_repos = calculate_role_repos(ctx.obj['role-repo-args'], use_default_roles=True)
+    task_descs = calculate_task_descs(ctx.obj['task-desc-args'], role_repos)
+    nsbl = Nsbl.create(config, role_repos, task_descs, wrap_into_hosts=["localhost"])
 
     runner = NsblRunner(nsbl)
     runner.run(target, force, "", stdout_callback)
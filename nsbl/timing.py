@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from builtins import *
+
+log = logging.getLogger("nsbl")
+
+
+class PhaseTimer(object):
+    def __init__(self, spans=None):
+        """Records how long the phases of creating, rendering and running an environment take.
+
+        Every recorded span is a dict with the keys 'name' (the phase), 'start' (timestamp), 'duration' (in
+        seconds), and optionally 'env' (the play/environment the span belongs to).
+
+        Args:
+          spans (list): spans that were recorded earlier (e.g. while creating the Nsbl object)
+        """
+
+        self.spans = list(spans) if spans else []
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+
+        return {"spans": self.get_spans()}
+
+    def __setstate__(self, state):
+
+        self.__init__(state["spans"])
+
+    @contextmanager
+    def span(self, name, env=None):
+        """Context manager that records the duration of the code it wraps.
+
+        Args:
+          name (str): the name of the phase
+          env (str): the name of the play/environment, if the span is specific to one
+        """
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            span = {"name": name, "start": start, "duration": time.time() - start}
+            if env is not None:
+                span["env"] = env
+            with self._lock:
+                self.spans.append(span)
+
+    def get_spans(self):
+        """Returns a copy of all recorded spans, ordered by start time."""
+
+        with self._lock:
+            return sorted([dict(span) for span in self.spans], key=lambda s: s["start"])
+
+    def get_phases(self):
+        """Returns the total duration (in seconds) of every phase, summed over all its spans."""
+
+        result = {}
+        for span in self.get_spans():
+            result[span["name"]] = result.get(span["name"], 0) + span["duration"]
+        return result
+
+    def as_dict(self):
+
+        return {"spans": self.get_spans(), "phases": self.get_phases()}
+
+    def to_json(self):
+
+        return json.dumps(self.as_dict(), sort_keys=True, indent=2)
+
+    def write_json(self, path):
+        """Writes all spans and phase totals into a json file.
+
+        Args:
+          path (str): the path of the file
+        """
+
+        log.debug("Writing timings to: {}".format(path))
+        with open(path, "w") as f:
+            f.write("{}".format(self.to_json()))
@@ -23,6 +23,11 @@ test_requirements = [
     'pytest>=3.2.2'
 ]
 
+extra_requirements = {
+    # faster decoding of the ansible output
+    'fast-json': ['ujson']
+}
+
 setup(
     name='nsbl',
     version='0.3.7',
@@ -38,7 +43,9 @@ setup(
                  'nsbl'},
     entry_points={
         'console_scripts': [
-            'nsbl=nsbl.nsbl.cli:cli',
+            'nsbl=nsbl.cli:cli',
+            'nsbl-client=nsbl.daemon:client_main',
+            'nsbl-daemon=nsbl.daemon:daemon_main',
             'nsbl-inventory=nsbl.inventory_cli:main',
             'nsbl-playbook=nsbl.playbook_cli:cli',
             'nsbl-tasks=nsbl.tasks_cli:cli'
@@ -54,6 +61,7 @@ setup(
     },
     include_package_data=True,
     install_requires=requirements,
+    extras_require=extra_requirements,
     license="GNU General Public License v3",
     zip_safe=False,
     keywords='nsbl',
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_async_runner
+----------------------------------
+
+Tests for `nsbl.async_runner` module.
+"""
+
+import os
+import stat
+import time
+
+from nsbl.async_runner import AsyncNsblRunner
+
+
+class FakeNsbl(object):
+    """Stand-in for a Nsbl object, 'renders' a run script that prints the lines it got."""
+
+    def __init__(self, script):
+        self.script = script
+
+    def render(self, target, extract_vars=True, **kwargs):
+        os.makedirs(target)
+        script_file = os.path.join(target, "run_all_plays.sh")
+        with open(script_file, "w") as f:
+            f.write("#!/bin/sh\n" + self.script)
+        os.chmod(script_file, os.stat(script_file).st_mode | stat.S_IEXEC)
+        return {"env_dir": target, "run_playbooks_script": script_file, "ask_become_pass": False}
+
+
+class ListConsumer(object):
+
+    def __init__(self):
+        self.log = []
+        self.errors = []
+        self.finished = False
+
+    def add_log_message(self, line):
+        self.log.append(line.strip())
+
+    def add_error_message(self, line):
+        self.errors.append(line.strip())
+
+    def finish_up(self):
+        self.finished = True
+
+
+def test_concurrent_runs_stream_to_their_consumers(tmpdir):
+
+    runs = []
+    for i in range(3):
+        runner = AsyncNsblRunner(FakeNsbl("echo start {0}\nsleep 1\necho error {0} >&2\nexit {0}\n".format(i)))
+        consumer = ListConsumer()
+        runs.append((runner.start(str(tmpdir.join("env_{}".format(i))), consumer=consumer), consumer))
+
+    started = time.time()
+    for i, (run, consumer) in enumerate(runs):
+        assert run.wait(10) == i
+        assert consumer.log == ["start {}".format(i)]
+        assert consumer.errors == ["error {}".format(i)]
+        assert consumer.finished
+    assert time.time() - started < 2.5
+
+
+def test_cancel_kills_process_group(tmpdir):
+
+    finished = []
+    runner = AsyncNsblRunner(FakeNsbl("echo started\nsleep 30 &\nwait\necho done\n"))
+    consumer = ListConsumer()
+    run = runner.start(str(tmpdir.join("env")), consumer=consumer, done_callback=finished.append)
+
+    while not consumer.log:
+        time.sleep(0.05)
+    assert run.cancel()
+
+    assert run.wait(5) == -15
+    assert run.cancelled
+    assert finished == [run]
+    assert consumer.log == ["started"]
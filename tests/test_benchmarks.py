@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_benchmarks
+----------------------------------
+
+Tests for the synthetic inputs and the runner of the benchmark suite (in the `benchmarks` folder).
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import suite  # noqa: E402
+import synthetic  # noqa: E402
+from nsbl.defaults import calculate_task_descs  # noqa: E402
+from nsbl.nsbl import Nsbl  # noqa: E402
+from nsbl.tasks import find_roles_in_repo  # noqa: E402
+
+
+def test_synthetic_inputs(tmpdir):
+
+    role_repo = synthetic.create_role_repo(str(tmpdir.join("roles")), 60)
+    assert len(find_roles_in_repo(role_repo)) == 60
+
+    aliases = [t["meta"]["name"] for t in calculate_task_descs(None, [role_repo], add_upper_case_versions=False)]
+    assert aliases == [synthetic.get_alias_name(i) for i in range(60)]
+
+    config = synthetic.create_config(100, 4, 60, number_of_host_envs=2)
+    nsbl = Nsbl.create(config, [role_repo], [], pre_chain=[])
+    assert len(nsbl.inventory.hosts) == 100
+    assert len(nsbl.plays) == 6
+
+    # every alias with a list of two paths is split into two tasks, plus the 'shell' task of every group
+    lookup_index = nsbl.get_lookup_index()
+    assert len([key for key in lookup_index.records.keys() if key[2] is not None]) == 4 * (2 * 2 + 1)
+
+    events = synthetic.create_event_stream(lookup_index, 200)
+    assert len(events) >= 200
+
+
+def test_suite_runs_and_finds_regressions(tmpdir):
+
+    durations = suite.run_suite("tiny", repeats=1, work_dir=str(tmpdir))
+    results = suite.get_relative_results(durations)
+    assert sorted(results.keys()) == ["Nsbl.create", "Nsbl.render", "calculate_task_descs", "event_adapter",
+                                      "find_roles_in_repo"]
+    assert results["Nsbl.render"] == durations["Nsbl.render"] / durations[suite.CALIBRATION_BENCHMARK]
+
+    baselines = dict((name, duration * 2) for name, duration in results.items())
+    assert suite.find_regressions(results, baselines, 0.3) == []
+    baselines["Nsbl.render"] = results["Nsbl.render"] / 2
+    assert suite.find_regressions(results, baselines, 0.3) == ["Nsbl.render"]
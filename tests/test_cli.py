@@ -8,11 +8,32 @@ test_nsbl
 Tests for `nsbl` module.
 """
 
+import json
+import os
 import pprint
+import subprocess
+import sys
 
+import pytest
 from click.testing import CliRunner
 from nsbl import cli
 
+CLI_MODULES = ["nsbl.cli", "nsbl.playbook_cli", "nsbl.tasks_cli", "nsbl.inventory_cli"]
+# modules that are only needed once a command does actual work
+DEFERRED_MODULES = ["frkl", "jinja2", "cookiecutter", "yaml", "nsbl.nsbl", "nsbl.inventory", "nsbl.tasks"]
+# maximum time (in seconds) it may take to import a cli module in a fresh interpreter
+CLI_IMPORT_BUDGET = float(os.environ.get("NSBL_CLI_IMPORT_BUDGET", 0.15))
+
+
+def import_in_fresh_interpreter(module):
+    """Imports a module in a new python process, returns the import time and all modules that got imported."""
+
+    script = ("import json, sys, time, warnings; warnings.simplefilter('ignore'); "
+              "start = time.time(); import {}; duration = time.time() - start; "
+              "print(json.dumps({{'duration': duration, 'modules': sorted(sys.modules.keys())}}))".format(module))
+    output = subprocess.check_output([sys.executable, "-c", script])
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
 
 def test_command_line_interface():
     runner = CliRunner()
@@ -24,3 +45,35 @@ def test_command_line_interface():
     assert 'Show this message and exit.' in help_result.output
 
 
+
+
+@pytest.mark.parametrize("module", CLI_MODULES)
+def test_cli_imports_are_deferred(module):
+
+    imported = import_in_fresh_interpreter(module)["modules"]
+    assert [m for m in DEFERRED_MODULES if m in imported] == []
+
+
+@pytest.mark.parametrize("module", CLI_MODULES)
+def test_cli_import_time_budget(module):
+
+    # the fastest of a few tries, to not fail because of a busy machine
+    duration = min(import_in_fresh_interpreter(module)["duration"] for i in range(3))
+    assert duration < CLI_IMPORT_BUDGET, "importing '{}' took {:.3f}s (budget: {}s)".format(
+        module, duration, CLI_IMPORT_BUDGET)
+
+
+def test_task_descs_are_only_calculated_when_needed(monkeypatch):
+
+    calls = []
+    monkeypatch.setattr(cli, "calculate_task_descs", lambda task_descs, role_repos: calls.append(task_descs) or [])
+
+    runner = CliRunner()
+    assert runner.invoke(cli.cli, ["--version"]).output.strip() == cli.VERSION
+    result = runner.invoke(cli.cli, ["list-groups", "--help"])
+    assert result.exit_code == 0
+    assert calls == []
+
+    result = runner.invoke(cli.cli, ["-t", "extra.yml", "print-available-tasks", "--format", "json"])
+    assert result.exit_code == 0
+    assert calls == [["extra.yml"]]
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_daemon
+----------------------------------
+
+Tests for `nsbl.daemon` module.
+"""
+
+import io
+import json
+import os
+import threading
+
+import pytest
+
+from nsbl import __version__ as VERSION
+from nsbl.daemon import NsblDaemon, get_unsupported_reason, send_request
+from nsbl.defaults import calculate_task_descs
+
+CONFIG = [{"envs": [{"meta": {"name": "group_1", "type": "group", "hosts": ["host_1"]},
+                     "tasks": [{"shell": {"free_form": "echo 1"}}]}]}]
+
+
+@pytest.fixture
+def daemon(tmpdir):
+
+    daemon = NsblDaemon(str(tmpdir.join("daemon.sock")))
+    thread = threading.Thread(target=daemon.serve)
+    thread.daemon = True
+    thread.start()
+    yield daemon
+    send_request({"command": "stop"}, socket_path=daemon.socket_path)
+    thread.join(10)
+
+
+def run(daemon, program, argv, cwd=None):
+
+    stdout = io.BytesIO()
+    stderr = io.BytesIO()
+    exit_code = send_request({"program": program, "argv": argv, "cwd": cwd}, socket_path=daemon.socket_path,
+                             stdout=stdout, stderr=stderr)
+    return exit_code, stdout.getvalue().decode("utf-8"), stderr.getvalue().decode("utf-8")
+
+
+def test_daemon_runs_commands(daemon, tmpdir):
+
+    tmpdir.join("config.yml").write(json.dumps(CONFIG))
+
+    assert run(daemon, "nsbl", ["--version"]) == (0, "{}\n".format(VERSION), "")
+
+    # relative paths are relative to the working directory of the client
+    exit_code, stdout, stderr = run(daemon, "nsbl", ["list-groups", "--format", "json", "config.yml"],
+                                    cwd=str(tmpdir))
+    assert exit_code == 0
+    assert json.loads(stdout)["group_1"]["hosts"] == ["host_1"]
+
+    exit_code, stdout, stderr = run(daemon, "nsbl-inventory", ["--config", "config.yml", "--host", "host_1"],
+                                    cwd=str(tmpdir))
+    assert exit_code == 0
+    assert json.loads(stdout) == {}
+
+    exit_code, stdout, stderr = run(daemon, "nsbl", ["list-groups", "--bogus"])
+    assert exit_code == 2
+    assert "no such option" in stderr.lower()
+
+
+def test_daemon_leaves_interactive_commands_to_the_client(daemon):
+
+    assert get_unsupported_reason("nsbl", ["-r", "repo", "run", "config.yml"]) is not None
+    assert get_unsupported_reason("nsbl-playbook", ["config.yml"]) is not None
+    assert get_unsupported_reason("nsbl-playbook", ["--no-run", "config.yml"]) is None
+    assert get_unsupported_reason("nsbl", ["-r", "repo", "list-roles", "config.yml"]) is None
+
+    assert run(daemon, "nsbl", ["run", "config.yml"]) == (None, "", "")
+
+
+def test_no_daemon(tmpdir):
+
+    assert send_request({"program": "nsbl", "argv": ["--version"]},
+                        socket_path=str(tmpdir.join("missing.sock"))) is None
+
+
+def test_task_descs_cache_notices_changed_files(tmpdir):
+
+    task_desc = tmpdir.join("task-aliases.yml")
+    task_desc.write("- meta:\n    name: install-pkgs\n    task-desc: installing packages\n")
+
+    first = calculate_task_descs([str(task_desc)], add_upper_case_versions=False)
+    second = calculate_task_descs([str(task_desc)], add_upper_case_versions=False)
+    assert first == second
+    # callers can change the result without changing the cache
+    assert first is not second
+    first[0]["meta"]["name"] = "changed"
+    assert calculate_task_descs([str(task_desc)], add_upper_case_versions=False) == second
+
+    task_desc.write("- meta:\n    name: install-packages\n    task-desc: installing packages\n")
+    os.utime(str(task_desc), (1, 1))
+    assert calculate_task_descs([str(task_desc)], add_upper_case_versions=False)[0]["meta"]["name"] == \
+        "install-packages"
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_event_bus
+----------------------------------
+
+Tests for `nsbl.event_bus` module.
+"""
+
+import json
+import threading
+import time
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from nsbl.event_bus import EventBus, EventSink, MetricsSink, WebhookSink
+from nsbl.metrics import RunMetrics
+
+
+class RecordingSink(EventSink):
+    def __init__(self, delay=0, release=None):
+
+        self.delay = delay
+        self.release = release
+        self.lines = []
+        self.errors = []
+        self.closed = None
+
+    def process_lines(self, timestamp, lines):
+
+        if self.release is not None:
+            self.release.wait()
+        time.sleep(self.delay)
+        self.lines.extend(lines)
+
+    def process_error(self, timestamp, line):
+
+        self.errors.append(line)
+
+    def close(self, timestamp, aborted=False):
+
+        self.closed = aborted
+
+
+def test_slow_sink_does_not_block_publisher():
+
+    fast = RecordingSink()
+    slow = RecordingSink(delay=0.05)
+    bus = EventBus([fast, slow])
+
+    start = time.time()
+    for i in range(20):
+        bus.add_log_messages(["line {}".format(i)])
+    bus.add_error_message("error")
+    assert time.time() - start < 0.5
+
+    bus.finish_up()
+    expected = ["line {}".format(i) for i in range(20)]
+    assert fast.lines == expected
+    assert slow.lines == expected
+    assert slow.errors == ["error"]
+    assert fast.closed is False and slow.closed is False
+
+
+def test_full_queue_drops_batches_for_lossy_sinks():
+
+    release = threading.Event()
+    blocked = RecordingSink(release=release)
+    bus = EventBus(max_queue_size=2)
+    bus.subscribe(blocked, lossy=True)
+
+    start = time.time()
+    for i in range(10):
+        bus.add_log_messages(["line {}".format(i)])
+    assert time.time() - start < 0.5
+    release.set()
+    bus.close(aborted=True)
+
+    assert 0 < len(blocked.lines) < 10
+    assert bus.subscriptions[0]["dropped"] == 10 - len(blocked.lines)
+    assert blocked.closed is True
+
+
+def test_full_queue_blocks_publisher():
+
+    release = threading.Event()
+    blocked = RecordingSink(release=release)
+    bus = EventBus([blocked], max_queue_size=2)
+
+    publisher = threading.Thread(target=lambda: [bus.add_log_messages(["line {}".format(i)]) for i in range(10)])
+    publisher.start()
+    publisher.join(0.5)
+    assert publisher.is_alive()
+
+    release.set()
+    publisher.join(10)
+    bus.close()
+
+    assert blocked.lines == ["line {}".format(i) for i in range(10)]
+    assert bus.subscriptions[0]["dropped"] == 0
+
+
+def test_metrics_sink_uses_read_time():
+
+    metrics = RunMetrics()
+    bus = EventBus([MetricsSink(metrics)])
+    bus.add_log_messages([json.dumps({"category": "play_start"}), "not an event"])
+    bus.add_log_messages([json.dumps({"category": "ok", "_env_id": 0, "_role_id": 0, "name": "task"})])
+    bus.finish_up()
+
+    assert [kind for kind, name, duration in metrics.spans] == ["task", "role", "env"]
+
+
+def test_webhook_sink():
+
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers["Content-Length"])
+            received.append(json.loads(self.rfile.read(length).decode("utf-8")))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        sink = WebhookSink("http://127.0.0.1:{}/events".format(server.server_address[1]))
+        bus = EventBus([sink])
+        bus.add_log_messages([json.dumps({"category": "play_start"}), "not an event"])
+        bus.finish_up()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert received[0]["events"] == [{"category": "play_start"}]
+    assert received[1]["finished"] is True
+    assert sink.failed_requests == 0
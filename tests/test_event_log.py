@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_event_log
+----------------------------------
+
+Tests for `nsbl.event_log` module.
+"""
+
+import json
+import os
+
+from click.testing import CliRunner
+
+from nsbl import cli
+from nsbl.defaults import EVENT_LOG_FILENAME, LOOKUP_INDEX_FILENAME
+from nsbl.event_log import EventLogWriter, iter_events, iter_indexed_events, load_event_log_index
+from nsbl.lookup_index import LookupIndex
+from nsbl.nsbl import Nsbl
+
+from .test_nsbl import CONFIG
+
+
+def _events():
+
+    events = [{"category": "play_start"}]
+    for env_id in range(3):
+        for role_id in range(2):
+            task_id = "dyn_role_{}_0000".format(role_id)
+            events.append({"category": "ok", "_env_id": env_id, "_role_id": role_id, "_dyn_task_id": task_id,
+                           "stdout_lines": [u"env {} role {}".format(env_id, role_id)]})
+            events.append({"category": "nsbl_item_ok", "item": "item"})
+    return events
+
+
+def test_event_log_roundtrip_and_index(tmpdir):
+
+    path = str(tmpdir.join("events.jsonl.gz"))
+    writer = EventLogWriter(path, max_buffered_events=4)
+    for event in _events():
+        writer.add_event(json.dumps(event), event)
+    writer.close()
+
+    events = list(iter_events(path))
+    assert len(events) == 13
+    assert events[0] == {"category": "play_start"}
+    assert [(e["_env_id"], e["_role_id"]) for e in events if e["category"] == "nsbl_item_ok"] == \
+        [(env_id, role_id) for env_id in range(3) for role_id in range(2)]
+
+    index = load_event_log_index(path)
+    assert index["events"] == 13
+    assert len(index["blocks"]) == 4
+    assert index["keys"]["2/1/dyn_role_1_0000"] == [index["blocks"][2][0], index["blocks"][3][0]]
+
+    env_events = list(iter_indexed_events(path, 1, index=index))
+    assert len(env_events) == 4
+    assert all(e["_env_id"] == 1 for e in env_events)
+    role_events = list(iter_indexed_events(path, 2, role_id=1))
+    assert [e["category"] for e in role_events] == ["ok", "nsbl_item_ok"]
+    assert role_events[0]["stdout_lines"] == [u"env 2 role 1"]
+    assert list(iter_indexed_events(path, 0, role_id=1, task_id="dyn_role_0_0000")) == []
+
+
+def test_replay_run_from_event_log(tmpdir):
+
+    nsbl = Nsbl.create(CONFIG, pre_chain=[])
+    env_dir = nsbl.render(str(tmpdir.join("env")), ask_become_pass="false")["env_dir"]
+    lookup_index = LookupIndex.load_json(os.path.join(env_dir, LOOKUP_INDEX_FILENAME))
+    assert lookup_index.records == nsbl.get_lookup_index().records
+
+    writer = EventLogWriter(os.path.join(env_dir, EVENT_LOG_FILENAME), max_buffered_events=3)
+    events = [{"category": "play_start"}]
+    for env_id, role_id, task_id in sorted(lookup_index.records.keys(), key=str):
+        if role_id is not None and task_id is None:
+            events.append({"category": "ok", "_env_id": env_id, "_role_id": role_id, "name": "shell",
+                           "status": "changed", "skipped": False})
+    for event in events:
+        writer.add_event(json.dumps(event), event)
+    writer.close()
+
+    result = CliRunner().invoke(cli.cli, ["replay", env_dir])
+    assert result.exit_code == 0
+    assert result.output.count("   => ok (changed)") == 4
+    assert "* starting tasks (on 'group_1')..." in result.output
+
+    result = CliRunner().invoke(cli.cli, ["replay", str(tmpdir)])
+    assert result.exit_code == 1
+    assert "No event log" in result.output
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_external_roles
+----------------------------------
+
+Tests for `nsbl.external_roles` module.
+"""
+
+import os
+import sys
+import threading
+
+import yaml
+
+from nsbl import external_roles
+
+ROLES = [
+    {"name": "geerlingguy.git", "src": "geerlingguy.git", "type": "remote"},
+    {"name": "nginx", "src": "https://github.com/jdauphant/ansible-role-nginx.git", "version": "v2.0",
+     "type": "remote"}
+]
+
+# stand-in for 'ansible-galaxy install -r <file> -p <dir>', logs every installed role and sleeps a bit to make
+# races between concurrent installs likely
+FAKE_GALAXY = """
+import os, sys, time, yaml
+args = sys.argv[1:]
+requirements = yaml.safe_load(open(args[args.index("-r") + 1]))
+target = args[args.index("-p") + 1]
+for role in requirements:
+    with open({log!r}, "a") as f:
+        f.write("{{}} {{}}\\n".format(role["name"], role.get("version", None)))
+    time.sleep(0.2)
+    os.makedirs(os.path.join(target, role["name"], "meta"))
+    with open(os.path.join(target, role["name"], "meta", "main.yml"), "w") as f:
+        f.write("version: {{}}\\n".format(role.get("version", None)))
+"""
+
+
+def _fake_galaxy(tmpdir):
+
+    log_file = str(tmpdir.join("galaxy.log"))
+    script = tmpdir.join("fake_galaxy.py")
+    script.write(FAKE_GALAXY.format(log=log_file))
+
+    def installed():
+        if not os.path.exists(log_file):
+            return []
+        with open(log_file) as f:
+            return f.read().splitlines()
+
+    return [sys.executable, str(script)], installed
+
+
+def _populate_cache(cache_dir, roles):
+
+    for role in roles:
+        os.makedirs(external_roles.get_role_store_path(role, cache_dir))
+    external_roles.update_role_lock(added=roles, role_cache_dir=cache_dir)
+
+
+def test_satisfied_roles_skip_galaxy(tmpdir, monkeypatch):
+
+    cache_dir = str(tmpdir.join("cache"))
+    requirements_file = str(tmpdir.join("env", "roles", "roles_requirements.yml"))
+    _populate_cache(cache_dir, ROLES)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("ansible-galaxy should not be called")
+
+    monkeypatch.setattr(external_roles, "install_roles_with_galaxy", fail)
+
+    installed = external_roles.resolve_external_roles(ROLES, requirements_file, role_cache_dir=cache_dir)
+
+    assert installed == []
+    with open(requirements_file) as f:
+        requirements = yaml.safe_load(f)
+    assert [r["name"] for r in requirements] == ["geerlingguy.git", "nginx"]
+
+
+def test_new_version_is_stored_next_to_old_one(tmpdir):
+
+    cache_dir = str(tmpdir.join("cache"))
+    requirements_file = str(tmpdir.join("env", "roles", "roles_requirements.yml"))
+    _populate_cache(cache_dir, ROLES)
+    galaxy_command, galaxy_log = _fake_galaxy(tmpdir)
+
+    roles = [ROLES[0], dict(ROLES[1], version="v3.0")]
+    installed = external_roles.resolve_external_roles(roles, requirements_file, role_cache_dir=cache_dir,
+                                                      galaxy_command=galaxy_command)
+
+    assert [r["name"] for r in installed] == ["nginx"]
+    assert galaxy_log() == ["nginx v3.0"]
+    assert len(external_roles.read_role_lock(cache_dir)) == 3
+    assert os.path.isdir(external_roles.get_role_store_path(ROLES[1], cache_dir))
+    with open(os.path.join(external_roles.get_role_store_path(roles[1], cache_dir), "meta", "main.yml")) as f:
+        assert f.read().strip() == "version: v3.0"
+
+    # switching back doesn't need a download
+    external_roles.resolve_external_roles(ROLES, requirements_file, role_cache_dir=cache_dir,
+                                          galaxy_command=galaxy_command)
+    assert galaxy_log() == ["nginx v3.0"]
+
+
+def test_download_output_can_go_to_stderr(tmpdir, capsys):
+
+    cache_dir = str(tmpdir.join("cache"))
+    requirements_file = str(tmpdir.join("env", "roles", "roles_requirements.yml"))
+    galaxy_command, galaxy_log = _fake_galaxy(tmpdir)
+
+    external_roles.resolve_external_roles(ROLES, requirements_file, role_cache_dir=cache_dir,
+                                          galaxy_command=galaxy_command, output_to_stderr=True)
+
+    out, err = capsys.readouterr()
+    assert out == ""
+    assert "Downloading external roles" in err
+
+
+def test_prune_keeps_referenced_and_recently_used_entries(tmpdir):
+
+    cache_dir = str(tmpdir.join("cache"))
+    roles = [dict(ROLES[1], version="v{}".format(i)) for i in range(4)]
+    _populate_cache(cache_dir, roles)
+
+    env_dir = tmpdir.mkdir("env")
+    external_roles.add_role_reference(roles[0], str(env_dir), cache_dir)
+    deleted_env_dir = tmpdir.mkdir("deleted_env")
+    external_roles.add_role_reference(roles[1], str(deleted_env_dir), cache_dir)
+    deleted_env_dir.remove()
+
+    for i, role in enumerate(roles):
+        external_roles.touch_role_store_entry(role, cache_dir)
+        last_used = os.path.join(external_roles.get_role_store_entry(role, cache_dir),
+                                 external_roles.ROLE_STORE_LAST_USED_FILENAME)
+        os.utime(last_used, (1000 + i, 1000 + i))
+
+    removed = external_roles.prune_role_store(cache_dir, max_entries=1)
+
+    assert sorted(removed) == sorted(external_roles.get_role_store_key(r) for r in roles[1:3])
+    lock = external_roles.read_role_lock(cache_dir)
+    assert sorted(lock.keys()) == sorted(external_roles.get_role_store_key(r) for r in (roles[0], roles[3]))
+
+
+def test_concurrent_fetches_download_each_role_once(tmpdir):
+
+    cache_dir = str(tmpdir.join("cache"))
+    galaxy_command, galaxy_log = _fake_galaxy(tmpdir)
+    errors = []
+
+    def fetch():
+        try:
+            external_roles.fetch_roles(ROLES, cache_dir, galaxy_command=galaxy_command)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=fetch) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert sorted(galaxy_log()) == ["geerlingguy.git None", "nginx v2.0"]
+    lock = external_roles.read_role_lock(cache_dir)
+    assert sorted(entry["name"] for entry in lock.values()) == ["geerlingguy.git", "nginx"]
+    assert os.listdir(os.path.join(cache_dir, external_roles.ROLE_CACHE_STAGING_DIRNAME)) == []
+
+
+def test_locked_entries_are_not_pruned(tmpdir):
+
+    cache_dir = str(tmpdir.join("cache"))
+    requirements_file = str(tmpdir.join("env", "roles", "roles_requirements.yml"))
+    _populate_cache(cache_dir, ROLES)
+
+    # no environment to reference the entries
+    entries_lock = external_roles.lock_external_roles(ROLES, requirements_file, role_cache_dir=cache_dir)
+    keys = [external_roles.get_role_store_key(role) for role in ROLES]
+    assert external_roles.prune_role_store(cache_dir, max_entries=0, exclude=keys) == []
+
+    removed = []
+    prune = threading.Thread(target=lambda: removed.extend(external_roles.prune_role_store(cache_dir, max_entries=0)))
+    prune.start()
+    prune.join(0.5)
+    assert prune.is_alive()
+    assert all(os.path.isdir(external_roles.get_role_store_path(role, cache_dir)) for role in ROLES)
+
+    entries_lock.release()
+    prune.join(10)
+    assert sorted(removed) == sorted(keys)
+
+
+def test_store_is_only_pruned_when_over_its_limits(tmpdir, monkeypatch):
+
+    cache_dir = str(tmpdir.join("cache"))
+    _populate_cache(cache_dir, ROLES)
+    pruned = []
+
+    def prune(*args, **kwargs):
+        pruned.append(kwargs)
+        return []
+
+    monkeypatch.setattr(external_roles, "prune_role_store", prune)
+
+    external_roles.prune_role_store_if_needed(cache_dir, max_entries=2, max_size=None)
+    assert pruned == []
+    external_roles.prune_role_store_if_needed(cache_dir, max_entries=1, max_size=None)
+    assert len(pruned) == 1
+
+    # the size limit can only be checked by walking the store, which happens at most once per interval
+    external_roles.prune_role_store_if_needed(cache_dir, max_entries=2, max_size=1000, interval=3600)
+    external_roles.prune_role_store_if_needed(cache_dir, max_entries=2, max_size=1000, interval=3600)
+    assert len(pruned) == 1
+    external_roles.prune_role_store_if_needed(cache_dir, max_entries=2, max_size=1000, interval=0)
+    assert len(pruned) == 2
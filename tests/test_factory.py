@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_factory
+----------------------------------
+
+Tests for `nsbl.factory` module.
+"""
+
+import os
+
+from nsbl.factory import NsblFactory
+from nsbl.render_targets import InMemoryRenderTarget
+from nsbl.tasks import NsblDynamicRoleProcessor
+
+from .test_nsbl import CONFIG
+
+
+def _config(index):
+
+    return [{"envs": [{"meta": {"name": "host_{}".format(index), "type": "host"},
+                       "tasks": [{"shell": {"free_form": "echo {}".format(index)}}]}]}]
+
+
+def test_factory_creates_and_renders_many_configs_in_parallel(tmpdir):
+
+    factory = NsblFactory()
+    configs = [_config(i) for i in range(6)]
+
+    nsbls = factory.create_many(configs + [CONFIG], max_workers=4, pre_chain=[])
+    assert [sorted(n.plays.keys()) for n in nsbls[:6]] == [["host_{}_0".format(i)] for i in range(6)]
+    assert nsbls[-1].get_play_chains() == factory.create(CONFIG, pre_chain=[]).get_play_chains()
+
+    targets = {}
+
+    def target_factory(env_dir):
+        targets[env_dir] = InMemoryRenderTarget()
+        return targets[env_dir]
+
+    jobs = [(config, "/tmp/nsbl_env_{}".format(i)) for i, config in enumerate(configs)]
+    results = factory.render_many(jobs, max_workers=4, create_args={"pre_chain": []}, ask_become_pass="false",
+                                  render_target_factory=target_factory)
+    assert [r["env_dir"] for r in results] == [env_dir for _, env_dir in jobs]
+    for i, (_, env_dir) in enumerate(jobs):
+        playbook = targets[env_dir].read_file(os.path.join("plays", "play_host_{}_0.yml".format(i)))
+        assert "echo {}".format(i) in playbook.decode("utf-8")
+
+    on_disk = factory.render_many([(configs[0], str(tmpdir.join("env_0"))), (configs[1], str(tmpdir.join("env_1")))],
+                                  max_workers=2, create_args={"pre_chain": []}, ask_become_pass="false")
+    assert all(os.path.exists(r["run_playbooks_script"]) for r in on_disk)
+
+
+def test_role_ids_are_unique_across_parallel_creates():
+
+    nsbls = NsblFactory().create_many([_config(i) for i in range(8)] + [CONFIG], max_workers=4, pre_chain=[])
+
+    role_ids = [role.role_id for nsbl in nsbls for tasks in nsbl.plays.values() for role in tasks.roles]
+    assert len(role_ids) == len(set(role_ids))
+    # every id was allocated, so later creates can't use it again
+    assert max(role_ids) < NsblDynamicRoleProcessor.role_id
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_metrics
+----------------------------------
+
+Tests for `nsbl.metrics` module.
+"""
+
+import json
+
+from nsbl.metrics import RunMetrics, calculate_percentile
+
+LOOKUP_DICT = {
+    0: {"name": "localhost", "tasks": {
+        0: {"name": "install-pkgs", "tasks": {"dyn_role_0_0000": {"meta": {"task-desc": "installing git"}}}},
+        1: {"name": "create-folder", "tasks": {}}}}
+}
+
+
+def test_percentile_nearest_rank():
+
+    values = list(range(1, 101))
+    assert calculate_percentile(values, 50) == 50
+    assert calculate_percentile(values, 99) == 99
+    assert calculate_percentile(values, 100) == 100
+    assert calculate_percentile([3], 90) == 3
+    assert calculate_percentile([], 50) is None
+
+
+def test_run_metrics_spans(tmpdir):
+
+    metrics = RunMetrics(LOOKUP_DICT)
+    events = [
+        (0, {"category": "play_start"}),
+        # setup task without ids, ignored
+        (0, {"category": "ok", "name": "setup"}),
+        (1, {"category": "ok", "_env_id": 0, "_role_id": 0, "_dyn_task_id": "dyn_role_0_0000", "name": "apt"}),
+        (1, {"category": "nsbl_item_started", "item": "git"}),
+        (3, {"category": "nsbl_item_ok", "item": "git"}),
+        (4, {"category": "item_ok", "_env_id": 0, "_role_id": 1, "name": "file", "item": "a"}),
+        (8, {"category": "item_ok", "_env_id": 0, "_role_id": 1, "name": "file", "item": "b"}),
+        (10, {"category": "ok", "_env_id": 0, "_role_id": 1, "name": "stat"}),
+    ]
+    for timestamp, event in events:
+        metrics.add_event(event, timestamp=timestamp)
+    metrics.finish(timestamp=12)
+
+    spans = dict(((kind, name), duration) for kind, name, duration in metrics.spans if kind != "item")
+    assert spans[("env", "localhost")] == 12
+    assert spans[("role", "localhost/install-pkgs")] == 3
+    assert spans[("role", "localhost/create-folder")] == 9
+    assert spans[("task", "localhost/install-pkgs/installing git")] == 3
+    assert spans[("task", "localhost/create-folder/file")] == 5
+    assert spans[("task", "localhost/create-folder/stat")] == 4
+    assert sorted(metrics.get_durations("item")) == [1, 2, 4]
+
+    summary = metrics.get_summary()
+    assert summary["role"]["count"] == 2
+    assert summary["task"]["count"] == 3
+    assert summary["item"]["p50"] == 2
+    assert summary["slowest_roles"][0]["name"] == "localhost/create-folder"
+
+    table = metrics.format_table(summary)
+    assert "slowest roles:" in table
+    assert "localhost/create-folder" in table
+
+    path = str(tmpdir.join("metrics.json"))
+    metrics.write_json(path)
+    with open(path) as f:
+        assert json.load(f)["role"]["total"] == 12
@@ -8,3 +8,156 @@ test_nsbl
 Tests for `nsbl` module.
 """
 
+import json
+import os
+
+import pytest
+import yaml
+from frkl.frkl import Frkl
+
+from nsbl import nsbl as nsbl_module
+from nsbl.exceptions import NsblException
+from nsbl.lookup_index import LookupIndex
+from nsbl.nsbl import Nsbl
+from nsbl.render_targets import InMemoryRenderTarget
+
+CONFIG = [
+    {"envs": [
+        {"meta": {"name": "group_1", "type": "group", "hosts": ["host_1", "host_2"]},
+         "tasks": [{"shell": {"free_form": "echo 1"}}]},
+        {"meta": {"name": "host_3", "type": "host"},
+         "tasks": [{"shell": {"free_form": "echo 2"}}]},
+        {"meta": {"name": "host_2", "type": "host"},
+         "tasks": [{"shell": {"free_form": "echo 3"}}]},
+        {"meta": {"name": "host_4", "type": "host"},
+         "tasks": [{"shell": {"free_form": "echo 4"}}]}
+    ]}
+]
+
+
+def test_play_chains_group_plays_with_shared_hosts():
+
+    nsbl = Nsbl.create(CONFIG, pre_chain=[])
+
+    chains = nsbl.get_play_chains()
+    env_names = sorted([[nsbl.plays[play].env_name for play in chain] for chain in chains])
+
+    assert env_names == [["group_1", "host_2"], ["host_3"], ["host_4"]]
+
+
+def test_sudo_probe_is_cached(tmpdir, monkeypatch):
+
+    probes = []
+
+    def probe():
+        probes.append(True)
+        return False
+
+    monkeypatch.setattr(nsbl_module, "_probe_passwordless_sudo", probe)
+    monkeypatch.setattr(nsbl_module, "SUDO_PROBE_CACHE", {})
+    cache_file = str(tmpdir.join("cache", "sudo_probe.json"))
+
+    assert not nsbl_module.can_passwordless_sudo(cache_file=cache_file)
+    assert not nsbl_module.can_passwordless_sudo(cache_file=cache_file)
+    assert len(probes) == 1
+    assert not nsbl_module.can_passwordless_sudo(ttl=0)
+    assert len(probes) == 2
+
+    # another process only sees the cache file
+    nsbl_module.SUDO_PROBE_CACHE.clear()
+    assert not nsbl_module.can_passwordless_sudo(cache_file=cache_file)
+    assert len(probes) == 2
+
+    nsbl_module.prime_sudo_probe_cache(True)
+    assert nsbl_module.can_passwordless_sudo()
+    assert len(probes) == 2
+
+
+def test_render_records_phase_timings():
+
+    nsbl = Nsbl.create(CONFIG, pre_chain=[])
+    target = InMemoryRenderTarget()
+
+    result = nsbl.render("/tmp/nsbl_env", ask_become_pass="false", render_target=target, write_timings=True)
+
+    phases = result["timings"]["phases"]
+    for phase in ["create", "tasks", "render", "env_template", "playbook", "dynamic_roles"]:
+        assert phases[phase] >= 0
+    assert sorted(set(span["env"] for span in result["timings"]["spans"] if span["name"] == "playbook")) == \
+        sorted(nsbl.plays.keys())
+    assert json.loads(target.read_file("timings.json").decode("utf-8"))["phases"] == phases
+
+
+def test_render_does_not_overwrite_existing_env_without_force(tmpdir):
+
+    nsbl = Nsbl.create(CONFIG, pre_chain=[])
+    env_dir = str(tmpdir.join("env"))
+    nsbl.render(env_dir, ask_become_pass="false")
+    tmpdir.join("env", "marker").write("old")
+
+    with pytest.raises(NsblException):
+        nsbl.render(env_dir, ask_become_pass="false")
+    assert tmpdir.join("env", "marker").check()
+
+    nsbl.render(env_dir, ask_become_pass="false", force=True)
+    assert not tmpdir.join("env", "marker").check()
+
+
+def test_plan_cache_skips_processing_for_unchanged_inputs(tmpdir, monkeypatch):
+
+    config_file = tmpdir.join("config.yml")
+    config_file.write(yaml.safe_dump(CONFIG))
+    plan_cache_dir = str(tmpdir.join("plans"))
+
+    first = Nsbl.create([str(config_file)], use_plan_cache=True, plan_cache_dir=plan_cache_dir)
+    assert len(os.listdir(plan_cache_dir)) == 1
+
+    def fail(self, *args, **kwargs):
+        raise AssertionError("config should not be processed again")
+
+    monkeypatch.setattr(Frkl, "process", fail)
+    cached = Nsbl.create([str(config_file)], use_plan_cache=True, plan_cache_dir=plan_cache_dir)
+    assert sorted(cached.plays.keys()) == sorted(first.plays.keys())
+    assert cached.get_play_chains() == first.get_play_chains()
+    assert "plan_cache" in cached.timer.get_phases()
+
+    monkeypatch.undo()
+    config_file.write(yaml.safe_dump([{"envs": CONFIG[0]["envs"][:1]}]))
+    changed = Nsbl.create([str(config_file)], use_plan_cache=True, plan_cache_dir=plan_cache_dir)
+    assert list(changed.plays.keys()) == ["group_1_0"]
+    assert len(os.listdir(plan_cache_dir)) == 2
+
+
+def test_identical_dynamic_roles_are_rendered_once():
+
+    config = [{"envs": CONFIG[0]["envs"] + [
+        {"meta": {"name": "host_5", "type": "host"},
+         "tasks": [{"file": {"path": "/tmp/5", "state": "directory"}}]}]}]
+    nsbl = Nsbl.create(config, pre_chain=[])
+    target = InMemoryRenderTarget()
+
+    nsbl.render("/tmp/nsbl_env", ask_become_pass="false", render_target=target)
+
+    dyn_roles = sorted(d.split("/")[2] for d in target.dirs if d.startswith("roles/dynamic/") and d.count("/") == 2)
+    assert len(dyn_roles) == 2
+    playbooks = dict((play, yaml.safe_load(target.read_file("plays/play_{}.yml".format(play)))[0]["roles"][0])
+                     for play in nsbl.plays.keys())
+    shell_roles = [role for play, role in playbooks.items() if not play.startswith("host_5")]
+    assert len(set(role["role"] for role in shell_roles)) == 1
+    assert sorted(role["{}_0000_free_form".format(role["role"])] for role in shell_roles) == \
+        ["echo 1", "echo 2", "echo 3", "echo 4"]
+    assert playbooks["host_5_4"]["role"] in dyn_roles
+
+
+def test_lookup_index_matches_lookup_dict():
+
+    nsbl = Nsbl.create(CONFIG, pre_chain=[])
+    index = nsbl.get_lookup_index()
+
+    assert index.records == LookupIndex.from_lookup_dict(nsbl.get_lookup_dict()).records
+    assert index.get_env_name(0) == "group_1"
+    role_ids = [role_id for env_id, role_id, task_id in index.records.keys() if env_id == 0 and role_id is not None]
+    assert index.get(0, role_ids[0])["role_type"] == "dyn_role"
+    task_ids = [task_id for env_id, role_id, task_id in index.records.keys() if task_id is not None]
+    assert len(task_ids) == len(CONFIG[0]["envs"])
+    assert LookupIndex.from_list(json.loads(json.dumps(index.to_list()))).records == index.records
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_output
+----------------------------------
+
+Tests for `nsbl.output` module.
+"""
+
+import io
+import json
+import time
+
+import pytest
+
+from nsbl.output import BufferedTerminalWriter, ClickStdOutput, MultiplexedDisplay, NsblLogCallbackAdapter, \
+    SpillingLineBuffer, decode_event, forward_log_messages, iter_line_batches
+
+
+class LineConsumer(object):
+
+    def __init__(self):
+        self.lines = []
+
+    def add_log_message(self, line):
+        self.lines.append(line)
+
+
+def test_line_batches_only_contain_complete_lines(tmpdir):
+
+    path = str(tmpdir.join("output"))
+    with open(path, "wb") as f:
+        f.write(b'{"category": "ok"}\n' * 5 + b'{"category": "fail')
+
+    with io.open(path, "rb") as stream:
+        batches = list(iter_line_batches(stream, chunk_size=24))
+
+    lines = [line for batch in batches for line in batch]
+    assert len(batches) > 1
+    assert lines[:5] == [b'{"category": "ok"}\n'] * 5
+    assert lines[5] == b'{"category": "fail'
+
+    consumer = LineConsumer()
+    for batch in batches:
+        forward_log_messages(consumer, batch)
+    assert consumer.lines == lines
+
+
+def test_decode_event():
+
+    event = {"category": "ok", "stdout_lines": ["a", u"ä"]}
+    assert decode_event(json.dumps(event)) == event
+    with pytest.raises(ValueError):
+        decode_event(b'{"category": "fail')
+
+
+def test_buffered_writer_merges_writes():
+
+    stream = io.StringIO()
+    writer = BufferedTerminalWriter(file=stream, refresh_interval=60)
+    output = ClickStdOutput(writer=writer)
+
+    output.start_env("localhost")
+    output.print_task_string(u"   - task => ")
+    assert stream.getvalue() == u"* starting tasks (on 'localhost')...\n"
+
+    output.echo(u"ok (changed)")
+    output.echo(b"done", nl=False)
+    assert stream.getvalue() == u"* starting tasks (on 'localhost')...\n"
+    output.flush()
+    assert stream.getvalue() == u"* starting tasks (on 'localhost')...\n   - task => ok (changed)\ndone"
+
+    writer.refresh_interval = 0.05
+    output.echo(u"   - next => ", nl=False)
+    time.sleep(0.5)
+    assert stream.getvalue().endswith(u"done   - next => ")
+
+
+def test_spilling_line_buffer_keeps_memory_bounded():
+
+    buffer = SpillingLineBuffer(max_size=10)
+    lines = [u"line {}".format(i) for i in range(100)] + [u"ä"]
+    buffer.extend(lines[:50])
+    assert buffer.spill_file is not None
+    assert buffer.size <= 10
+    assert list(buffer) == lines[:50]
+
+    buffer.extend(lines[50:])
+    assert len(buffer) == 101
+    assert list(buffer) == lines
+    buffer.close()
+    assert not buffer
+
+
+def test_failed_role_displays_spilled_output():
+
+    lookup_dict = {0: {"name": "localhost", "tasks": {0: {"name": "compile", "role_type": "dyn_role", "tasks": {}}}}}
+    stream = io.StringIO()
+    adapter = NsblLogCallbackAdapter(lookup_dict, max_output_size=20)
+    adapter.output.writer = BufferedTerminalWriter(file=stream)
+    stdout = ["output line {}".format(i) for i in range(50)]
+    for i in range(0, 50, 10):
+        adapter.add_log_message(json.dumps({"category": "ok", "_env_id": 0, "_role_id": 0, "name": "make",
+                                            "stdout_lines": stdout[i:i + 10]}))
+    assert adapter.stdouts.size <= 20
+    adapter.add_log_message(json.dumps({"category": "failed", "_env_id": 0, "_role_id": 0, "name": "make",
+                                        "msg": "error"}))
+    adapter.finish_up()
+
+    output = stream.getvalue()
+    assert u"failed: error" in output
+    assert all(u"-> {}".format(line) in output for line in stdout)
+
+
+def test_multiplexed_display_keeps_env_output_together():
+
+    lookup_dict = {0: {"name": "host_1", "tasks": {0: {"name": "role_a", "role_type": "dyn_role", "tasks": {}}}},
+                   1: {"name": "host_2", "tasks": {1: {"name": "role_b", "role_type": "dyn_role", "tasks": {}}}}}
+    stream = io.StringIO()
+    display = MultiplexedDisplay(lookup_dict, file=stream, live=True, refresh_interval=60)
+    first = display.add_env("play_1", 0)
+    second = display.add_env("play_2", 1)
+
+    for env_id, adapter in [(0, first), (1, second)]:
+        adapter.add_log_message(json.dumps({"category": "play_start"}))
+    for env_id, adapter in [(0, first), (1, second)]:
+        adapter.add_log_message(json.dumps({"category": "ok", "_env_id": env_id, "_role_id": env_id,
+                                            "name": "task_{}".format(env_id), "status": "changed",
+                                            "skipped": False}))
+
+    display.render()
+    status = stream.getvalue()
+    assert status.count(u"\n") == 2
+    assert u"host_1: - task_0 =>" in status
+    assert u"host_2: - task_1 =>" in status
+
+    second.finish_up()
+    display.finish_env("play_2")
+    display.render()
+    output = stream.getvalue()[len(status):]
+    assert output.startswith(u"\u001b[2A\r\u001b[J* starting tasks (on 'host_2')...")
+    assert u"host_1" not in output.split(u"\n")[0]
+    assert output.endswith(u"host_1: - task_0 =>\n")
+
+    first.finish_up()
+    display.finish_env("play_1")
+    display.close()
+    output = stream.getvalue()
+    assert output.endswith(u"   => ok (changed)\n")
+    assert u"* starting tasks (on 'host_1')..." in output
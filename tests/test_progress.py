@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_progress
+----------------------------------
+
+Tests for `nsbl.progress` module.
+"""
+
+import io
+import json
+
+import pytest
+
+from nsbl.exceptions import NsblException
+from nsbl.nsbl import Nsbl, NsblRunner
+from nsbl.progress import JsonlProgressSink
+
+from .test_metrics import LOOKUP_DICT
+
+
+def test_jsonl_progress_records():
+
+    stream = io.StringIO()
+    sink = JsonlProgressSink(LOOKUP_DICT, progress_file=stream)
+    events = [
+        (0, {"category": "play_start"}),
+        (1, {"category": "ok", "_env_id": 0, "_role_id": 0, "_dyn_task_id": "dyn_role_0_0000", "name": "apt"}),
+        (1, {"category": "nsbl_item_started", "item": "git"}),
+        (3, {"category": "nsbl_item_ok", "item": "git", "status": "changed"}),
+        (4, {"category": "failed", "_env_id": 0, "_role_id": 1, "name": "file", "msg": "denied"}),
+    ]
+    for timestamp, event in events:
+        sink.process_lines(timestamp, [json.dumps(event)])
+    sink.process_error(5, b"some error\n")
+    sink.close(6)
+
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [r["type"] for r in records] == ["item", "task", "role", "error", "task", "role", "env", "run"]
+
+    item = records[0]
+    assert item["item"] == "git"
+    assert item["task"] == "installing git"
+    assert item["role"] == "install-pkgs"
+    assert item["env"] == "localhost"
+    assert item["status"] == "changed"
+    assert item["duration"] == 2
+
+    assert records[2]["status"] == "changed"
+    assert records[3]["message"] == "some error"
+    assert records[4]["task"] == "file"
+    assert records[4]["status"] == "failed"
+    assert records[6]["status"] == "failed"
+    assert records[6]["duration"] == 6
+    assert records[7]["status"] == "failed"
+
+
+def test_jsonl_progress_without_durations():
+
+    stream = io.StringIO()
+    sink = JsonlProgressSink(LOOKUP_DICT, progress_file=stream, durations=False)
+    sink.process_lines(0, [json.dumps({"category": "play_start"})])
+    sink.process_lines(3, [json.dumps({"category": "ok", "_env_id": 0, "_role_id": 0, "name": "apt"})])
+    sink.close(6)
+
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [r["type"] for r in records] == ["task", "role", "env", "run"]
+    assert [r["duration"] for r in records[:3]] == [None, None, None]
+
+
+def test_jsonl_progress_needs_nsbl_callback():
+
+    nsbl = Nsbl.create([], pre_chain=[])
+    with pytest.raises(NsblException):
+        NsblRunner(nsbl).run("/tmp/nsbl_env", callback="default", progress_format="jsonl")
+    with pytest.raises(NsblException):
+        NsblRunner(nsbl).run("/tmp/nsbl_env", progress_format="xml")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_render_targets
+----------------------------------
+
+Tests for `nsbl.render_targets` module.
+"""
+
+import io
+import json
+import os
+import stat
+import tarfile
+from multiprocessing.pool import ThreadPool
+
+from cookiecutter.main import cookiecutter
+
+from nsbl.render_targets import FileSystemRenderTarget, InMemoryRenderTarget, TarballRenderTarget
+
+
+def _create_template(tmpdir):
+
+    template = tmpdir.mkdir("template")
+    template.join("cookiecutter.json").write(json.dumps({"env_dir": "env", "greeting": "hello"}))
+    project = template.mkdir("{{cookiecutter.env_dir}}")
+    project.mkdir("plays").join("{{cookiecutter.greeting}}.yml").write("- {{ cookiecutter.greeting }}\n")
+    script = project.join("run.sh")
+    script.write("#!/bin/sh\necho {{ cookiecutter.greeting }}\n")
+    script.chmod(0o755)
+
+    return str(template)
+
+
+def _read_tree(env_dir):
+
+    result = {}
+    for root, dirs, files in os.walk(env_dir):
+        for f in files:
+            path = os.path.join(root, f)
+            with open(path, "rb") as input_file:
+                result[os.path.relpath(path, env_dir)] = (input_file.read(), stat.S_IMODE(os.stat(path).st_mode))
+    return result
+
+
+def test_in_memory_target_renders_same_files_as_cookiecutter(tmpdir):
+
+    template = _create_template(tmpdir)
+    env_dir = str(tmpdir.join("env"))
+    context = {"env_dir": env_dir, "greeting": "hi"}
+
+    cookiecutter(template, extra_context=context, no_input=True, output_dir=str(tmpdir))
+    target = InMemoryRenderTarget()
+    target.open(env_dir)
+    target.render_template(template, context, str(tmpdir))
+
+    on_disk = _read_tree(env_dir)
+    assert sorted(on_disk.keys()) == ["plays/hi.yml", "run.sh"]
+    assert dict((k, (v, target.modes[k])) for k, v in target.files.items()) == on_disk
+    assert target.read_file("plays/hi.yml") == b"- hi\n"
+
+
+def test_file_system_target_renders_in_threads_without_chdir(tmpdir):
+
+    template = _create_template(tmpdir)
+    cookiecutter(template, extra_context={"env_dir": str(tmpdir.join("reference"))}, no_input=True,
+                 output_dir=str(tmpdir))
+    cwd = os.getcwd()
+
+    def render(index):
+        env_dir = str(tmpdir.join("env_{}".format(index)))
+        FileSystemRenderTarget().render_template(template, {"env_dir": env_dir}, str(tmpdir))
+        return _read_tree(env_dir)
+
+    pool = ThreadPool(4)
+    try:
+        results = pool.map(render, range(8))
+    finally:
+        pool.close()
+
+    assert os.getcwd() == cwd
+    assert all(result == _read_tree(str(tmpdir.join("reference"))) for result in results)
+
+
+def test_tarball_target_streams_archive(tmpdir):
+
+    class Stream(object):
+        """Write-only, non-seekable file object."""
+
+        def __init__(self):
+            self.data = b""
+
+        def write(self, data):
+            self.data += data
+
+    stream = Stream()
+    target = TarballRenderTarget(stream)
+    target.open("/virtual/env")
+    target.write_file("/virtual/env/plays/all_plays.yml", u"- play\n")
+    target.write_file("/virtual/env/run.sh", b"#!/bin/sh\n", mode=0o755)
+    target.close()
+
+    assert not os.path.exists("/virtual")
+    archive = tarfile.open(fileobj=io.BytesIO(stream.data))
+    assert archive.getnames() == ["env", "env/plays", "env/plays/all_plays.yml", "env/run.sh"]
+    assert archive.extractfile("env/plays/all_plays.yml").read() == b"- play\n"
+    assert archive.getmember("env/run.sh").mode == 0o755